@@ -22,6 +22,9 @@ from django.contrib.admin.models import LogEntry
 from django.contrib import messages
 from django import forms
 from .utils import test_payment_connection
+from .search import is_full_text_search_available, search_products
+from .cache import get_cache_stats
+from .cache_metrics import collect_cache_metrics, summarize_cache_metrics
 
 
 
@@ -79,6 +82,7 @@ class AdminDashboard(admin.AdminSite):
         urls = super().get_urls()
         custom_urls = [
             path('statistics/', self.admin_view(self.statistics_view), name='statistics'),
+            path('statistics/cache/', self.admin_view(self.cache_statistics_view), name='cache_statistics'),
         ]
         return custom_urls + urls
 
@@ -195,6 +199,21 @@ class AdminDashboard(admin.AdminSite):
 
         return TemplateResponse(request, 'admin/statistics.html', context)
 
+    def cache_statistics_view(self, request):
+        if getattr(request, 'user_role', '') not in ['ADMIN', 'STAFF']:
+            return self.no_permission(request)
+
+        metrics = collect_cache_metrics()
+        context = self.each_context(request)
+        context.update({
+            'title': 'Статистика кэша',
+            'processes': metrics['processes'],
+            'families': summarize_cache_metrics(metrics['families']),
+            # Общие счетчики Redis (пусто для других бэкендов)
+            'redis_stats': get_cache_stats(),
+        })
+        return TemplateResponse(request, 'admin/cache_statistics.html', context)
+
     def get_app_list(self, request, app_label=None):
         from django.urls import NoReverseMatch
 
@@ -237,6 +256,7 @@ class AdminDashboard(admin.AdminSite):
                 'app_label': 'analytics',
                 'models': [
                     {'name': 'Статистика', 'admin_url': reverse('myadmin:statistics')},
+                    {'name': 'Кэш', 'admin_url': reverse('myadmin:cache_statistics')},
                 ]
             },
         ]
@@ -302,6 +322,12 @@ class DashboardProductAdmin(RoleBasedAdmin):
     search_fields = ('name', 'description')
     prepopulated_fields = {'slug': ('name',)}
 
+    def get_search_results(self, request, queryset, search_term):
+        # В PostgreSQL ищем по search_vector (GIN) вместо ILIKE '%q%'
+        if search_term and is_full_text_search_available():
+            return search_products(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
     def has_add_permission(self, request):
         if not request.user.is_authenticated:
             return False
@@ -498,14 +524,12 @@ class DashboardOrderAdmin(admin.ModelAdmin):
     def create_ttn_action(self, request, queryset):
         from .views import create_ttn
 
-        settings_qs = NovaPoshtaSettings.objects.filter(is_active=True)
+        settings = NovaPoshtaSettings.get_active()
 
-        if settings_qs.count() != 1:
-            self.message_user(request, "Настройки Новой Почты не найдены или их несколько", level=messages.ERROR)
+        if not settings:
+            self.message_user(request, "Настройки Новой Почты не найдены", level=messages.ERROR)
             return
 
-        settings = settings_qs.get()
-
         if not settings.auto_create_ttn:
             self.message_user(request, "Автосоздание ТТН отключено в настройках", level=messages.WARNING)
             return
@@ -668,13 +692,19 @@ class CartAdmin(admin.ModelAdmin):
     readonly_fields = ('total_price', 'items_count')
     raw_id_fields = ('user',)
 
+    def get_queryset(self, request):
+        # Суммы и количества считаются в запросе списка, а не по строке
+        return super().get_queryset(request).select_related('user').with_totals()
+
     def items_count(self, obj):
-        return obj.items.count()
+        return obj.lines_count
     items_count.short_description = 'Количество товаров'
+    items_count.admin_order_field = 'annotated_lines_count'
 
     def total_price(self, obj):
-        return sum(item.total_price for item in obj.items.all())
+        return obj.total_price
     total_price.short_description = 'Общая сумма'
+    total_price.admin_order_field = 'annotated_total_price'
 
 @admin.register(CartItem, site=admin_site)
 class CartItemAdmin(admin.ModelAdmin):
@@ -726,11 +756,11 @@ class PaymentSettingsForm(forms.ModelForm):
         instance = kwargs.get('instance')  # Получаем до super
         super().__init__(*args, **kwargs)
         if instance:
-            if instance.api_key:
+            if instance._api_key:
                 self.fields['api_key'].widget.attrs['placeholder'] = '**********'
-            if instance.secret_key:
+            if instance._secret_key:
                 self.fields['secret_key'].widget.attrs['placeholder'] = '**********'
-            if instance.webhook_secret:
+            if instance._webhook_secret:
                 self.fields['webhook_secret'].widget.attrs['placeholder'] = '**********'
 
     def save(self, commit=True):
@@ -0,0 +1,166 @@
+"""
+Автодополнение названий товаров: префиксное дерево в памяти процесса + pg_trgm
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+
+from .models import Product
+
+# Сколько самых продаваемых товаров держим в дереве каждого процесса
+AUTOCOMPLETE_INDEX_SIZE = getattr(settings, 'PRODUCT_AUTOCOMPLETE_INDEX_SIZE', 5000)
+# Не дольше этого дерево живет без перестроения (секунды)
+AUTOCOMPLETE_INDEX_TTL = getattr(settings, 'PRODUCT_AUTOCOMPLETE_INDEX_TTL', 300)
+# Максимум подсказок на запрос (столько храним в каждом узле дерева)
+AUTOCOMPLETE_MAX_RESULTS = 10
+# Версия дерева в общем кэше: изменение товара в одном процессе сбрасывает деревья во всех
+AUTOCOMPLETE_VERSION_KEY = 'products:autocomplete:version'
+
+
+def is_trigram_search_available():
+    """
+    pg_trgm есть только в PostgreSQL (в тестах на SQLite — поиск через ILIKE)
+    """
+    return connection.vendor == 'postgresql'
+
+
+class _TrieNode:
+    __slots__ = ('children', 'entries')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = []
+
+
+class ProductNameTrie:
+    """
+    Префиксное дерево по словам названий товаров.
+    Товары вставляются по убыванию популярности, и каждый узел хранит
+    первые max_results из них — поиск по префиксу не обходит поддерево
+    """
+
+    def __init__(self, max_results=AUTOCOMPLETE_MAX_RESULTS):
+        self.max_results = max_results
+        self.root = _TrieNode()
+
+    def insert(self, entry):
+        words = entry['name'].lower().split()
+        # Ключи — название с каждого слова: "iphone 1" найдет "Apple iPhone 15"
+        for i in range(len(words)):
+            node = self.root
+            for char in ' '.join(words[i:]):
+                node = node.children.setdefault(char, _TrieNode())
+                if len(node.entries) < self.max_results and entry not in node.entries:
+                    node.entries.append(entry)
+
+    def lookup(self, prefix, limit):
+        node = self.root
+        for char in ' '.join(prefix.lower().split()):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.entries[:limit]
+
+
+class AutocompleteIndex:
+    """
+    Дерево популярных названий в памяти процесса.
+    Перестраивается лениво: после изменения товаров (сигналы) или по TTL
+    """
+
+    def __init__(self, size=AUTOCOMPLETE_INDEX_SIZE, ttl=AUTOCOMPLETE_INDEX_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._trie = None
+        self._version = None
+        self._built_at = 0
+        # True, если в дерево попал весь каталог и в БД искать больше нечего
+        self.complete = False
+
+    def invalidate(self):
+        self._trie = None
+
+    def get_trie(self):
+        version = cache.get(AUTOCOMPLETE_VERSION_KEY)
+        trie = self._trie
+        if trie is not None and version == self._version and time.monotonic() - self._built_at < self.ttl:
+            return trie
+
+        with self._lock:
+            if self._trie is trie:
+                self._build(version)
+            return self._trie
+
+    def _build(self, version):
+        products = list(
+            Product.objects.filter(available=True)
+            .annotate(order_count=Count('orderitem'))
+            .order_by('-order_count', 'name', 'id')
+            .values('id', 'name', 'slug')[:self.size + 1]
+        )
+        trie = ProductNameTrie()
+        for entry in products[:self.size]:
+            trie.insert(entry)
+
+        self.complete = len(products) <= self.size
+        self._version = version
+        self._built_at = time.monotonic()
+        self._trie = trie
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+def invalidate_autocomplete_index():
+    """
+    Сбрасывает дерево в этом процессе и меняет версию для остальных
+    """
+    autocomplete_index.invalidate()
+    try:
+        cache.incr(AUTOCOMPLETE_VERSION_KEY)
+    except ValueError:
+        cache.set(AUTOCOMPLETE_VERSION_KEY, 1, None)
+
+
+def query_product_names(queryset, prefix, limit):
+    """
+    Подсказки из БД: на PostgreSQL с учетом опечаток (pg_trgm, GIN-индекс по name)
+    """
+    if not is_trigram_search_available():
+        return list(queryset.filter(name__icontains=prefix).order_by('name', 'id').values('id', 'name', 'slug')[:limit])
+
+    return list(
+        queryset.filter(Q(name__icontains=prefix) | Q(name__trigram_word_similar=prefix))
+        .annotate(similarity=TrigramWordSimilarity(prefix, 'name'))
+        .order_by('-similarity', 'name', 'id')
+        .values('id', 'name', 'slug')[:limit]
+    )
+
+
+def autocomplete_products(queryset, prefix, limit=AUTOCOMPLETE_MAX_RESULTS):
+    """
+    Подсказки по префиксу названия: сначала дерево в памяти,
+    в БД — только если дерево не набрало limit подсказок (опечатка или непопулярный товар)
+    """
+    prefix = ' '.join((prefix or '').split())
+    if not prefix:
+        return []
+
+    limit = min(limit, AUTOCOMPLETE_MAX_RESULTS)
+    results = autocomplete_index.get_trie().lookup(prefix, limit)
+    if len(results) >= limit or (results and autocomplete_index.complete):
+        return results
+
+    seen = {entry['id'] for entry in results}
+    for entry in query_product_names(queryset, prefix, limit):
+        if len(results) >= limit:
+            break
+        if entry['id'] not in seen:
+            results.append(entry)
+    return results
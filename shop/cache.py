@@ -1,30 +1,84 @@
 """
 Кэширование для приложения shop
 """
+import copy
 import json
 import hashlib
+import math
+import pickle
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import wraps
 from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 import logging
 
+from .cache_metrics import cache_family, cache_metrics, payload_size
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 logger = logging.getLogger(__name__)
 
 # Время жизни кэша по умолчанию
 DEFAULT_CACHE_TIMEOUT = 3600  # 1 час
 
+# Сколько живет блокировка пересборки ключа (если воркер упал, не успев записать)
+REBUILD_LOCK_TIMEOUT = 30
+
+# Сколько ждать чужую пересборку ключа без предыдущего поколения (секунды)
+REBUILD_LOCK_WAIT = getattr(settings, 'CACHE_REBUILD_LOCK_WAIT', 1.0)
+REBUILD_LOCK_POLL_INTERVAL = 0.05
+
+# XFetch: чем больше, тем раньше до истечения начинается пересчет горячих ключей
+XFETCH_BETA = getattr(settings, 'CACHE_XFETCH_BETA', 1.0)
+
+# Значения больше этого размера (байт) сжимаются кодеком
+CACHE_COMPRESS_THRESHOLD = getattr(settings, 'CACHE_COMPRESS_THRESHOLD', 16 * 1024)
+
+# Локальный (в памяти процесса) уровень перед общим кэшем
+LOCAL_CACHE_MAXSIZE = getattr(settings, 'LOCAL_CACHE_MAXSIZE', 256)
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'LOCAL_CACHE_TIMEOUT', 60)
+
 # Ключи кэша
 CACHE_KEYS = {
-    'products': 'products:list',
+    'catalog_version': 'catalog:version',
+    'products': 'products:list:v{version}',
     'categories': 'categories:list',
+    'category_detail': 'category:detail:{slug}',
     'product_detail': 'product:detail:{id}',
     'user_orders': 'user:orders:{user_id}',
     'nova_poshta_cities': 'nova_poshta:cities:{search}',
     'nova_poshta_warehouses': 'nova_poshta:warehouses:{city_ref}',
     'payment_settings': 'payment:settings:{system}',
+    'payment_methods': 'payment:methods',
     'order_stats': 'order:stats:{date}',
     'user_cart': 'user:cart:{user_id}',
+    'cart_count': 'user:cart_count:{user_id}',
+    'cart_items': 'cart:items:{cart_id}',
+    'cart_dirty': 'cart:dirty',
+    'cart_lock': 'cart:lock:{cart_id}',
+    'guest_cart': 'cart:guest:{token}',
+    'catalog_state': 'catalog:state:{model}',
+    'catalog_changed': 'catalog:changed:{model}',
+    'tag': 'tag:{tag}',
 }
 
 
@@ -50,29 +104,508 @@ def cache_key_generator(prefix, *args, **kwargs):
     return key_string
 
 
-def cache_products_list(products, timeout=DEFAULT_CACHE_TIMEOUT):
+def get_catalog_version():
+    """
+    Текущее поколение каталога: входит в ключи списков товаров
+    """
+    key = CACHE_KEYS['catalog_version']
+    version = cache.get(key)
+    if version is None:
+        # Начинаем с метки времени: если счетчик вытеснен из кэша,
+        # новое поколение не совпадет ни с одним из старых
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key, int(time.time() * 1000))
+    return version
+
+
+def bump_catalog_version():
+    """
+    Новое поколение каталога: старые списки больше не читаются и истекают по TTL
+    """
+    key = CACHE_KEYS['catalog_version']
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        version = get_catalog_version()
+    logger.info(f"Catalog version bumped to {version}")
+    return version
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class PickleCodec:
+    """
+    Pickle — то же, что делает кэш Django по умолчанию
+    """
+    name = 'pickle'
+
+    def encode(self, value):
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class BytesCodec:
+    """
+    Готовые байты (например, отрендеренный JSON ответа) — без преобразования
+    """
+    name = 'raw'
+
+    def encode(self, value):
+        return bytes(value)
+
+    def decode(self, data):
+        return data
+
+
+class JSONCodec:
+    """
+    JSON для ответов API (orjson, если установлен). Decimal сохраняется строкой,
+    datetime — в ISO 8601, как их и так отдает DRF
+    """
+    name = 'json'
+
+    def encode(self, value):
+        if orjson is not None:
+            return orjson.dumps(value, default=_json_default)
+        return json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def decode(self, data):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+class CompressedCodec:
+    """
+    Сжатие поверх другого кодека для значений больше threshold байт:
+    zstd, если установлен, иначе zlib. Первый байт — способ сжатия
+    """
+    RAW, ZLIB, ZSTD = b'\x00', b'\x01', b'\x02'
+
+    def __init__(self, codec, threshold=CACHE_COMPRESS_THRESHOLD):
+        self.codec = codec
+        self.threshold = threshold
+        self.name = f"{codec.name}+compressed"
+
+    def encode(self, value):
+        data = self.codec.encode(value)
+        if len(data) < self.threshold:
+            return self.RAW + data
+        if zstandard is not None:
+            return self.ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+        return self.ZLIB + zlib.compress(data, 1)
+
+    def decode(self, data):
+        marker, data = data[:1], data[1:]
+        if marker == self.ZSTD:
+            data = zstandard.ZstdDecompressor().decompress(data)
+        elif marker == self.ZLIB:
+            data = zlib.decompress(data)
+        return self.codec.decode(data)
+
+
+CACHE_CODECS = {
+    codec.name: codec
+    for codec in (
+        PickleCodec(),
+        JSONCodec(),
+        BytesCodec(),
+        CompressedCodec(PickleCodec()),
+        CompressedCodec(JSONCodec()),
+        CompressedCodec(BytesCodec()),
+    )
+}
+
+# Кодек для кэшированных ответов API (списки и карточки товаров)
+API_CACHE_CODEC = CACHE_CODECS[getattr(settings, 'CACHE_API_CODEC', 'json+compressed')]
+# Кодек для уже отрендеренных ответов API (байты JSON)
+RENDERED_CACHE_CODEC = CACHE_CODECS['raw+compressed']
+
+
+def api_codec_for(value):
+    """
+    Кодек для значения ответа API: байты хранятся как есть, данные — через API_CACHE_CODEC
+    """
+    return RENDERED_CACHE_CODEC if isinstance(value, bytes) else API_CACHE_CODEC
+
+
+def _xfetch_entry(value, timeout, compute_time=0, codec=None):
+    entry = {'value': value, 'delta': compute_time, 'expiry': time.time() + timeout}
+    if codec is not None:
+        entry.update(value=codec.encode(value), codec=codec.name)
+    return entry
+
+
+def xfetch_set(key, value, timeout, compute_time=0, codec=None):
+    """
+    Сохранение значения вместе со временем его вычисления и моментом истечения (для XFetch).
+    С codec значение хранится закодированными байтами
+    """
+    started = time.perf_counter()
+    entry = _xfetch_entry(value, timeout, compute_time, codec)
+    cache.set(key, entry, timeout)
+    cache_metrics.record_set(cache_family(key), time.perf_counter() - started, payload_size(entry['value']))
+
+
+def _is_xfetch_entry(entry):
+    """
+    Запись в формате xfetch_set. Значения, сохраненные до XFetch под теми же
+    ключами (голые данные), считаются промахом и перезаписываются пересборкой
+    """
+    return isinstance(entry, dict) and {'value', 'delta', 'expiry'} <= entry.keys()
+
+
+def _entry_value(entry):
+    codec = entry.get('codec')
+    if codec is None:
+        return entry['value']
+    return CACHE_CODECS[codec].decode(entry['value'])
+
+
+def xfetch_should_recompute(entry, beta=XFETCH_BETA):
+    """
+    Вероятностное досрочное истечение (XFetch): вероятность пересчета растет
+    по мере приближения к expiry и тем раньше, чем дороже вычисление
+    """
+    return time.time() - entry['delta'] * beta * math.log(1.0 - random.random()) >= entry['expiry']
+
+
+class LocalLRUCache:
+    """
+    Ограниченный по размеру и времени жизни LRU-кэш в памяти процесса.
+    Каждое значение помечено поколением каталога: после изменения каталога
+    в любом процессе (bump_catalog_version) старые записи перестают читаться
+    """
+
+    def __init__(self, maxsize=LOCAL_CACHE_MAXSIZE, timeout=LOCAL_CACHE_TIMEOUT):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, entry_version, expires_at = entry
+            if entry_version != version or time.monotonic() >= expires_at:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, version):
+        with self._lock:
+            self._data[key] = (value, version, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalLRUCache()
+
+
+class LocalSettingsCache:
+    """
+    Запись настроек-синглтона в памяти процесса на SETTINGS_CACHE_TIMEOUT секунд.
+    Сохранение настроек сбрасывает копию в этом процессе (сигналы),
+    остальные процессы перечитают ее по истечении TTL.
+    Каждый вызов get() получает свою копию: объект общий для всех потоков,
+    и изменение полей в одном запросе не должно быть видно остальным
+    """
+    _MISSING = object()
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._value = self._MISSING
+        self._expires_at = 0
+        self._generation = 0
+
+    def get(self):
+        value = self._value
+        if value is not self._MISSING and time.monotonic() < self._expires_at:
+            return copy.copy(value)
+
+        with self._lock:
+            generation = self._generation
+        value = self.loader()
+        timeout = getattr(settings, 'SETTINGS_CACHE_TIMEOUT', 60)
+        with self._lock:
+            # Настройки могли измениться, пока шла загрузка — тогда не запоминаем
+            if timeout and generation == self._generation:
+                self._value = value
+                self._expires_at = time.monotonic() + timeout
+        return copy.copy(value)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._value = self._MISSING
+
+
+def _cache_get(key):
+    """
+    cache.get с учетом в метриках семейства ключа
+    """
+    started = time.perf_counter()
+    value = cache.get(key)
+    cache_metrics.record_get(cache_family(key), time.perf_counter() - started, 'misses' if value is None else 'hits')
+    return value
+
+
+def _cache_set(key, value, timeout, family=None):
+    """
+    cache.set с учетом в метриках семейства ключа
+    """
+    started = time.perf_counter()
+    cache.set(key, value, timeout)
+    cache_metrics.record_set(family or cache_family(key), time.perf_counter() - started, payload_size(value))
+
+
+# KEYS: ключ блокировки. ARGV: токен владельца. Удаляет блокировку, только если она наша
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Токены блокировок пересборки, взятых get_or_lock в этом потоке: {ключ: токен}
+_held_locks = threading.local()
+
+
+def _lock_tokens():
+    tokens = getattr(_held_locks, 'tokens', None)
+    if tokens is None:
+        tokens = _held_locks.tokens = {}
+    return tokens
+
+
+def _acquire_rebuild_lock(key):
+    """
+    Блокировка пересборки key с уникальным токеном владельца.
+    Возвращает токен или None, если блокировка уже занята
+    """
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    redis_client = _get_redis_client()
+    if redis_client is not None:
+        # Напрямую в Redis: значение должно остаться строкой для сравнения в RELEASE_LOCK_SCRIPT
+        acquired = redis_client.set(cache.make_key(lock_key), token, nx=True, ex=REBUILD_LOCK_TIMEOUT)
+    else:
+        acquired = cache.add(lock_key, token, REBUILD_LOCK_TIMEOUT)
+    return token if acquired else None
+
+
+def _release_rebuild_lock(key, token):
+    """
+    Снимает блокировку, только если она все еще принадлежит token: если пересборка
+    шла дольше REBUILD_LOCK_TIMEOUT и блокировку взял другой воркер, ее не трогаем
+    """
+    lock_key = f"{key}:lock"
+    redis_client = _get_redis_client()
+    if redis_client is not None:
+        return bool(redis_client.eval(RELEASE_LOCK_SCRIPT, 1, cache.make_key(lock_key), token))
+    # Без Redis сравнение и удаление не атомарны — LocMem и так живет в одном процессе
+    if cache.get(lock_key) != token:
+        return False
+    cache.delete(lock_key)
+    return True
+
+
+def _rebuild_lock_held(key):
+    lock_key = f"{key}:lock"
+    redis_client = _get_redis_client()
+    if redis_client is not None:
+        return bool(redis_client.exists(cache.make_key(lock_key)))
+    return cache.get(lock_key) is not None
+
+
+def _take_rebuild_lock(key):
+    token = _acquire_rebuild_lock(key)
+    if token is None:
+        return False
+    _lock_tokens()[key] = token
+    return True
+
+
+def _wait_for_rebuild(key, wait=REBUILD_LOCK_WAIT):
+    """
+    Ждет, пока владелец блокировки запишет key. None, если не дождались
+    или блокировку сняли без значения (пересборка упала)
+    """
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(REBUILD_LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if _is_xfetch_entry(entry):
+            return entry
+        if not _rebuild_lock_held(key):
+            return None
+    return None
+
+
+@contextmanager
+def release_rebuild_locks():
+    """
+    Снимает блокировки, которые get_or_lock выдал этому потоку внутри блока,
+    если пересборка не дошла до set_and_unlock (404, ошибка фильтра и т.п.).
+    Работает и как декоратор
+    """
+    held = dict(_lock_tokens())
+    try:
+        yield
+    finally:
+        tokens = _lock_tokens()
+        for key in [key for key, token in tokens.items() if held.get(key) != token]:
+            _release_rebuild_lock(key, tokens.pop(key))
+
+
+def get_or_lock(key, fallback_key=None, local_version=None):
+    """
+    Получение значения с защитой от одновременной пересборки.
+    При промахе (или досрочном пересчете XFetch) блокировку получает только один
+    воркер (ему возвращается None), остальные получают текущее значение или,
+    если его нет, значение fallback_key — предыдущее поколение. Без fallback_key
+    остальные недолго ждут значение от владельца блокировки.
+    С local_version сначала проверяется локальный кэш процесса.
+    Пересборку нужно вести внутри release_rebuild_locks()
+    """
+    family = cache_family(key)
+    started = time.perf_counter()
+    if local_version is not None:
+        value = local_cache.get(key, local_version)
+        if value is not None:
+            cache_metrics.record_get(family, time.perf_counter() - started, 'local_hits')
+            return value
+
+    entry = cache.get(key)
+    if _is_xfetch_entry(entry):
+        if xfetch_should_recompute(entry) and _take_rebuild_lock(key):
+            logger.debug(f"Early recompute for key: {key}")
+            cache_metrics.record_get(family, time.perf_counter() - started, 'misses')
+            return None
+    elif _take_rebuild_lock(key):
+        cache_metrics.record_get(family, time.perf_counter() - started, 'misses')
+        return None
+    elif fallback_key is not None:
+        fallback = cache.get(fallback_key)
+        if not _is_xfetch_entry(fallback):
+            cache_metrics.record_get(family, time.perf_counter() - started, 'misses')
+            return None
+        cache_metrics.record_get(family, time.perf_counter() - started, 'stale_hits')
+        return _entry_value(fallback)
+    else:
+        # Предыдущего поколения нет (карточка, категория) — ждем пересборку владельца
+        entry = _wait_for_rebuild(key)
+        if entry is None:
+            cache_metrics.record_get(family, time.perf_counter() - started, 'misses')
+            return None
+
+    value = _entry_value(entry)
+    if local_version is not None:
+        local_cache.set(key, value, local_version)
+    cache_metrics.record_get(family, time.perf_counter() - started, 'hits')
+    return value
+
+
+def set_and_unlock(key, value, timeout, compute_time=0, local_version=None, codec=None):
+    """
+    Сохранение пересобранного значения и снятие блокировки get_or_lock
+    (если ее брал этот поток и она еще не перешла к другому воркеру)
+    """
+    xfetch_set(key, value, timeout, compute_time, codec)
+    token = _lock_tokens().pop(key, None)
+    if token is not None:
+        _release_rebuild_lock(key, token)
+    if local_version is not None:
+        local_cache.set(key, value, local_version)
+
+
+def get_missing_keys(keys):
+    """
+    Ключи из keys, которых нет в кэше или которые лежат в старом формате (одним get_many)
+    """
+    found = cache.get_many(keys)
+    return [key for key in keys if not _is_xfetch_entry(found.get(key))]
+
+
+def products_list_key(version, params=None):
+    """
+    Ключ списка товаров (или страницы/выборки с params) для поколения каталога
+    """
+    prefix = CACHE_KEYS['products'].format(version=version)
+    if not params:
+        return prefix
+    return cache_key_generator(prefix, **params)
+
+
+def cache_products_list(products, timeout=DEFAULT_CACHE_TIMEOUT, version=None, compute_time=0):
     """
-    Кэширование списка товаров
+    Кэширование списка товаров.
+    version — поколение, прочитанное до запроса к БД: если каталог успел
+    измениться, список ляжет в старое поколение и не будет отдан как актуальный.
+    compute_time — сколько секунд строился список (для XFetch)
     """
-    key = CACHE_KEYS['products']
-    cache.set(key, products, timeout)
+    version = version or get_catalog_version()
+    key = products_list_key(version)
+    set_and_unlock(key, products, timeout, compute_time, local_version=version, codec=api_codec_for(products))
     logger.info(f"Cached products list with key: {key}")
 
 
-def get_cached_products_list():
+def get_cached_products_list(version=None):
     """
     Получение кэшированного списка товаров
     """
-    key = CACHE_KEYS['products']
-    return cache.get(key)
+    version = version or get_catalog_version()
+    return get_or_lock(products_list_key(version), products_list_key(version - 1), local_version=version)
+
+
+def cache_products_page(params, data, timeout=300, version=None, compute_time=0):  # 5 минут
+    """
+    Кэширование страницы/выборки списка товаров (фильтры и курсор в ключе)
+    """
+    version = version or get_catalog_version()
+    key = products_list_key(version, params)
+    set_and_unlock(key, data, timeout, compute_time, local_version=version, codec=api_codec_for(data))
+    logger.info(f"Cached products page with key: {key}")
 
 
-def cache_product_detail(product_id, product_data, timeout=DEFAULT_CACHE_TIMEOUT):
+def get_cached_products_page(params, version=None):
+    """
+    Получение кэшированной страницы/выборки списка товаров
+    """
+    version = version or get_catalog_version()
+    return get_or_lock(
+        products_list_key(version, params), products_list_key(version - 1, params), local_version=version
+    )
+
+
+def cache_product_detail(product_id, product_data, timeout=DEFAULT_CACHE_TIMEOUT, compute_time=0):
     """
     Кэширование детальной информации о товаре
     """
     key = CACHE_KEYS['product_detail'].format(id=product_id)
-    cache.set(key, product_data, timeout)
+    set_and_unlock(
+        key, product_data, timeout, compute_time, local_version=get_catalog_version(), codec=api_codec_for(product_data)
+    )
+    tag_cache_key(key, [f"product:{product_id}"], timeout)
     logger.info(f"Cached product detail for ID {product_id}")
 
 
@@ -81,7 +614,102 @@ def get_cached_product_detail(product_id):
     Получение кэшированной информации о товаре
     """
     key = CACHE_KEYS['product_detail'].format(id=product_id)
-    return cache.get(key)
+    # Локальная копия действительна, пока не сменилось поколение каталога
+    return get_or_lock(key, local_version=get_catalog_version())
+
+
+def cache_product_details(products, timeout=DEFAULT_CACHE_TIMEOUT, compute_time=0):
+    """
+    Кэширование нескольких карточек товаров одним set_many.
+    products — {product_id: данные}
+    """
+    if not products:
+        return
+    version = get_catalog_version()
+    started = time.perf_counter()
+    entries = {
+        CACHE_KEYS['product_detail'].format(id=product_id): _xfetch_entry(
+            product_data, timeout, compute_time, api_codec_for(product_data)
+        )
+        for product_id, product_data in products.items()
+    }
+    cache.set_many(entries, timeout)
+    cache_metrics.record_set_many(
+        cache_family(CACHE_KEYS['product_detail']), time.perf_counter() - started,
+        [payload_size(entry['value']) for entry in entries.values()],
+    )
+
+    for key, product_data in zip(entries, products.values()):
+        local_cache.set(key, product_data, version)
+    tag_cache_keys({key: [f"product:{product_id}"] for key, product_id in zip(entries, products)}, timeout)
+    logger.info(f"Cached product details for {len(entries)} products")
+
+
+def get_cached_product_details(product_ids):
+    """
+    Получение нескольких карточек товаров: сначала локальный кэш процесса,
+    остальные — одним get_many. Возвращает {product_id: данные} только для найденных
+    """
+    version = get_catalog_version()
+    started = time.perf_counter()
+    found = {}
+    missing = {}
+    for product_id in product_ids:
+        key = CACHE_KEYS['product_detail'].format(id=product_id)
+        value = local_cache.get(key, version)
+        if value is not None:
+            found[product_id] = value
+        else:
+            missing[key] = product_id
+
+    local_hits = len(found)
+    entries = cache.get_many(list(missing)) if missing else {}
+    entries = {key: entry for key, entry in entries.items() if _is_xfetch_entry(entry)}
+    for key, entry in entries.items():
+        value = _entry_value(entry)
+        local_cache.set(key, value, version)
+        found[missing[key]] = value
+
+    cache_metrics.record_get_many(cache_family(CACHE_KEYS['product_detail']), time.perf_counter() - started, {
+        'local_hits': local_hits,
+        'hits': len(entries),
+        'misses': len(missing) - len(entries),
+    })
+    return found
+
+
+def cache_categories_list(categories, timeout=DEFAULT_CACHE_TIMEOUT):
+    """
+    Кэширование списка категорий
+    """
+    key = CACHE_KEYS['categories']
+    set_and_unlock(key, categories, timeout, codec=api_codec_for(categories))
+    tag_cache_key(key, ['categories'], timeout)
+    logger.info(f"Cached categories list with key: {key}")
+
+
+def get_cached_categories_list():
+    """
+    Получение кэшированного списка категорий
+    """
+    return get_or_lock(CACHE_KEYS['categories'])
+
+
+def cache_category_detail(category_id, slug, category_data, timeout=DEFAULT_CACHE_TIMEOUT):
+    """
+    Кэширование категории (ключ по slug, тег по id — slug может смениться)
+    """
+    key = CACHE_KEYS['category_detail'].format(slug=slug)
+    set_and_unlock(key, category_data, timeout, codec=api_codec_for(category_data))
+    tag_cache_key(key, [f"category:{category_id}"], timeout)
+    logger.info(f"Cached category detail for slug {slug}")
+
+
+def get_cached_category_detail(slug):
+    """
+    Получение кэшированной категории
+    """
+    return get_or_lock(CACHE_KEYS['category_detail'].format(slug=slug))
 
 
 def cache_user_orders(user_id, orders, timeout=1800):  # 30 минут
@@ -89,7 +717,8 @@ def cache_user_orders(user_id, orders, timeout=1800):  # 30 минут
     Кэширование заказов пользователя
     """
     key = CACHE_KEYS['user_orders'].format(user_id=user_id)
-    cache.set(key, orders, timeout)
+    _cache_set(key, orders, timeout)
+    tag_cache_key(key, [f"user:{user_id}"], timeout)
     logger.info(f"Cached orders for user {user_id}")
 
 
@@ -98,7 +727,7 @@ def get_cached_user_orders(user_id):
     Получение кэшированных заказов пользователя
     """
     key = CACHE_KEYS['user_orders'].format(user_id=user_id)
-    return cache.get(key)
+    return _cache_get(key)
 
 
 def cache_nova_poshta_cities(search, cities, timeout=86400):  # 24 часа
@@ -106,7 +735,7 @@ def cache_nova_poshta_cities(search, cities, timeout=86400):  # 24 часа
     Кэширование городов Nova Poshta
     """
     key = CACHE_KEYS['nova_poshta_cities'].format(search=search)
-    cache.set(key, cities, timeout)
+    _cache_set(key, cities, timeout)
     logger.info(f"Cached Nova Poshta cities for search: {search}")
 
 
@@ -115,7 +744,7 @@ def get_cached_nova_poshta_cities(search):
     Получение кэшированных городов Nova Poshta
     """
     key = CACHE_KEYS['nova_poshta_cities'].format(search=search)
-    return cache.get(key)
+    return _cache_get(key)
 
 
 def cache_nova_poshta_warehouses(city_ref, warehouses, timeout=86400):  # 24 часа
@@ -123,7 +752,7 @@ def cache_nova_poshta_warehouses(city_ref, warehouses, timeout=86400):  # 24 ч
     Кэширование отделений Nova Poshta
     """
     key = CACHE_KEYS['nova_poshta_warehouses'].format(city_ref=city_ref)
-    cache.set(key, warehouses, timeout)
+    _cache_set(key, warehouses, timeout)
     logger.info(f"Cached Nova Poshta warehouses for city: {city_ref}")
 
 
@@ -132,15 +761,15 @@ def get_cached_nova_poshta_warehouses(city_ref):
     Получение кэшированных отделений Nova Poshta
     """
     key = CACHE_KEYS['nova_poshta_warehouses'].format(city_ref=city_ref)
-    return cache.get(key)
+    return _cache_get(key)
 
 
-def cache_payment_settings(payment_system, settings_data, timeout=3600):  # 1 час
+def cache_payment_settings(payment_system, settings_data, timeout=3600, compute_time=0):  # 1 час
     """
     Кэширование настроек платежной системы
     """
     key = CACHE_KEYS['payment_settings'].format(system=payment_system)
-    cache.set(key, settings_data, timeout)
+    set_and_unlock(key, settings_data, timeout, compute_time)
     logger.info(f"Cached payment settings for {payment_system}")
 
 
@@ -149,7 +778,22 @@ def get_cached_payment_settings(payment_system):
     Получение кэшированных настроек платежной системы
     """
     key = CACHE_KEYS['payment_settings'].format(system=payment_system)
-    return cache.get(key)
+    return get_or_lock(key)
+
+
+def cache_payment_methods(methods, timeout=3600, compute_time=0):  # 1 час
+    """
+    Кэширование активных способов оплаты (без секретов)
+    """
+    set_and_unlock(CACHE_KEYS['payment_methods'], methods, timeout, compute_time)
+    logger.info("Cached active payment methods")
+
+
+def get_cached_payment_methods():
+    """
+    Получение кэшированных способов оплаты
+    """
+    return get_or_lock(CACHE_KEYS['payment_methods'])
 
 
 def cache_order_stats(date, stats, timeout=3600):  # 1 час
@@ -157,7 +801,7 @@ def cache_order_stats(date, stats, timeout=3600):  # 1 час
     Кэширование статистики заказов
     """
     key = CACHE_KEYS['order_stats'].format(date=date.strftime('%Y-%m-%d'))
-    cache.set(key, stats, timeout)
+    _cache_set(key, stats, timeout)
     logger.info(f"Cached order stats for date: {date}")
 
 
@@ -166,7 +810,7 @@ def get_cached_order_stats(date):
     Получение кэшированной статистики заказов
     """
     key = CACHE_KEYS['order_stats'].format(date=date.strftime('%Y-%m-%d'))
-    return cache.get(key)
+    return _cache_get(key)
 
 
 def cache_user_cart(user_id, cart_data, timeout=1800):  # 30 минут
@@ -174,7 +818,8 @@ def cache_user_cart(user_id, cart_data, timeout=1800):  # 30 минут
     Кэширование корзины пользователя
     """
     key = CACHE_KEYS['user_cart'].format(user_id=user_id)
-    cache.set(key, cart_data, timeout)
+    _cache_set(key, cart_data, timeout)
+    tag_cache_key(key, [f"user:{user_id}"], timeout)
     logger.info(f"Cached cart for user {user_id}")
 
 
@@ -183,21 +828,157 @@ def get_cached_user_cart(user_id):
     Получение кэшированной корзины пользователя
     """
     key = CACHE_KEYS['user_cart'].format(user_id=user_id)
-    return cache.get(key)
+    return _cache_get(key)
+
 
+def cache_cart_count(user_id, count, timeout=600):  # 10 минут
+    """
+    Количество товаров в корзине пользователя (счетчик для значка в шапке).
+    Хранится числом без обертки, чтобы его можно было менять через incr
+    """
+    _cache_set(CACHE_KEYS['cart_count'].format(user_id=user_id), count, timeout)
 
-def invalidate_cache_pattern(pattern):
+
+def get_cached_cart_count(user_id):
     """
-    Инвалидация кэша по паттерну (только для Redis)
+    Счетчик товаров в корзине или None, если его нет в кэше
     """
+    return _cache_get(CACHE_KEYS['cart_count'].format(user_id=user_id))
+
+
+def incr_cart_count(user_id, delta):
+    """
+    Изменение счетчика на delta; если счетчика нет — его пересчитает следующее чтение.
+    В метриках incr считается записью, отсутствующий счетчик — промахом
+    """
+    if not delta:
+        return
+    key = CACHE_KEYS['cart_count'].format(user_id=user_id)
+    started = time.perf_counter()
     try:
-        # Получаем все ключи по паттерну
-        keys = cache.keys(pattern)
-        if keys:
-            cache.delete_many(keys)
-            logger.info(f"Invalidated {len(keys)} cache keys with pattern: {pattern}")
-    except Exception as e:
-        logger.error(f"Error invalidating cache pattern {pattern}: {e}")
+        cache.incr(key, delta)
+    except ValueError:
+        cache_metrics.record_get(cache_family(key), time.perf_counter() - started, 'misses')
+    else:
+        cache_metrics.record_set(cache_family(key), time.perf_counter() - started)
+
+
+def invalidate_cart_count(user_id):
+    cache.delete(CACHE_KEYS['cart_count'].format(user_id=user_id))
+
+
+def cache_catalog_state(model_name, state, timeout=300):  # 5 минут
+    """
+    Кэширование состояния каталога (количество записей и max(updated)) для ETag
+    """
+    key = CACHE_KEYS['catalog_state'].format(model=model_name)
+    _cache_set(key, state, timeout)
+    logger.info(f"Cached catalog state for {model_name}")
+
+
+def get_cached_catalog_state(model_name):
+    """
+    Получение кэшированного состояния каталога
+    """
+    key = CACHE_KEYS['catalog_state'].format(model=model_name)
+    return _cache_get(key)
+
+
+def get_catalog_changed_at(model_name):
+    """
+    Время последнего изменения каталога (учитывает удаления, которых не видно по max(updated))
+    """
+    key = CACHE_KEYS['catalog_changed'].format(model=model_name)
+    return cache.get(key)
+
+
+def invalidate_catalog_state(model_name):
+    """
+    Инвалидация состояния каталога
+    """
+    cache.delete(CACHE_KEYS['catalog_state'].format(model=model_name))
+    cache.set(CACHE_KEYS['catalog_changed'].format(model=model_name), timezone.now(), None)
+    logger.info(f"Invalidated catalog state for {model_name}")
+
+
+def _get_redis_client():
+    """
+    Клиент Redis, если кэш настроен через django-redis (иначе None)
+    """
+    client = getattr(cache, 'client', None)
+    if client is None or not hasattr(client, 'get_client'):
+        return None
+    return client.get_client(write=True)
+
+
+def tag_cache_key(key, tags, timeout=DEFAULT_CACHE_TIMEOUT):
+    """
+    Регистрация ключа в множествах тегов (например product:42, user:13)
+    """
+    tag_cache_keys({key: tags}, timeout)
+
+
+# KEYS: множество тега. ARGV: TTL. Срок множества только продлевается: оно должно
+# жить не меньше самого долгоживущего из своих ключей
+EXTEND_TTL_SCRIPT = """
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[1]) then
+    return redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def tag_cache_keys(key_tags, timeout=DEFAULT_CACHE_TIMEOUT):
+    """
+    Регистрация нескольких ключей в тегах: {ключ: [теги]}.
+    На Redis — SADD в один pipeline, на остальных бэкендах — множество в значении кэша.
+    Без Redis чтение и запись множества не атомарны: параллельная регистрация в том же
+    теге может потерять ключ, поэтому этот вариант рассчитан на один процесс (LocMem)
+    """
+    redis_client = _get_redis_client()
+    if redis_client is not None:
+        extend_ttl = redis_client.register_script(EXTEND_TTL_SCRIPT)
+        pipeline = redis_client.pipeline()
+        for key, tags in key_tags.items():
+            for tag in tags:
+                tag_key = cache.make_key(CACHE_KEYS['tag'].format(tag=tag))
+                pipeline.sadd(tag_key, key)
+                extend_ttl(keys=[tag_key], args=[timeout], client=pipeline)
+        pipeline.execute()
+        return
+
+    tag_members = {}
+    for key, tags in key_tags.items():
+        for tag in tags:
+            tag_members.setdefault(CACHE_KEYS['tag'].format(tag=tag), set()).add(key)
+    stored = cache.get_many(list(tag_members))
+    for tag_key, members in tag_members.items():
+        members.update(stored.get(tag_key, ()))
+    cache.set_many(tag_members, timeout)
+
+
+def invalidate_tags(*tags, keys=()):
+    """
+    Удаление всех ключей, зарегистрированных под тегами, одним delete_many.
+    keys — ключи, которые удаляются в любом случае (на случай вытеснения множества тега)
+    """
+    redis_client = _get_redis_client()
+    tag_keys = [CACHE_KEYS['tag'].format(tag=tag) for tag in tags]
+    keys = set(keys)
+    if redis_client is not None:
+        pipeline = redis_client.pipeline()
+        for tag_key in tag_keys:
+            pipeline.smembers(cache.make_key(tag_key))
+        for members in pipeline.execute():
+            keys.update(member.decode() if isinstance(member, bytes) else member for member in members)
+    else:
+        for members in cache.get_many(tag_keys).values():
+            keys.update(members)
+
+    cache.delete_many(list(keys) + tag_keys)
+    for key in keys:
+        local_cache.delete(key)
+    logger.info(f"Invalidated {len(keys)} cache keys with tags: {', '.join(tags)}")
 
 
 def invalidate_product_cache(product_id=None):
@@ -205,36 +986,81 @@ def invalidate_product_cache(product_id=None):
     Инвалидация кэша товаров
     """
     if product_id:
-        # Инвалидируем конкретный товар
-        key = CACHE_KEYS['product_detail'].format(id=product_id)
-        cache.delete(key)
+        # Инвалидируем все ключи конкретного товара
+        invalidate_tags(f"product:{product_id}", keys=[CACHE_KEYS['product_detail'].format(id=product_id)])
         logger.info(f"Invalidated product cache for ID: {product_id}")
     
-    # Инвалидируем список товаров
-    cache.delete(CACHE_KEYS['products'])
-    logger.info("Invalidated products list cache")
+    # Списки, страницы и выборки — новое поколение вместо удаления ключей
+    bump_catalog_version()
+
+    # ETag/Last-Modified каталога
+    invalidate_catalog_state('product')
+
+
+def invalidate_category_cache(category_id=None):
+    """
+    Инвалидация кэша категорий
+    """
+    tags = ['categories'] + ([f"category:{category_id}"] if category_id else [])
+    invalidate_tags(*tags, keys=[CACHE_KEYS['categories']])
+    logger.info(f"Invalidated category cache for ID: {category_id}")
+
+
+def invalidate_payment_settings(*payment_systems):
+    """
+    Инвалидация кэша настроек платежных систем и списка способов оплаты
+    """
+    keys = [CACHE_KEYS['payment_settings'].format(system=system) for system in payment_systems]
+    # Список способов оплаты строится из тех же настроек
+    cache.delete_many(keys + [CACHE_KEYS['payment_methods']])
+    logger.info(f"Invalidated payment settings cache for: {', '.join(payment_systems)}")
 
 
 def invalidate_user_cache(user_id):
     """
     Инвалидация кэша пользователя
     """
-    # Инвалидируем заказы пользователя
-    key = CACHE_KEYS['user_orders'].format(user_id=user_id)
-    cache.delete(key)
-    
-    # Инвалидируем корзину пользователя
-    cart_key = CACHE_KEYS['user_cart'].format(user_id=user_id)
-    cache.delete(cart_key)
+    # Заказы, корзина и прочие ключи пользователя
+    invalidate_tags(f"user:{user_id}", keys=[
+        CACHE_KEYS['user_orders'].format(user_id=user_id),
+        CACHE_KEYS['user_cart'].format(user_id=user_id),
+        CACHE_KEYS['cart_count'].format(user_id=user_id),
+    ])
     
     logger.info(f"Invalidated cache for user: {user_id}")
 
 
-def cache_decorator(timeout=DEFAULT_CACHE_TIMEOUT, key_prefix=''):
+def _refresh_in_background(cache_key, func, args, kwargs, timeout, soft_timeout, family=None, token=None):
+    """
+    Пересчет устаревшего значения в отдельном потоке; блокировку (token) ставит вызывающий
+    """
+    def refresh():
+        try:
+            result = func(*args, **kwargs)
+            _cache_set(cache_key, {'value': result, 'fresh_until': time.time() + soft_timeout}, timeout, family)
+            logger.debug(f"Refreshed stale cache for key: {cache_key}")
+        except Exception as e:
+            logger.error(f"Error refreshing cache key {cache_key}: {e}")
+        finally:
+            _release_rebuild_lock(cache_key, token)
+            # Поток не из пула запросов — соединение с БД закрываем сами
+            connection.close()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def cache_decorator(timeout=DEFAULT_CACHE_TIMEOUT, key_prefix='', soft_timeout=None):
     """
-    Декоратор для кэширования функций
+    Декоратор для кэширования функций.
+    С soft_timeout (stale-while-revalidate): после soft_timeout секунд значение
+    еще отдается из кэша, а пересчет запускается в фоне (один на ключ);
+    timeout остается жестким сроком, после которого вызов ждет пересчета
     """
     def decorator(func):
+        # Семейство в метриках — функция целиком, а не ключ с аргументами
+        family = f"{key_prefix}:{func.__name__}"
+
+        @wraps(func)
         def wrapper(*args, **kwargs):
             # Генерируем ключ кэша
             cache_key = cache_key_generator(
@@ -244,16 +1070,34 @@ def cache_decorator(timeout=DEFAULT_CACHE_TIMEOUT, key_prefix=''):
             )
             
             # Пытаемся получить из кэша
+            started = time.perf_counter()
             cached_result = cache.get(cache_key)
             if cached_result is not None:
                 logger.debug(f"Cache hit for key: {cache_key}")
-                return cached_result
+                if soft_timeout is None:
+                    cache_metrics.record_get(family, time.perf_counter() - started, 'hits')
+                    return cached_result
+
+                if time.time() < cached_result['fresh_until']:
+                    cache_metrics.record_get(family, time.perf_counter() - started, 'hits')
+                    return cached_result['value']
+
+                token = _acquire_rebuild_lock(cache_key)
+                if token is not None:
+                    logger.debug(f"Serving stale cache for key: {cache_key}")
+                    _refresh_in_background(cache_key, func, args, kwargs, timeout, soft_timeout, family, token)
+                cache_metrics.record_get(family, time.perf_counter() - started, 'stale_hits')
+                return cached_result['value']
+            cache_metrics.record_get(family, time.perf_counter() - started, 'misses')
             
             # Выполняем функцию
             result = func(*args, **kwargs)
             
             # Сохраняем в кэш
-            cache.set(cache_key, result, timeout)
+            if soft_timeout is None:
+                _cache_set(cache_key, result, timeout, family)
+            else:
+                _cache_set(cache_key, {'value': result, 'fresh_until': time.time() + soft_timeout}, timeout, family)
             logger.debug(f"Cached result for key: {cache_key}")
             
             return result
@@ -275,8 +1119,11 @@ def get_cache_stats():
     """
     Получение статистики кэша (только для Redis)
     """
+    redis_client = _get_redis_client()
+    if redis_client is None:
+        return {}
     try:
-        info = cache.client.info()
+        info = redis_client.info()
         return {
             'used_memory': info.get('used_memory_human', 'N/A'),
             'connected_clients': info.get('connected_clients', 0),
@@ -0,0 +1,292 @@
+"""
+Метрики кэша по семействам ключей: попадания/промахи, задержки get/set и размеры значений
+"""
+import bisect
+import copy
+import logging
+import os
+import pickle
+import random
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_METRICS_ENABLED = getattr(settings, 'CACHE_METRICS_ENABLED', True)
+
+# Как часто процесс выгружает свои счетчики в общий кэш (секунды)
+CACHE_METRICS_FLUSH_INTERVAL = getattr(settings, 'CACHE_METRICS_FLUSH_INTERVAL', 15)
+
+# Доля записей, для которых меряется размер непиклованного значения (pickle — лишняя работа)
+CACHE_METRICS_SIZE_SAMPLE_RATE = getattr(settings, 'CACHE_METRICS_SIZE_SAMPLE_RATE', 0.1)
+
+# Границы корзин гистограмм (как le в Prometheus)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+PAYLOAD_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+METRICS_PROCESS_KEY = 'cache:metrics:process:{process}'
+METRICS_PROCESSES_KEY = 'cache:metrics:processes'
+
+COUNTERS = ('hits', 'local_hits', 'stale_hits', 'misses', 'sets')
+HISTOGRAMS = {
+    'get_latency': LATENCY_BUCKETS,
+    'set_latency': LATENCY_BUCKETS,
+    'payload_bytes': PAYLOAD_BUCKETS,
+}
+
+
+def cache_family(key):
+    """
+    Семейство ключа — первые два сегмента: product:detail:42 -> product:detail
+    """
+    return ':'.join(key.split(':')[:2])
+
+
+def payload_size(value, sample_rate=CACHE_METRICS_SIZE_SAMPLE_RATE):
+    """
+    Размер значения в байтах: для байтов/строк точно, для остального — размер pickle
+    на доле sample_rate записей (иначе None)
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode())
+    if random.random() < sample_rate:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    return None
+
+
+def _new_family():
+    family = dict.fromkeys(COUNTERS, 0)
+    for name, buckets in HISTOGRAMS.items():
+        family[name] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0, 'count': 0}
+    return family
+
+
+def _observe(histogram, buckets, value):
+    histogram['buckets'][bisect.bisect_left(buckets, value)] += 1
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+def merge_families(snapshots):
+    """
+    Сумма снимков нескольких процессов
+    """
+    merged = {}
+    for families in snapshots:
+        for name, data in families.items():
+            family = merged.setdefault(name, _new_family())
+            for counter in COUNTERS:
+                family[counter] += data.get(counter, 0)
+            for histogram in HISTOGRAMS:
+                source, target = data[histogram], family[histogram]
+                target['buckets'] = [a + b for a, b in zip(target['buckets'], source['buckets'])]
+                target['sum'] += source['sum']
+                target['count'] += source['count']
+    return merged
+
+
+class CacheMetrics:
+    """
+    Счетчики в памяти процесса. Раз в CACHE_METRICS_FLUSH_INTERVAL секунд снимок
+    выгружается в общий кэш, чтобы панель и /metrics видели все воркеры
+    """
+
+    def __init__(self, enabled=CACHE_METRICS_ENABLED, flush_interval=CACHE_METRICS_FLUSH_INTERVAL):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self._families = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def record_get(self, family, duration, outcome):
+        """
+        outcome: 'hits', 'local_hits', 'stale_hits' или 'misses'
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            data = self._families.setdefault(family, _new_family())
+            data[outcome] += 1
+            _observe(data['get_latency'], LATENCY_BUCKETS, duration)
+        self.maybe_flush()
+
+    def record_set(self, family, duration, size=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            data = self._families.setdefault(family, _new_family())
+            data['sets'] += 1
+            _observe(data['set_latency'], LATENCY_BUCKETS, duration)
+            if size is not None:
+                _observe(data['payload_bytes'], PAYLOAD_BUCKETS, size)
+        self.maybe_flush()
+
+    def record_get_many(self, family, duration, outcomes):
+        """
+        Один get_many: счетчики по outcomes ({'hits': 3, 'misses': 1}), задержка — одна на запрос
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            data = self._families.setdefault(family, _new_family())
+            for outcome, count in outcomes.items():
+                data[outcome] += count
+            _observe(data['get_latency'], LATENCY_BUCKETS, duration)
+        self.maybe_flush()
+
+    def record_set_many(self, family, duration, sizes):
+        if not self.enabled:
+            return
+        with self._lock:
+            data = self._families.setdefault(family, _new_family())
+            data['sets'] += len(sizes)
+            _observe(data['set_latency'], LATENCY_BUCKETS, duration)
+            for size in sizes:
+                if size is not None:
+                    _observe(data['payload_bytes'], PAYLOAD_BUCKETS, size)
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self._families)
+
+    def reset(self):
+        with self._lock:
+            self._families.clear()
+
+    @property
+    def process_id(self):
+        # pid читается каждый раз: после fork у воркера свой идентификатор
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def maybe_flush(self):
+        with self._lock:
+            if time.monotonic() - self._flushed_at < self.flush_interval:
+                return
+            self._flushed_at = time.monotonic()
+        self.flush()
+
+    def flush(self):
+        """
+        Снимок процесса в общий кэш и регистрация процесса в списке воркеров
+        """
+        timeout = self.flush_interval * 4
+        process_id = self.process_id
+        try:
+            cache.set(METRICS_PROCESS_KEY.format(process=process_id), self.snapshot(), timeout)
+            now = time.time()
+            processes = {
+                pid: seen_at for pid, seen_at in (cache.get(METRICS_PROCESSES_KEY) or {}).items()
+                if now - seen_at < timeout
+            }
+            processes[process_id] = now
+            cache.set(METRICS_PROCESSES_KEY, processes, timeout)
+        except Exception as e:
+            logger.error(f"Error flushing cache metrics: {e}")
+
+
+cache_metrics = CacheMetrics()
+
+
+def collect_cache_metrics():
+    """
+    Метрики всех процессов, выгрузившихся в общий кэш (текущий — всегда свежие)
+    """
+    cache_metrics.flush()
+    process_id = cache_metrics.process_id
+    processes = cache.get(METRICS_PROCESSES_KEY) or {}
+    keys = [METRICS_PROCESS_KEY.format(process=pid) for pid in processes if pid != process_id]
+    snapshots = list(cache.get_many(keys).values()) if keys else []
+    snapshots.append(cache_metrics.snapshot())
+    return {'processes': len(snapshots), 'families': merge_families(snapshots)}
+
+
+def _histogram_quantile(histogram, buckets, quantile):
+    """
+    Верхняя граница корзины, в которую попадает quantile (None для пустой гистограммы)
+    """
+    if not histogram['count']:
+        return None
+    rank = quantile * histogram['count']
+    seen = 0
+    for bound, count in zip(buckets + (float('inf'),), histogram['buckets']):
+        seen += count
+        if seen >= rank:
+            return bound
+    return float('inf')
+
+
+def summarize_cache_metrics(families):
+    """
+    Строки для панели в админке: доля попаданий, средние и p95 задержки, средний размер
+    """
+    rows = []
+    for name, data in sorted(families.items()):
+        hits = data['hits'] + data['local_hits'] + data['stale_hits']
+        lookups = hits + data['misses']
+        get_latency, set_latency, payload = data['get_latency'], data['set_latency'], data['payload_bytes']
+        get_p95 = _histogram_quantile(get_latency, LATENCY_BUCKETS, 0.95)
+        rows.append({
+            'family': name,
+            'hits': data['hits'],
+            'local_hits': data['local_hits'],
+            'stale_hits': data['stale_hits'],
+            'misses': data['misses'],
+            'sets': data['sets'],
+            'hit_ratio': hits / lookups * 100 if lookups else None,
+            'get_avg_ms': get_latency['sum'] / get_latency['count'] * 1000 if get_latency['count'] else None,
+            'get_p95_ms': get_p95 * 1000 if get_p95 is not None else None,
+            'set_avg_ms': set_latency['sum'] / set_latency['count'] * 1000 if set_latency['count'] else None,
+            'payload_avg_bytes': payload['sum'] / payload['count'] if payload['count'] else None,
+        })
+    return rows
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def render_prometheus_metrics(families):
+    """
+    Метрики в текстовом формате Prometheus (exposition format 0.0.4)
+    """
+    lines = [
+        '# HELP shop_cache_requests_total Cache lookups by key family and result.',
+        '# TYPE shop_cache_requests_total counter',
+    ]
+    results = (('hits', 'hit'), ('local_hits', 'local_hit'), ('stale_hits', 'stale_hit'), ('misses', 'miss'))
+    for name, data in sorted(families.items()):
+        for counter, result in results:
+            lines.append(f'shop_cache_requests_total{{family="{name}",result="{result}"}} {data[counter]}')
+
+    lines += [
+        '# HELP shop_cache_sets_total Cache writes by key family.',
+        '# TYPE shop_cache_sets_total counter',
+    ]
+    for name, data in sorted(families.items()):
+        lines.append(f'shop_cache_sets_total{{family="{name}"}} {data["sets"]}')
+
+    histograms = (
+        ('shop_cache_get_duration_seconds', 'get_latency', 'Cache get latency by key family.'),
+        ('shop_cache_set_duration_seconds', 'set_latency', 'Cache set latency by key family.'),
+        ('shop_cache_payload_bytes', 'payload_bytes', 'Stored cache value size by key family.'),
+    )
+    for metric, histogram, help_text in histograms:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        buckets = HISTOGRAMS[histogram] + (float('inf'),)
+        for name, data in sorted(families.items()):
+            source = data[histogram]
+            cumulative = 0
+            for bound, count in zip(buckets, source['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{family="{name}",le="{_format_bound(bound)}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{family="{name}"}} {source["sum"]}')
+            lines.append(f'{metric}_count{{family="{name}"}} {source["count"]}')
+
+    return '\n'.join(lines) + '\n'
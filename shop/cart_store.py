@@ -0,0 +1,304 @@
+"""
+Горячее хранилище корзин в Redis с отложенной записью в Cart/CartItem.
+
+Живая корзина — хеш {product_id: quantity} (плюс служебное поле), изменения
+идут через HINCRBY без блокировок в БД. Измененные корзины попадают в множество
+cart:dirty, откуда их периодически сбрасывает в БД задача flush_cart_store_task;
+оформление заказа и чтение полной корзины сбрасывают свою корзину синхронно.
+Запись хеша в БД и прямые изменения корзины в БД идут под блокировкой корзины
+в Redis: пока она занята, HINCRBY ждет, и изменения не теряются.
+Без Redis (LocMem, DummyCache) хранилище выключено и корзина работает через БД
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .cache import CACHE_KEYS, RELEASE_LOCK_SCRIPT, _get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Хранилище включается, только если кэш — Redis
+CART_STORE_ENABLED = getattr(settings, 'CART_STORE_ENABLED', True)
+
+# Сколько живет неактивная корзина в Redis (БД остается источником при повторной загрузке)
+CART_STORE_TIMEOUT = getattr(settings, 'CART_STORE_TIMEOUT', 7 * 24 * 3600)
+
+# Сколько корзин сбрасывается в БД за один запуск задачи
+CART_STORE_FLUSH_BATCH = getattr(settings, 'CART_STORE_FLUSH_BATCH', 500)
+
+# Сколько живет блокировка корзины, если ее владелец упал (секунды)
+CART_LOCK_TIMEOUT = getattr(settings, 'CART_STORE_LOCK_TIMEOUT', 10)
+
+# Сколько ждать занятую блокировку корзины, прежде чем отказать (секунды)
+CART_LOCK_WAIT = getattr(settings, 'CART_STORE_LOCK_WAIT', 5)
+CART_LOCK_POLL_INTERVAL = 0.01
+
+# Максимальное количество одного товара в корзине (как в CartItem.clean)
+MAX_ITEM_QUANTITY = 100
+
+# Служебное поле: хеш загружен из БД (пустая корзина — хеш только с ним)
+LOADED_FIELD = 'loaded'
+
+# Ответ ADD_SCRIPT, пока корзина заблокирована
+LOCKED = b'locked'
+
+# KEYS: хеш корзины, множество измененных, блокировка корзины. ARGV: товар, прирост, TTL, id корзины.
+# Без загруженного хеша возвращает nil — сначала корзину нужно поднять из БД
+ADD_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return 'locked'
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if quantity <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[4])
+return quantity
+"""
+
+# KEYS: хеш корзины. ARGV: TTL, затем пары поле/значение (включая служебное поле).
+# Загружает только если хеша еще нет; вызывается под блокировкой корзины
+LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+
+class CartLocked(APIException):
+    """
+    Корзину дольше CART_LOCK_WAIT меняет другой запрос: клиенту — 409 с просьбой повторить
+    """
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Корзина обновляется, повторите попытку"
+    default_code = 'cart_locked'
+
+
+class CartStore:
+    """
+    Корзины в Redis-хешах: атомарные изменения количества и отложенная запись в БД
+    """
+
+    def __init__(self):
+        self._scripts = {}
+
+    def get_client(self):
+        if not CART_STORE_ENABLED:
+            return None
+        return _get_redis_client()
+
+    @property
+    def enabled(self):
+        return self.get_client() is not None
+
+    def _items_key(self, cart_id):
+        return cache.make_key(CACHE_KEYS['cart_items'].format(cart_id=cart_id))
+
+    def _dirty_key(self):
+        return cache.make_key(CACHE_KEYS['cart_dirty'])
+
+    def _lock_key(self, cart_id):
+        return cache.make_key(CACHE_KEYS['cart_lock'].format(cart_id=cart_id))
+
+    def _acquire(self, client, cart_id, wait=CART_LOCK_WAIT):
+        """
+        Блокировка корзины с токеном владельца; None, если не удалось за wait секунд
+        """
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        while not client.set(self._lock_key(cart_id), token, nx=True, ex=CART_LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(CART_LOCK_POLL_INTERVAL)
+        return token
+
+    def _release(self, client, cart_id, token):
+        self._run(client, RELEASE_LOCK_SCRIPT, [self._lock_key(cart_id)], [token])
+
+    @contextmanager
+    def _locked(self, client, cart_id):
+        token = self._acquire(client, cart_id)
+        if token is None:
+            raise CartLocked()
+        try:
+            yield
+        finally:
+            self._release(client, cart_id, token)
+
+    def _run(self, client, source, keys, args):
+        # Скрипт регистрируется один раз (EVALSHA с откатом на EVAL)
+        if source not in self._scripts:
+            self._scripts[source] = client.register_script(source)
+        return self._scripts[source](keys=keys, args=args, client=client)
+
+    def _load(self, client, cart):
+        """
+        Поднимает корзину из БД в Redis, если ее там еще нет.
+        Под блокировкой: чтение БД не пересекается с прямым изменением корзины
+        """
+        from .models import CartItem
+
+        with self._locked(client, cart.id):
+            fields = [LOADED_FIELD, 1]
+            for product_id, quantity in CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'):
+                fields.extend([product_id, quantity])
+            self._run(client, LOAD_SCRIPT, [self._items_key(cart.id)], [CART_STORE_TIMEOUT, *fields])
+
+    def _increment(self, client, cart, product_id, quantity):
+        keys = [self._items_key(cart.id), self._dirty_key(), self._lock_key(cart.id)]
+        args = [product_id, quantity, CART_STORE_TIMEOUT, cart.id]
+        deadline = time.monotonic() + CART_LOCK_WAIT
+        while True:
+            result = self._run(client, ADD_SCRIPT, keys, args)
+            if result is None:
+                self._load(client, cart)
+            elif result == LOCKED:
+                # Корзину пишут в БД — ждем, пока хеш снова станет актуальным
+                if time.monotonic() >= deadline:
+                    raise CartLocked()
+                time.sleep(CART_LOCK_POLL_INTERVAL)
+            else:
+                return int(result)
+
+    def add_product(self, cart, product, quantity=1):
+        """
+        Добавляет товар в корзину (HINCRBY), возвращает новое количество.
+        Проверки те же, что у Cart.add_product, но по итоговому количеству:
+        превышение лимита или остатка откатывается обратным приращением
+        """
+        client = self.get_client()
+        if not product.available:
+            raise ValidationError(f"Товар {product.name} недоступен")
+
+        total = self._increment(client, cart, product.id, quantity)
+        if total > MAX_ITEM_QUANTITY:
+            self._increment(client, cart, product.id, -quantity)
+            raise ValidationError("Слишком большое количество товара")
+        if total > product.stock:
+            self._increment(client, cart, product.id, -quantity)
+            raise ValidationError(
+                f"Недостаточно товара {product.name} на складе. Запрошено: {total}, доступно: {product.stock}"
+            )
+        return total
+
+    def clear(self, cart):
+        """
+        Пустая корзина в Redis (запись в БД — следующим сбросом)
+        """
+        client = self.get_client()
+        with self._locked(client, cart.id):
+            pipeline = client.pipeline(transaction=True)
+            pipeline.delete(self._items_key(cart.id))
+            pipeline.hset(self._items_key(cart.id), LOADED_FIELD, 1)
+            pipeline.expire(self._items_key(cart.id), CART_STORE_TIMEOUT)
+            pipeline.sadd(self._dirty_key(), cart.id)
+            pipeline.execute()
+
+    def _discard(self, client, cart_id):
+        pipeline = client.pipeline(transaction=True)
+        pipeline.delete(self._items_key(cart_id))
+        pipeline.srem(self._dirty_key(), cart_id)
+        pipeline.execute()
+
+    @contextmanager
+    def locked(self, cart):
+        """
+        Изменение корзины в БД в обход хранилища. Под блокировкой корзины
+        несохраненные изменения из Redis сначала пишутся в БД, а после блока
+        хеш удаляется и при следующем изменении поднимается из БД заново.
+        add_product на время блока ждет. Транзакция с изменением должна
+        завершиться внутри блока
+        """
+        client = self.get_client()
+        if client is None:
+            yield
+            return
+        with self._locked(client, cart.id):
+            self._materialize(client, cart.id)
+            yield
+            self._discard(client, cart.id)
+
+    def _write(self, client, cart_id):
+        from .models import Cart
+
+        data = client.hgetall(self._items_key(cart_id))
+        if not data:
+            # Хеш истек до сброса — в БД остается последнее сохраненное состояние
+            logger.warning(f"Cart {cart_id} expired in cart store before flush")
+            return False
+
+        quantities = {int(field): int(value) for field, value in data.items() if field.decode() != LOADED_FIELD}
+        cart = Cart.objects.filter(id=cart_id).first()
+        if cart is None:
+            self._discard(client, cart_id)
+            return False
+        if cart.replace_items(quantities) != quantities:
+            # Часть позиций отброшена или урезана — хеш перечитается из БД при следующем изменении
+            client.delete(self._items_key(cart_id))
+        return True
+
+    def _materialize(self, client, cart_id):
+        # Вызывается под блокировкой корзины
+        if not client.srem(self._dirty_key(), cart_id):
+            return False
+        try:
+            return self._write(client, cart_id)
+        except Exception:
+            client.sadd(self._dirty_key(), cart_id)
+            raise
+
+    def materialize(self, cart):
+        """
+        Синхронно записывает корзину в БД, если в Redis есть несохраненные изменения
+        """
+        client = self.get_client()
+        if client is None:
+            return False
+        # Чистая корзина — без блокировки
+        if not client.sismember(self._dirty_key(), cart.id):
+            return False
+        with self._locked(client, cart.id):
+            return self._materialize(client, cart.id)
+
+    def flush(self, batch_size=CART_STORE_FLUSH_BATCH):
+        """
+        Сбрасывает в БД измененные корзины, возвращает количество записанных
+        """
+        client = self.get_client()
+        if client is None:
+            return 0
+
+        flushed = 0
+        for cart_id in client.spop(self._dirty_key(), batch_size) or ():
+            cart_id = int(cart_id)
+            # Корзину сейчас пишут в БД — вернем в очередь, не дожидаясь
+            token = self._acquire(client, cart_id, wait=0)
+            if token is None:
+                client.sadd(self._dirty_key(), cart_id)
+                continue
+            try:
+                if self._write(client, cart_id):
+                    flushed += 1
+            except Exception as e:
+                # Вернем в очередь — попробуем при следующем запуске
+                client.sadd(self._dirty_key(), cart_id)
+                logger.error(f"Error flushing cart {cart_id}: {e}", exc_info=True)
+            finally:
+                self._release(client, cart_id, token)
+        return flushed
+
+
+cart_store = CartStore()
@@ -0,0 +1,54 @@
+"""
+Условные GET-запросы (ETag / Last-Modified) для API каталога
+"""
+from django.db.models import Count, Max
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from .cache import cache_catalog_state, get_cached_catalog_state, get_catalog_changed_at
+from .models import PaymentSettings
+
+
+def get_catalog_state(model):
+    """
+    Количество записей и время последнего изменения модели каталога.
+    Агрегат по БД кэшируется и сбрасывается сигналами при изменениях
+    """
+    model_name = model._meta.model_name
+    state = get_cached_catalog_state(model_name)
+    if state is None:
+        state = model.objects.aggregate(count=Count('pk'), last_modified=Max('updated'))
+        cache_catalog_state(model_name, state)
+
+    # Удаление не двигает max(updated) — учитываем время последней инвалидации
+    last_modified = max(
+        (value for value in (state['last_modified'], get_catalog_changed_at(model_name)) if value),
+        default=None
+    )
+    return {'count': state['count'], 'updated': state['last_modified'], 'last_modified': last_modified}
+
+
+def catalog_condition(model):
+    """
+    Декоратор методов ViewSet'а: 304 Not Modified по If-None-Match / If-Modified-Since,
+    без запроса к БД и сериализации, пока каталог не менялся
+    """
+    def etag_func(request, *args, **kwargs):
+        state = get_catalog_state(model)
+        updated = state['updated'].timestamp() if state['updated'] else 0
+        return f"{model._meta.model_name}-{state['count']}-{updated}"
+
+    def last_modified_func(request, *args, **kwargs):
+        return get_catalog_state(model)['last_modified']
+
+    return method_decorator(condition(etag_func=etag_func, last_modified_func=last_modified_func))
+
+
+def payment_methods_condition():
+    """
+    Декоратор для списков способов оплаты: 304 по ETag из кэшированного списка
+    """
+    def etag_func(request, *args, **kwargs):
+        return PaymentSettings.get_active_methods()['etag']
+
+    return method_decorator(condition(etag_func=etag_func))
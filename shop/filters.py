@@ -0,0 +1,52 @@
+"""
+Фильтры для API приложения shop
+"""
+from decimal import Decimal, InvalidOperation
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    """
+    Фильтрация товаров по query-параметрам:
+    category (slug или id), min_price, max_price, in_stock (true/false)
+    """
+    query_params = ('category', 'min_price', 'max_price', 'in_stock')
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        category = params.get('category')
+        if category:
+            if category.isdigit():
+                queryset = queryset.filter(category_id=int(category))
+            else:
+                queryset = queryset.filter(category__slug=category)
+
+        min_price = self._parse_price(params, 'min_price')
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+
+        max_price = self._parse_price(params, 'max_price')
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+
+        in_stock = params.get('in_stock')
+        if in_stock is not None:
+            if in_stock.lower() in ('1', 'true', 'yes'):
+                queryset = queryset.filter(stock__gt=0)
+            elif in_stock.lower() in ('0', 'false', 'no'):
+                queryset = queryset.filter(stock__lte=0)
+            else:
+                raise ValidationError({'in_stock': 'Ожидается true или false'})
+
+        return queryset
+
+    def _parse_price(self, params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: 'Цена должна быть числом'})
@@ -0,0 +1,131 @@
+"""
+Корзина гостя: {product_id: quantity} в кэше по токену из подписанной cookie.
+Таблицы Cart/CartItem не используются до входа — при входе корзина гостя
+переносится в корзину пользователя одним upsert
+"""
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from .cache import CACHE_KEYS
+
+logger = logging.getLogger(__name__)
+
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_SALT = 'shop.guest_cart'
+
+# Сколько живет корзина гостя с последнего изменения
+GUEST_CART_TIMEOUT = getattr(settings, 'GUEST_CART_TIMEOUT', 14 * 24 * 3600)
+
+# Максимальное количество одного товара и число позиций в корзине гостя
+MAX_ITEM_QUANTITY = 100
+MAX_GUEST_CART_LINES = 100
+
+
+def _cart_key(token):
+    return CACHE_KEYS['guest_cart'].format(token=token)
+
+
+def get_guest_cart_token(request):
+    """
+    Токен корзины гостя из подписанной cookie (None, если cookie нет или подпись неверна)
+    """
+    return request.get_signed_cookie(GUEST_CART_COOKIE, default=None, salt=GUEST_CART_SALT)
+
+
+def new_guest_cart_token():
+    return uuid.uuid4().hex
+
+
+def set_guest_cart_cookie(response, token):
+    response.set_signed_cookie(
+        GUEST_CART_COOKIE, token, salt=GUEST_CART_SALT, max_age=GUEST_CART_TIMEOUT,
+        httponly=True, samesite='Lax', secure=not settings.DEBUG
+    )
+
+
+def get_guest_cart(token):
+    """
+    {product_id: quantity} корзины гостя
+    """
+    if not token:
+        return {}
+    return cache.get(_cart_key(token)) or {}
+
+
+def save_guest_cart(token, items):
+    if items:
+        cache.set(_cart_key(token), items, GUEST_CART_TIMEOUT)
+    else:
+        cache.delete(_cart_key(token))
+
+
+def delete_guest_cart(token):
+    cache.delete(_cart_key(token))
+
+
+def apply_guest_operations(token, operations):
+    """
+    Пакет операций add/set/remove (как у Cart.apply_operations) над корзиной гостя.
+    Товары проверяются одним запросом; при ошибке корзина не меняется
+    """
+    from .models import Product
+
+    items = dict(get_guest_cart(token))
+    product_ids = {op['product_id'] for op in operations if op['action'] != 'remove'}
+    products = Product.objects.only('id', 'name', 'stock', 'available').in_bulk(product_ids)
+    missing = product_ids - products.keys()
+    if missing:
+        raise ValidationError(f"Товары не найдены: {', '.join(map(str, sorted(missing)))}")
+
+    for op in operations:
+        product_id = op['product_id']
+        if op['action'] == 'add':
+            items[product_id] = items.get(product_id, 0) + op['quantity']
+        elif op['action'] == 'set':
+            items[product_id] = op['quantity']
+        else:
+            items.pop(product_id, None)
+
+    for product_id in product_ids:
+        product, quantity = products[product_id], items.get(product_id, 0)
+        if quantity <= 0:
+            items.pop(product_id, None)
+            continue
+        if not product.available:
+            raise ValidationError(f"Товар {product.name} недоступен")
+        if quantity > MAX_ITEM_QUANTITY:
+            raise ValidationError(f"Слишком большое количество товара {product.name}")
+        if product.stock < quantity:
+            raise ValidationError(f"Недостаточно товара {product.name} на складе. Запрошено: {quantity}, доступно: {product.stock}")
+
+    if len(items) > MAX_GUEST_CART_LINES:
+        raise ValidationError("Слишком много товаров в корзине")
+
+    save_guest_cart(token, items)
+    return items
+
+
+def merge_guest_cart(request, user):
+    """
+    Переносит корзину гостя в корзину пользователя после входа.
+    Возвращает True, если было что переносить (cookie нужно удалить)
+    """
+    from .models import Cart
+
+    token = get_guest_cart_token(request)
+    items = get_guest_cart(token)
+    if not items:
+        return bool(token)
+
+    cart, _ = Cart.objects.get_or_create(user=user)
+    cart.apply_operations(
+        [{'action': 'add', 'product_id': product_id, 'quantity': quantity} for product_id, quantity in items.items()],
+        strict=False
+    )
+    delete_guest_cart(token)
+    logger.info(f"Merged guest cart ({len(items)} lines) into cart {cart.id} for user {user.email}")
+    return True
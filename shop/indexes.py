@@ -0,0 +1,22 @@
+"""
+Индексы, которые есть только в PostgreSQL
+"""
+from django.contrib.postgres.indexes import GinIndex
+
+
+class PostgresGinIndex(GinIndex):
+    """
+    GIN-индекс, который создается только в PostgreSQL.
+    На других БД (SQLite в тестах) вместо DDL выполняется пустой запрос,
+    а в состоянии миграций индекс остается
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return ''
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+    def remove_sql(self, model, schema_editor, **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return ''
+        return super().remove_sql(model, schema_editor, **kwargs)
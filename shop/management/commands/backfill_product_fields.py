@@ -0,0 +1,55 @@
+"""
+Заполнение денормализованных полей товара (category_name, main_image_url)
+"""
+from django.core.management.base import BaseCommand
+
+from shop.models import Product
+from shop.search import refresh_search_vector
+
+
+class Command(BaseCommand):
+    help = 'Заполняет category_name и main_image_url у товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Размер пачки для bulk_update (по умолчанию 500)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        products = (
+            Product.objects.select_related('category')
+            .prefetch_related('images')
+            .order_by('pk')
+        )
+
+        batch = []
+        updated = 0
+        for product in products.iterator(chunk_size=batch_size):
+            main_image = product.get_main_image()
+            main_image_url = main_image.image.url if main_image else ''
+            category_name = product.category.name
+
+            if product.main_image_url == main_image_url and product.category_name == category_name:
+                continue
+
+            product.main_image_url = main_image_url
+            product.category_name = category_name
+            batch.append(product)
+
+            if len(batch) >= batch_size:
+                updated += self._flush(batch)
+                batch = []
+
+        updated += self._flush(batch)
+        self.stdout.write(self.style.SUCCESS(f'Обновлено товаров: {updated}'))
+
+    def _flush(self, batch):
+        if batch:
+            Product.objects.bulk_update(batch, ['main_image_url', 'category_name'])
+            # category_name входит в search_vector
+            refresh_search_vector(Product.objects.filter(pk__in=[product.pk for product in batch]))
+        return len(batch)
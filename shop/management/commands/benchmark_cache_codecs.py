@@ -0,0 +1,85 @@
+"""
+Сравнение кодеков кэша: время кодирования/декодирования и размер значения
+"""
+import pickle
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from shop.cache import CACHE_CODECS, BytesCodec
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает кодеки кэша на списке товаров в формате ProductSerializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=5000,
+            help='Сколько товаров в списке (по умолчанию 5000)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Сколько раз повторять замер (берется лучшее время, по умолчанию 5)',
+        )
+
+    def handle(self, *args, **options):
+        payload = self._build_payload(options['products'])
+        # raw-кодеки хранят уже отрендеренный ответ — им на вход байты JSON
+        rendered = JSONRenderer().render(payload)
+        repeat = options['repeat']
+
+        self.stdout.write(f"{'Кодек':<20}{'Байт':>12}{'Encode, мс':>14}{'Decode, мс':>14}")
+
+        # Текущий способ: кэш Django пиклит serializer.data целиком
+        self._report('default (pickle)', lambda: pickle.dumps(payload), pickle.loads, repeat)
+        for name, codec in CACHE_CODECS.items():
+            value = rendered if name.split('+')[0] == BytesCodec.name else payload
+            self._report(name, lambda codec=codec, value=value: codec.encode(value), codec.decode, repeat)
+
+    def _report(self, name, encode, decode, repeat):
+        data, encode_time = self._best_time(encode, repeat)
+        _, decode_time = self._best_time(lambda: decode(data), repeat)
+        self.stdout.write(f"{name:<20}{len(data):>12}{encode_time * 1000:>14.2f}{decode_time * 1000:>14.2f}")
+
+    def _best_time(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def _build_payload(self, count):
+        """
+        Синтетический serializer.data: OrderedDict с Decimal и datetime, как до рендеринга
+        """
+        now = timezone.now()
+        return [
+            OrderedDict([
+                ('id', i),
+                ('name', f'Товар {i}'),
+                ('slug', f'product-{i}'),
+                ('category', f'Категория {i % 50}'),
+                ('images', [OrderedDict([
+                    ('image', f'https://example.com/media/products/{i}.jpg'),
+                    ('alt_text', f'Товар {i}'),
+                    ('is_main', True),
+                ])]),
+                ('main_image', f'https://example.com/media/products/{i}.jpg'),
+                ('description', f'Описание товара {i}. ' * 20),
+                ('price', Decimal(f'{100 + i % 900}.99')),
+                ('available', True),
+                ('created', now),
+                ('updated', now),
+            ])
+            for i in range(count)
+        ]
@@ -0,0 +1,50 @@
+"""
+Прогрев кэша: список и карточки товаров, категории, города Nova Poshta
+"""
+from django.core.management.base import BaseCommand
+
+from shop.warmup import WARMUP_BATCH_SIZE, WARMUP_WORKERS, warm_cache
+
+
+class Command(BaseCommand):
+    help = 'Заполняет кэш API после деплоя или очистки Redis'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=WARMUP_BATCH_SIZE,
+            help=f'Сколько карточек товаров в одной пачке (по умолчанию {WARMUP_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=WARMUP_WORKERS,
+            help=f'Сколько пачек собирать параллельно (по умолчанию {WARMUP_WORKERS})',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересобрать и те ключи, которые уже есть в кэше',
+        )
+        parser.add_argument(
+            '--np-search',
+            action='append',
+            default=None,
+            help='Строка поиска городов Nova Poshta (можно несколько раз, по умолчанию пустая)',
+        )
+
+    def handle(self, *args, **options):
+        stats = warm_cache(
+            force=options['force'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            nova_poshta_searches=options['np_search'] or ('',),
+            progress=self._progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Кэш прогрет: ' + ', '.join(f'{name}={count}' for name, count in stats.items())
+        ))
+
+    def _progress(self, stage, done, total):
+        self.stdout.write(f'{stage}: {done}/{total}')
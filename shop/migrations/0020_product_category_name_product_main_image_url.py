@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-16 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0019_novaposhtasettings_sender_warehouse_ref_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="category_name",
+            field=models.CharField(blank=True, editable=False, max_length=200, verbose_name="Название категории"),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="main_image_url",
+            field=models.CharField(blank=True, editable=False, max_length=500, verbose_name="URL главной картинки"),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-16 11:00
+
+import django.contrib.postgres.search
+import shop.indexes
+from django.db import migrations
+
+
+def fill_search_vector(apps, schema_editor):
+    """Заполнение search_vector (только PostgreSQL)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    from shop.search import product_search_vector
+
+    Product = apps.get_model('shop', 'Product')
+    Product.objects.update(search_vector=product_search_vector())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0020_product_category_name_product_main_image_url"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=shop.indexes.PostgresGinIndex(fields=["search_vector"], name="shop_product_search_vector_gin"),
+        ),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-16 12:00
+
+import shop.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class PostgresTrigramExtension(TrigramExtension):
+    """pg_trgm только в PostgreSQL: Django проверяет БД лишь при создании расширения, не при откате"""
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0021_product_search_vector"),
+    ]
+
+    operations = [
+        PostgresTrigramExtension(),
+        migrations.AddIndex(
+            model_name="product",
+            index=shop.indexes.PostgresGinIndex(
+                fields=["name"], name="shop_product_name_trgm_gin", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.1 on 2026-10-16 13:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0022_product_name_trigram_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="updated",
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
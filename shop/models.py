@@ -1,7 +1,9 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core import signing
 from django.db import models, transaction
 from django.urls import reverse
-from django.db.models import Index, Sum
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Index, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils.safestring import mark_safe
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
@@ -11,6 +13,17 @@ from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.password_validation import validate_password
 from decimal import Decimal
 from datetime import timedelta
+from functools import lru_cache
+import hashlib
+import json
+import time
+
+from .cache import (
+    LocalSettingsCache, cache_cart_count, cache_payment_methods, cache_payment_settings, get_cached_payment_methods,
+    get_cached_payment_settings, incr_cart_count, invalidate_cart_count, release_rebuild_locks,
+)
+from .cart_store import cart_store
+from .indexes import PostgresGinIndex
 
 
 class UserManager(BaseUserManager):
@@ -96,6 +109,7 @@ class User(AbstractUser):
 class Category(models.Model):
     name = models.CharField(max_length=200, db_index=True)
     slug = models.SlugField(max_length=200, unique=True)
+    updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ('name',)
@@ -119,6 +133,11 @@ class Product(models.Model):
     available = models.BooleanField(default=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # Денормализованные поля для быстрых списков (поддерживаются сигналами)
+    category_name = models.CharField(max_length=200, blank=True, editable=False, verbose_name="Название категории")
+    main_image_url = models.CharField(max_length=500, blank=True, editable=False, verbose_name="URL главной картинки")
+    # Полнотекстовый индекс (PostgreSQL), обновляется в save() при изменении исходных полей
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         permissions = [
@@ -128,22 +147,51 @@ class Product(models.Model):
         ordering = ('name',)
         indexes = [
             Index(fields=['id', 'slug']),
+            PostgresGinIndex(fields=['search_vector'], name='shop_product_search_vector_gin'),
+            # pg_trgm для автодополнения с опечатками
+            PostgresGinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='shop_product_name_trgm_gin'),
         ]
 
+    # Поля, изменения которых save() отслеживает относительно значений из БД
+    TRACKED_FIELDS = ('name', 'slug', 'description', 'category_id', 'price', 'available', 'main_image_url')
+
     def __str__(self):
         return self.name
 
-    def image_preview(self):
-        """Превью изображения для админки"""
-        # Получаем главное изображение
-        main_image = self.images.filter(is_main=True).first()
+    def get_main_image(self):
+        """
+        Главное изображение товара (или первое, если главное не отмечено).
+        Работает по self.images.all(), поэтому при prefetch_related('images')
+        не делает дополнительных запросов к БД
+        """
+        images = sorted(self.images.all(), key=lambda img: img.pk)
+
+        main_image = next((img for img in images if img.is_main), None)
         if main_image and main_image.image:
-            return mark_safe(f'<img src="{main_image.image.url}" width="150" />')
-        
+            return main_image
+
         # Если нет главного, берем первое
-        first_image = self.images.first()
+        first_image = images[0] if images else None
         if first_image and first_image.image:
-            return mark_safe(f'<img src="{first_image.image.url}" width="150" />')
+            return first_image
+
+        return None
+
+    def refresh_main_image_url(self):
+        """
+        Пересчитывает денормализованный main_image_url по текущим изображениям
+        """
+        main_image = self.get_main_image()
+        self.main_image_url = main_image.image.url if main_image else ''
+        self.updated = timezone.now()
+        # update() вместо save(): без full_clean и без повторных сигналов
+        Product.objects.filter(pk=self.pk).update(main_image_url=self.main_image_url, updated=self.updated)
+
+    def image_preview(self):
+        """Превью изображения для админки"""
+        main_image = self.get_main_image()
+        if main_image:
+            return mark_safe(f'<img src="{main_image.image.url}" width="150" />')
         
         return "Нет изображения"
 
@@ -154,13 +202,76 @@ class Product(models.Model):
             raise ValidationError("Цена должна быть положительной")
         super().clean()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._remember_loaded_values(fields)
+
+    def _tracked_names(self, fields):
+        """
+        attname отслеживаемых полей из списка имен ('category' -> 'category_id')
+        """
+        if fields is None:
+            return set(self.TRACKED_FIELDS)
+        names = set()
+        for name in fields:
+            field = self._meta.get_field(name)
+            names.add(getattr(field, 'attname', name))
+        return names & set(self.TRACKED_FIELDS)
+
+    def _remember_loaded_values(self, fields=None):
+        """
+        Запоминает значения отслеживаемых полей в том виде, в каком они лежат в БД
+        """
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for name in self._tracked_names(fields):
+            if name in self.__dict__:
+                loaded[name] = self.__dict__[name]
+
+    def _changed_fields(self, update_fields=None):
+        """
+        Отслеживаемые поля, измененные с загрузки из БД (у нового товара — все).
+        При update_fields учитываются только сохраняемые поля
+        """
+        names = self._tracked_names(update_fields)
+        if self._state.adding:
+            return names
+        loaded = self.__dict__.get('_loaded_values', {})
+        return {
+            name for name in names
+            if name in self.__dict__ and (name not in loaded or loaded[name] != self.__dict__[name])
+        }
+
     def save(self, *args, **kwargs):
         """
         Сохранение товара
         """
         # Валидация перед сохранением
         self.full_clean()
+
+        update_fields = kwargs.get('update_fields')
+        changed = self._changed_fields(update_fields)
+        # Категорию читаем только при ее смене: обычное сохранение (например,
+        # списание остатка) не делает лишнего запроса за self.category
+        if self.category_id and ('category_id' in changed or not self.category_name):
+            self.category_name = self.category.name
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'category_name'}
+
+        # Для сигналов post_save: что именно изменилось этим сохранением
+        self._changed_on_save = changed
         super().save(*args, **kwargs)
+        self._remember_loaded_values(update_fields)
+
+        # Второй UPDATE только если изменилось что-то из исходных полей search_vector
+        if changed & {'name', 'description', 'category_id'}:
+            from .search import refresh_search_vector
+            refresh_search_vector(Product.objects.filter(pk=self.pk))
 
 class ProductImage(models.Model):
     product = models.ForeignKey('Product', related_name='images', on_delete=models.CASCADE)
@@ -179,6 +290,30 @@ class ProductImage(models.Model):
         return f"Image for {self.product.name}"
 
 
+def cart_totals(prefix=''):
+    """
+    Агрегаты корзины: сумма (quantity * price), количество товаров и позиций.
+    prefix — путь до CartItem ('items__' для аннотации корзин)
+    """
+    line_total = ExpressionWrapper(
+        F(f'{prefix}quantity') * F(f'{prefix}product__price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    return {
+        'total_price': Coalesce(Sum(line_total), Value(Decimal('0.00')), output_field=DecimalField(max_digits=12, decimal_places=2)),
+        'items_count': Coalesce(Sum(f'{prefix}quantity'), 0),
+        'lines_count': Count(f'{prefix}id'),
+    }
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Корзины с суммой и количеством товаров, посчитанными в том же запросе
+        """
+        return self.annotate(**{f'annotated_{name}': expr for name, expr in cart_totals('items__').items()})
+
+
 class Cart(models.Model):
     user = models.OneToOneField(
         User,
@@ -195,6 +330,8 @@ class Cart(models.Model):
         verbose_name='Дата обновления'
     )
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
@@ -203,15 +340,33 @@ class Cart(models.Model):
     def __str__(self):
         return f"Корзина {self.user.username if self.user else 'анонима'}"
 
+    def summary(self):
+        """
+        Сумма, количество товаров и позиций корзины одним запросом
+        """
+        return self.items.aggregate(**cart_totals())
+
+    def _total(self, name):
+        # Корзина из Cart.objects.with_totals() уже содержит агрегаты
+        annotated = getattr(self, f'annotated_{name}', None)
+        if annotated is not None:
+            return annotated
+        return self.summary()[name]
+
     @property
     def total_price(self):
-        """Суммарная стоимость всех товаров в корзине с кэшированием"""
-        return sum(item.total_price for item in self.items.all())
+        """Суммарная стоимость всех товаров в корзине"""
+        return self._total('total_price')
 
     @property
     def items_count(self):
         """Общее количество товаров в корзине"""
-        return self.items.aggregate(total=Sum('quantity'))['total'] or 0
+        return self._total('items_count')
+
+    @property
+    def lines_count(self):
+        """Количество позиций в корзине"""
+        return self._total('lines_count')
 
     def create_order(self, shipping_address, phone, email, city='', comments=''):
         """
@@ -220,94 +375,106 @@ class Cart(models.Model):
         import logging
         logger = logging.getLogger(__name__)
         
-        if not self.items.exists():
-            logger.warning(f"Attempted to create order from empty cart for user {self.user.email}")
-            raise ValueError("Нельзя создать заказ из пустой корзины")
+        # Несохраненные изменения из Redis — в БД до проверок; до конца блока корзина заблокирована
+        with cart_store.locked(self):
+            if not self.items.exists():
+                logger.warning(f"Attempted to create order from empty cart for user {self.user.email}")
+                raise ValueError("Нельзя создать заказ из пустой корзины")
 
-        try:
-            with transaction.atomic():
-                logger.info(f"Starting order creation transaction for user {self.user.email}")
+            try:
+                with transaction.atomic():
+                    logger.info(f"Starting order creation transaction for user {self.user.email}")
                 
-                # Блокируем корзину для обновления
-                cart = Cart.objects.select_for_update().get(id=self.id)
-                logger.info(f"Locked cart {self.id} for user {self.user.email}")
+                    # Блокируем корзину для обновления
+                    cart = Cart.objects.select_for_update().get(id=self.id)
+                    logger.info(f"Locked cart {self.id} for user {self.user.email}")
                 
-                # Получаем настройки резервации
-                settings = ReservationSettings.get_settings()
+                    # Получаем настройки резервации
+                    settings = ReservationSettings.get_settings()
                 
-                # Проверяем доступность товаров и остатки
-                for item in cart.items.all():
-                    if not item.product.available:
-                        logger.error(f"Product {item.product.name} (ID: {item.product.id}) is not available")
-                        raise ValidationError(f"Товар {item.product.name} недоступен")
+                    # Позиции с товарами одним запросом
+                    items = list(cart.items.select_related('product'))
+
+                    # Проверяем доступность товаров и остатки
+                    for item in items:
+                        if not item.product.available:
+                            logger.error(f"Product {item.product.name} (ID: {item.product.id}) is not available")
+                            raise ValidationError(f"Товар {item.product.name} недоступен")
                     
-                    if item.product.stock < item.quantity:
-                        logger.error(f"Insufficient stock for product {item.product.name} (ID: {item.product.id}): requested {item.quantity}, available {item.product.stock}")
-                        raise ValidationError(f"Недостаточно товара {item.product.name} на складе. Запрошено: {item.quantity}, доступно: {item.product.stock}")
+                        if item.product.stock < item.quantity:
+                            logger.error(f"Insufficient stock for product {item.product.name} (ID: {item.product.id}): requested {item.quantity}, available {item.product.stock}")
+                            raise ValidationError(f"Недостаточно товара {item.product.name} на складе. Запрошено: {item.quantity}, доступно: {item.product.stock}")
                 
-                logger.info(f"Stock validation passed for cart {self.id}")
+                    logger.info(f"Stock validation passed for cart {self.id}")
                 
-                # Резервируем товары только если включена резервация
-                if settings.is_enabled:
-                    for item in cart.items.all():
-                        old_stock = item.product.stock
-                        item.product.stock -= item.quantity
-                        item.product.save()
-                        logger.info(f"Reserved product {item.product.name} (ID: {item.product.id}): stock {old_stock} -> {item.product.stock}")
+                    # Резервируем товары только если включена резервация
+                    if settings.is_enabled:
+                        for item in items:
+                            old_stock = item.product.stock
+                            item.product.stock -= item.quantity
+                            item.product.save()
+                            logger.info(f"Reserved product {item.product.name} (ID: {item.product.id}): stock {old_stock} -> {item.product.stock}")
                 
-                # Создаем заказ
-                order = Order.objects.create(
-                    user=self.user,
-                    total_price=self.total_price,
-                    address=shipping_address,
-                    phone=phone,
-                    email=email,
-                    city=city,
-                    comments=comments,
-                    status='pending'
-                )
+                    # Создаем заказ (сумма — по уже загруженным позициям, без агрегата в БД)
+                    total_price = sum((item.total_price for item in items), Decimal('0.00'))
+                    order = Order.objects.create(
+                        user=self.user,
+                        total_price=total_price,
+                        address=shipping_address,
+                        phone=phone,
+                        email=email,
+                        city=city,
+                        comments=comments,
+                        status='pending'
+                    )
                 
-                # Устанавливаем время резервации
-                order.set_reservation_time()
-                order.save()
+                    # Устанавливаем время резервации
+                    order.set_reservation_time()
+                    order.save()
                 
-                logger.info(f"Created order {order.id} with total_price {self.total_price}, reservation: {order.reserved_until}")
-
-                # Создаем элементы заказа
-                order_items = [
-                    OrderItem(
-                        order=order,
-                        product=item.product,
-                        quantity=item.quantity,
-                        price=item.product.price
-                    ) for item in cart.items.all()
-                ]
-
-                OrderItem.objects.bulk_create(order_items)
-                logger.info(f"Created {len(order_items)} order items for order {order.id}")
-
-                # Очищаем корзину
-                items_count = cart.items.count()
-                cart.items.all().delete()
-                logger.info(f"Cleared {items_count} items from cart {self.id}")
-
-                logger.info(f"Order creation transaction completed successfully: order_id={order.id}, user={self.user.email}")
-
-        except ValidationError as e:
-            logger.error(f"Validation error during order creation for user {self.user.email}: {e}")
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected error during order creation for user {self.user.email}: {e}", exc_info=True)
-            raise
-
+                    logger.info(f"Created order {order.id} with total_price {total_price}, reservation: {order.reserved_until}")
+
+                    # Создаем элементы заказа
+                    order_items = [
+                        OrderItem(
+                            order=order,
+                            product=item.product,
+                            quantity=item.quantity,
+                            price=item.product.price
+                        ) for item in items
+                    ]
+
+                    OrderItem.objects.bulk_create(order_items)
+                    logger.info(f"Created {len(order_items)} order items for order {order.id}")
+
+                    # Очищаем корзину
+                    cart.items.all().delete()
+                    logger.info(f"Cleared {len(items)} items from cart {self.id}")
+
+                    logger.info(f"Order creation transaction completed successfully: order_id={order.id}, user={self.user.email}")
+
+            except ValidationError as e:
+                logger.error(f"Validation error during order creation for user {self.user.email}: {e}")
+                raise
+            except Exception as e:
+                logger.error(f"Unexpected error during order creation for user {self.user.email}: {e}", exc_info=True)
+                raise
+
+        cache_cart_count(self.user_id, 0)
         return order
 
     def add_product(self, product, quantity=1):
         """
-        Добавляет товар в корзину с транзакцией
+        Добавляет товар в корзину с транзакцией.
+        С Redis — в горячее хранилище, без блокировок в БД (позиция не сохраняется)
         """
         import logging
         logger = logging.getLogger(__name__)
+
+        if cart_store.enabled:
+            total = cart_store.add_product(self, product, quantity)
+            incr_cart_count(self.user_id, quantity)
+            return CartItem(cart=self, product=product, quantity=total)
         
         try:
             with transaction.atomic():
@@ -342,6 +509,7 @@ class Cart(models.Model):
                     logger.info(f"Created new cart item {item.id} with quantity {quantity}")
                 
                 logger.info(f"Successfully added product {product.name} to cart {self.id}")
+                transaction.on_commit(lambda: incr_cart_count(self.user_id, quantity))
                 return item
                 
         except ValidationError as e:
@@ -351,12 +519,137 @@ class Cart(models.Model):
             logger.error(f"Unexpected error adding product {product.name} to cart {self.id}: {e}", exc_info=True)
             raise
 
+    def apply_operations(self, operations, strict=True):
+        """
+        Применяет пакет изменений корзины под одной блокировкой.
+        operations — список {'action': 'add' | 'set' | 'remove', 'product_id', 'quantity'};
+        операции применяются по порядку, итог по каждому товару проверяется и записывается
+        одним bulk_create(update_conflicts=True) и одним удалением.
+        strict=False (перенос корзины гостя): недоступные товары пропускаются,
+        количество урезается до остатка вместо ошибки
+        """
+        import logging
+        logger = logging.getLogger(__name__)
+
+        with cart_store.locked(self):
+            try:
+                with transaction.atomic():
+                    cart = Cart.objects.select_for_update().get(id=self.id)
+
+                    product_ids = {op['product_id'] for op in operations}
+                    products = Product.objects.in_bulk(product_ids)
+                    # Удалять можно и уже несуществующие товары
+                    missing = {op['product_id'] for op in operations if op['action'] != 'remove'} - products.keys()
+                    if not strict:
+                        unavailable = {pid for pid, product in products.items() if not product.available}
+                        operations = [op for op in operations if op['product_id'] not in missing | unavailable]
+                        product_ids = {op['product_id'] for op in operations}
+                        missing = set()
+                    if missing:
+                        raise ValidationError(f"Товары не найдены: {', '.join(map(str, sorted(missing)))}")
+
+                    quantities = dict(
+                        cart.items.filter(product_id__in=product_ids).values_list('product_id', 'quantity')
+                    )
+                    for op in operations:
+                        product_id = op['product_id']
+                        if op['action'] == 'add':
+                            quantities[product_id] = quantities.get(product_id, 0) + op['quantity']
+                        elif op['action'] == 'set':
+                            quantities[product_id] = op['quantity']
+                        else:
+                            quantities[product_id] = 0
+
+                    # bulk_create обходит CartItem.save — проверяем то же, что full_clean
+                    upserts, removed = [], []
+                    for product_id, quantity in quantities.items():
+                        if quantity <= 0:
+                            removed.append(product_id)
+                            continue
+                        product = products[product_id]
+                        if not strict:
+                            quantity = min(quantity, product.stock, 100)
+                            if quantity <= 0:
+                                continue
+                        if not product.available:
+                            raise ValidationError(f"Товар {product.name} недоступен")
+                        if quantity > 100:
+                            raise ValidationError(f"Слишком большое количество товара {product.name}")
+                        if product.stock < quantity:
+                            raise ValidationError(f"Недостаточно товара {product.name} на складе. Запрошено: {quantity}, доступно: {product.stock}")
+                        upserts.append(CartItem(cart=cart, product=product, quantity=quantity))
+
+                    if removed:
+                        cart.items.filter(product_id__in=removed).delete()
+                    if upserts:
+                        CartItem.objects.bulk_create(
+                            upserts,
+                            update_conflicts=True,
+                            unique_fields=['cart', 'product'],
+                            update_fields=['quantity']
+                        )
+
+                    logger.info(f"Applied {len(operations)} operations to cart {self.id}: {len(upserts)} upserted, {len(removed)} removed")
+
+            except ValidationError as e:
+                logger.error(f"Validation error applying operations to cart {self.id}: {e}")
+                raise
+
+        invalidate_cart_count(self.user_id)
+
+    def replace_items(self, quantities):
+        """
+        Записывает состояние корзины {product_id: quantity} (сброс из Redis):
+        лишние позиции удаляются, остальные — одним upsert.
+        Товары, удаленные или снятые с продажи после добавления, отбрасываются,
+        количество урезается до остатка. Возвращает записанное состояние
+        """
+        import logging
+        logger = logging.getLogger(__name__)
+
+        requested = {pid: quantity for pid, quantity in quantities.items() if quantity > 0}
+        with transaction.atomic():
+            cart = Cart.objects.select_for_update().get(id=self.id)
+            products = Product.objects.only('id', 'stock', 'available').in_bulk(requested)
+
+            items = {}
+            for product_id, quantity in requested.items():
+                product = products.get(product_id)
+                if product is None or not product.available:
+                    logger.warning(f"Dropped unavailable product {product_id} from cart {self.id}")
+                    continue
+                clamped = min(quantity, product.stock, 100)
+                if clamped != quantity:
+                    logger.warning(f"Clamped product {product_id} in cart {self.id}: {quantity} -> {clamped}")
+                if clamped > 0:
+                    items[product_id] = clamped
+
+            cart.items.exclude(product_id__in=items).delete()
+            if items:
+                CartItem.objects.bulk_create(
+                    [CartItem(cart=cart, product_id=pid, quantity=quantity) for pid, quantity in items.items()],
+                    update_conflicts=True,
+                    unique_fields=['cart', 'product'],
+                    update_fields=['quantity']
+                )
+
+        if items != requested:
+            # Счетчик в кэше считал отброшенные позиции
+            invalidate_cart_count(self.user_id)
+        return items
+
     def clear(self):
         """
-        Очистка корзины с транзакцией
+        Очистка корзины с транзакцией (с Redis — в горячем хранилище)
         """
         import logging
         logger = logging.getLogger(__name__)
+
+        if cart_store.enabled:
+            cart_store.clear(self)
+            cache_cart_count(self.user_id, 0)
+            logger.info(f"Cleared cart {self.id} in cart store")
+            return
         
         try:
             with transaction.atomic():
@@ -374,6 +667,7 @@ class Cart(models.Model):
                 
                 # Очищаем корзину
                 cart.items.all().delete()
+                transaction.on_commit(lambda: cache_cart_count(self.user_id, 0))
                 logger.info(f"Cleared {items_count} items from cart {self.id}")
                 
                 logger.info(f"Cart clear transaction completed successfully for cart {self.id}")
@@ -671,6 +965,15 @@ class OrderItem(models.Model):
         return self.price * self.quantity
 
 
+@lru_cache(maxsize=128)
+def _unsign_secret(value):
+    """
+    Расшифровка секрета платежной системы (HMAC + base64 + zlib) один раз на процесс.
+    Ключ памяти — шифротекст: после смены секрета в админке он другой
+    """
+    return signing.loads(value)
+
+
 class PaymentSettings(models.Model):
     PAYMENT_CHOICES = [
         ('stripe', 'Stripe'),
@@ -693,62 +996,59 @@ class PaymentSettings(models.Model):
     _webhook_secret = models.CharField(max_length=255, blank=True, null=True, verbose_name='Секрет вебхука (зашифрован)')
     is_sandbox = models.BooleanField(default=True, verbose_name='Песочница (sandbox)')
 
+    def _get_secret(self, name):
+        """
+        Расшифрованный секрет: лениво, при первом обращении, и один раз на экземпляр.
+        Запомненное значение сверяется с текущим шифротекстом (refresh_from_db, прямое присваивание)
+        """
+        ciphertext = getattr(self, f'_{name}')
+        if not ciphertext:
+            return ""
+        secrets = self.__dict__.setdefault('_decrypted_secrets', {})
+        cached = secrets.get(name)
+        if cached is None or cached[0] != ciphertext:
+            cached = secrets[name] = (ciphertext, _unsign_secret(ciphertext))
+        return cached[1]
+
+    def _set_secret(self, name, value):
+        # Шифруем сразу при присваивании — при save сравнивать и перешифровывать нечего
+        ciphertext = signing.dumps(value)
+        setattr(self, f'_{name}', ciphertext)
+        self.__dict__.setdefault('_decrypted_secrets', {})[name] = (ciphertext, value)
+
     @property
     def api_key(self):
-        return signing.loads(self._api_key) if self._api_key else ""
+        return self._get_secret('api_key')
 
     @api_key.setter
     def api_key(self, value):
-        self._api_key = signing.dumps(value)
+        self._set_secret('api_key', value)
 
     @property
     def secret_key(self):
-        return signing.loads(self._secret_key) if self._secret_key else ""
+        return self._get_secret('secret_key')
 
     @secret_key.setter
     def secret_key(self, value):
-        self._secret_key = signing.dumps(value)
+        self._set_secret('secret_key', value)
 
     @property
     def webhook_secret(self):
-        return signing.loads(self._webhook_secret) if self._webhook_secret else ""
+        return self._get_secret('webhook_secret')
 
     @webhook_secret.setter
     def webhook_secret(self, value):
-        self._webhook_secret = signing.dumps(value)
+        self._set_secret('webhook_secret', value)
 
     @property
     def sandbox(self):
         return self.is_sandbox
 
-    # Оригинальные значения для сравнения при save
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.__original_api_key = self.api_key
-        self.__original_secret_key = self.secret_key
-        self.__original_webhook_secret = self.webhook_secret
-
-    def save(self, *args, **kwargs):
-        """
-        Сохранение настроек платежей
-        """
-        # Если api_key есть (не пустая строка), и либо _api_key пустое, либо расшифрованное значение отличается — шифруем и записываем
-        if self.api_key and (not self._api_key or signing.loads(self._api_key) != self.api_key):
-            self._api_key = signing.dumps(self.api_key)
-
-        if self.secret_key and (not self._secret_key or signing.loads(self._secret_key) != self.secret_key):
-            self._secret_key = signing.dumps(self.secret_key)
-
-        if self.webhook_secret and (
-                not self._webhook_secret or signing.loads(self._webhook_secret) != self.webhook_secret):
-            self._webhook_secret = signing.dumps(self.webhook_secret)
-
-        super().save(*args, **kwargs)
-
-        # После сохранения обновляем оригиналы (для последующих сравнений)
-        self.__original_api_key = self.api_key
-        self.__original_secret_key = self.secret_key
-        self.__original_webhook_secret = self.webhook_secret
+    def __getstate__(self):
+        # Расшифрованные секреты не должны попадать в кэш или сессию вместе с объектом
+        state = super().__getstate__()
+        state.pop('_decrypted_secrets', None)
+        return state
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
 
@@ -760,6 +1060,58 @@ class PaymentSettings(models.Model):
     def __str__(self):
         return f"{self.get_payment_system_display()} Settings"
 
+    @classmethod
+    @release_rebuild_locks()
+    def get_active(cls, payment_system):
+        """
+        Активные настройки платежной системы или None.
+        Строка берется из кэша (секреты там остаются зашифрованными),
+        в БД — только после изменения настроек или истечения кэша
+        """
+        cached = get_cached_payment_settings(payment_system)
+        if cached is None:
+            started = time.monotonic()
+            instance = cls.objects.filter(payment_system=payment_system, is_active=True).first()
+            # Пустой словарь — «активных настроек нет», чтобы не ходить в БД на каждый вебхук
+            cached = {}
+            if instance:
+                cached = {field.attname: getattr(instance, field.attname) for field in cls._meta.concrete_fields}
+            cache_payment_settings(payment_system, cached, compute_time=time.monotonic() - started)
+            return instance
+
+        if not cached:
+            return None
+        return cls.from_db('default', list(cached), list(cached.values()))
+
+    @classmethod
+    @release_rebuild_locks()
+    def get_active_methods(cls):
+        """
+        Активные способы оплаты для checkout (без секретов) и ETag списка.
+        Строится один раз и живет в кэше до изменения настроек
+        """
+        resource = get_cached_payment_methods()
+        if resource is not None:
+            return resource
+
+        started = time.monotonic()
+        methods = [
+            {
+                'id': payment_settings.pk,
+                'payment_system': payment_settings.payment_system,
+                'name': payment_settings.get_payment_system_display(),
+                'is_active': True,
+                'is_sandbox': payment_settings.is_sandbox,
+            }
+            for payment_settings in cls.objects.filter(is_active=True).only('id', 'payment_system', 'is_sandbox')
+        ]
+        resource = {
+            'methods': methods,
+            'etag': hashlib.md5(json.dumps(methods, sort_keys=True).encode()).hexdigest(),
+        }
+        cache_payment_methods(resource, compute_time=time.monotonic() - started)
+        return resource
+
 
 class Payment(models.Model):
     STATUS_CHOICES = [
@@ -892,7 +1244,12 @@ class ReservationSettings(models.Model):
     
     @classmethod
     def get_settings(cls):
-        """Получить настройки резервации"""
+        """Получить настройки резервации (копия в памяти процесса)"""
+        return reservation_settings_cache.get()
+
+    @classmethod
+    def load_settings(cls):
+        """Настройки резервации из БД (создаются со значениями по умолчанию)"""
         settings, created = cls.objects.get_or_create(
             defaults={
                 'is_enabled': True,
@@ -904,6 +1261,9 @@ class ReservationSettings(models.Model):
         return settings
 
 
+reservation_settings_cache = LocalSettingsCache(ReservationSettings.load_settings)
+
+
 class NovaPoshtaSettings(models.Model):
 
     api_key = models.CharField(max_length=255, help_text="API ключ my.novaposhta.ua")
@@ -933,8 +1293,26 @@ class NovaPoshtaSettings(models.Model):
         
         return super().save(*args, **kwargs)
 
+    @classmethod
+    def get_settings(cls):
+        """Настройки Новой Почты или None (копия в памяти процесса)"""
+        return nova_poshta_settings_cache.get()
+
+    @classmethod
+    def load_settings(cls):
+        return cls.objects.order_by("-updated_at").first()
+
+    @classmethod
+    def get_active(cls):
+        """Настройки Новой Почты, если интеграция включена, иначе None"""
+        settings = cls.get_settings()
+        return settings if settings and settings.is_active else None
+
     class Meta:
         verbose_name = "Nova Poshta Настройка"
         verbose_name_plural = "Nova Poshta Настройки"
 
 
+nova_poshta_settings_cache = LocalSettingsCache(NovaPoshtaSettings.load_settings)
+
+
@@ -0,0 +1,61 @@
+"""
+Пагинация для API приложения shop
+"""
+import json
+from urllib.parse import parse_qs, urlparse
+
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация товаров по (name, id), как в Product.Meta.ordering.
+    Включается только если в запросе есть cursor или page_size —
+    без них список отдается целиком, как раньше
+    """
+    ordering = ('name', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def is_requested(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_cursor_tokens(self):
+        """
+        Курсоры соседних страниц без хоста и схемы запроса — их можно кэшировать
+        """
+        return {
+            'next': self._cursor_token(self.get_next_link()),
+            'previous': self._cursor_token(self.get_previous_link()),
+        }
+
+    def _cursor_token(self, link):
+        if link is None:
+            return None
+        return parse_qs(urlparse(link).query)[self.cursor_query_param][0]
+
+    def render_cached_page(self, request, page):
+        """
+        Ответ страницы из кэша: {'next', 'previous', 'results'} с курсорами и
+        отрендеренным JSON результатов. Ссылки строятся от текущего запроса
+        """
+        base_url = request.build_absolute_uri()
+        links = {
+            name: replace_query_param(base_url, self.cursor_query_param, page[name]) if page[name] else None
+            for name in ('next', 'previous')
+        }
+        return b''.join([
+            b'{"next":', json.dumps(links['next']).encode(),
+            b',"previous":', json.dumps(links['previous']).encode(),
+            b',"results":', page['results'].encode(), b'}',
+        ])
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework import permissions
 from rest_framework.throttling import UserRateThrottle
 
@@ -77,6 +79,16 @@ class IsOwnerOrAdmin(CustomPermission):
         return False
 
 
+class HasMetricsToken(permissions.BasePermission):
+    """Сборщик метрик (Prometheus) с токеном из CACHE_METRICS_TOKEN в заголовке X-Metrics-Token"""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'CACHE_METRICS_TOKEN', None)
+        if not token:
+            return False
+        return constant_time_compare(request.META.get('HTTP_X_METRICS_TOKEN', ''), token)
+
+
 class CartThrottle(UserRateThrottle):
     """Ограничение частоты запросов для корзины"""
     scope = 'cart'
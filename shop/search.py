@@ -0,0 +1,61 @@
+"""
+Полнотекстовый поиск товаров (PostgreSQL tsvector + GIN)
+"""
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Q
+
+# Конфигурация словаря PostgreSQL ('simple' не зависит от языка)
+SEARCH_CONFIG = getattr(settings, 'PRODUCT_SEARCH_CONFIG', 'simple')
+
+# Поля товара, из которых строится search_vector
+SEARCH_FIELDS = ('name', 'category_name', 'description')
+
+
+def is_full_text_search_available():
+    """
+    tsvector есть только в PostgreSQL (в тестах на SQLite — поиск через ILIKE)
+    """
+    return connection.vendor == 'postgresql'
+
+
+def product_search_vector():
+    """
+    Выражение для Product.search_vector: название важнее категории, категория важнее описания
+    """
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('category_name', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def refresh_search_vector(queryset):
+    """
+    Пересчитывает search_vector для товаров из queryset одним UPDATE
+    """
+    if not is_full_text_search_available():
+        return 0
+    return queryset.update(search_vector=product_search_vector())
+
+
+def search_products(queryset, query):
+    """
+    Поиск товаров с ранжированием по релевантности
+    """
+    query = (query or '').strip()
+    if not query:
+        return queryset.none()
+
+    if not is_full_text_search_available():
+        return queryset.filter(
+            Q(name__icontains=query) | Q(description__icontains=query)
+        ).order_by('name', 'id')
+
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    return (
+        queryset.filter(search_vector=search_query)
+        .annotate(rank=SearchRank(F('search_vector'), search_query))
+        .order_by('-rank', 'name', 'id')
+    )
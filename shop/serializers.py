@@ -27,7 +27,7 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return request.build_absolute_uri(obj.image.url) if obj.image and request else None
 
 class ProductSerializer(serializers.ModelSerializer):
-    category = serializers.StringRelatedField()
+    category = serializers.CharField(source='category_name', read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
     main_image = serializers.SerializerMethodField()
 
@@ -43,15 +43,9 @@ class ProductSerializer(serializers.ModelSerializer):
         """Получение главного изображения для фронтенда"""
         request = self.context.get('request')
         
-        # Ищем главное изображение
-        main_img = obj.images.filter(is_main=True).first()
-        if main_img and main_img.image:
-            return request.build_absolute_uri(main_img.image.url) if request else main_img.image.url
-        
-        # Если нет главного, берем первое
-        first_img = obj.images.first()
-        if first_img and first_img.image:
-            return request.build_absolute_uri(first_img.image.url) if request else first_img.image.url
+        # Денормализованное поле, поддерживается сигналами ProductImage
+        if obj.main_image_url:
+            return request.build_absolute_uri(obj.main_image_url) if request else obj.main_image_url
         
         return None
 
@@ -103,6 +97,19 @@ class AddToCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1, max_value=100)
 
+class CartOperationSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=100, default=0)
+
+    def validate(self, attrs):
+        if attrs['action'] != 'remove' and attrs['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Количество должно быть числом от 1 до 100'})
+        return attrs
+
+class CartBulkSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     total_price = serializers.SerializerMethodField()
@@ -244,23 +251,21 @@ class DashboardOrderDetailSerializer(serializers.ModelSerializer):
 
     def get_items(self, obj):
         items = []
-        for item in obj.order_items.all():
+        for item in obj.order_items.select_related('product'):
             product = item.product
-            main_image = product.images.filter(is_main=True).first()
-            image_url = main_image.image.url if main_image and main_image.image else None
 
             items.append({
                 'product_name': product.name,
                 'quantity': item.quantity,
                 'price': str(item.price),
                 'total': str(item.total_price),
-                'image': image_url,
+                'image': product.main_image_url or None,
             })
         return items
     def get_delivery_info(self, obj):
         from .models import NovaPoshtaSettings
 
-        if NovaPoshtaSettings.objects.filter(is_active=True).exists() and obj.nova_poshta_data:
+        if obj.nova_poshta_data and NovaPoshtaSettings.get_active():
             return {
                 'ttn': obj.nova_poshta_data.get('ttn'),
                 'status': obj.nova_poshta_data.get('status'),
@@ -1,6 +1,17 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import OrderItem
+from django.utils import timezone
+from .autocomplete import invalidate_autocomplete_index
+from .cache import (
+    invalidate_catalog_state, invalidate_category_cache, invalidate_payment_settings, invalidate_product_cache,
+    invalidate_tags,
+)
+from .models import (
+    OrderItem, Category, NovaPoshtaSettings, PaymentSettings, Product, ProductImage, ReservationSettings,
+    nova_poshta_settings_cache, reservation_settings_cache,
+)
+from .search import refresh_search_vector
 
 @receiver(post_save, sender=OrderItem)
 def update_order_total_on_save(sender, instance, **kwargs):
@@ -8,4 +19,84 @@ def update_order_total_on_save(sender, instance, **kwargs):
 
 @receiver(post_delete, sender=OrderItem)
 def update_order_total_on_delete(sender, instance, **kwargs):
-    instance.order.update_total_price()
\ No newline at end of file
+    instance.order.update_total_price()
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def update_product_main_image_url(sender, instance, **kwargs):
+    # Товар мог быть удален каскадом вместе с изображениями
+    product = Product.objects.filter(pk=instance.product_id).first()
+    if product:
+        product.refresh_main_image_url()
+        invalidate_product_cache(product.pk)
+
+@receiver(post_save, sender=Category)
+def update_products_category_name(sender, instance, created, **kwargs):
+    if created:
+        return
+    products = Product.objects.filter(category=instance).exclude(category_name=instance.name)
+    product_ids = list(products.values_list('pk', flat=True))
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(category_name=instance.name, updated=timezone.now())
+        refresh_search_vector(Product.objects.filter(pk__in=product_ids))
+        # Название категории есть и в карточках товаров
+        invalidate_tags(*(f"product:{pk}" for pk in product_ids))
+        invalidate_product_cache()
+
+@receiver(post_save, sender=Product)
+def reset_product_autocomplete_index_on_save(sender, instance, created, **kwargs):
+    # В дереве только id, название и slug доступных товаров: списание остатка его не сбрасывает
+    changed = getattr(instance, '_changed_on_save', None)
+    if created or changed is None or changed & {'name', 'slug', 'available'}:
+        invalidate_autocomplete_index()
+
+@receiver(post_delete, sender=Product)
+def reset_product_autocomplete_index(sender, instance, **kwargs):
+    invalidate_autocomplete_index()
+
+# Поля товара, которые попадают в ответы API (остаток stock в них не входит)
+PRODUCT_SERIALIZED_FIELDS = {'name', 'slug', 'description', 'category_id', 'price', 'available', 'main_image_url'}
+
+def _invalidate_product_cache_on_commit(product_id):
+    # Сбрасываем после коммита: иначе параллельный запрос успеет собрать
+    # еще не закоммиченные данные под новым поколением каталога
+    transaction.on_commit(lambda: invalidate_product_cache(product_id))
+
+@receiver(post_save, sender=Product)
+def reset_product_cache_on_save(sender, instance, created, **kwargs):
+    # Тела ответов (списки, страницы, карточка) и ETag сбрасываются вместе:
+    # сохранение из админки или через ORM не оставит новый ETag при старом теле.
+    # Списание и возврат остатка при заказе каталог не сбрасывают
+    changed = getattr(instance, '_changed_on_save', None)
+    if created or changed is None or changed & PRODUCT_SERIALIZED_FIELDS:
+        _invalidate_product_cache_on_commit(instance.pk)
+
+@receiver(post_delete, sender=Product)
+def reset_product_cache_on_delete(sender, instance, **kwargs):
+    _invalidate_product_cache_on_commit(instance.pk)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reset_catalog_state(sender, instance, **kwargs):
+    invalidate_catalog_state(sender._meta.model_name)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reset_category_cache(sender, instance, **kwargs):
+    invalidate_category_cache(instance.pk)
+
+@receiver(post_save, sender=PaymentSettings)
+@receiver(post_delete, sender=PaymentSettings)
+def reset_payment_settings_cache(sender, instance, **kwargs):
+    # Платежная система могла смениться — сбрасываем все
+    invalidate_payment_settings(*(system for system, _ in PaymentSettings.PAYMENT_CHOICES))
+
+@receiver(post_save, sender=ReservationSettings)
+@receiver(post_delete, sender=ReservationSettings)
+def reset_reservation_settings_cache(sender, instance, **kwargs):
+    reservation_settings_cache.invalidate()
+
+@receiver(post_save, sender=NovaPoshtaSettings)
+@receiver(post_delete, sender=NovaPoshtaSettings)
+def reset_nova_poshta_settings_cache(sender, instance, **kwargs):
+    nova_poshta_settings_cache.invalidate()
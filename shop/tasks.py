@@ -65,7 +65,7 @@ def create_nova_poshta_ttn_task(self, order_id):
             return False
             
         # Получаем настройки Nova Poshta
-        nova_settings = NovaPoshtaSettings.objects.filter(is_active=True).first()
+        nova_settings = NovaPoshtaSettings.get_active()
         if not nova_settings:
             logger.error("No active Nova Poshta settings found")
             return False
@@ -227,3 +227,41 @@ def cleanup_unpaid_orders_task():
     return f"Cancelled {cancelled_count} expired orders"
 
 
+
+
+@shared_task
+def flush_cart_store_task():
+    """
+    Запись измененных корзин из Redis в Cart/CartItem
+    """
+    from .cart_store import cart_store
+
+    flushed = cart_store.flush()
+    if flushed:
+        logger.info(f"Flushed {flushed} carts from cart store")
+    return flushed
+
+
+@shared_task(bind=True)
+def warm_cache_task(self, force=False):
+    """
+    Прогрев кэша после деплоя (запускается при старте воркера) или по требованию.
+    Одновременно выполняется только один прогрев
+    """
+    from django.core.cache import cache
+    from .warmup import warm_cache
+
+    lock_key = 'cache:warmup:lock'
+    if not cache.add(lock_key, self.request.id or 'local', 3600):
+        logger.info("Cache warm-up is already running, skipping")
+        return None
+
+    def progress(stage, done, total):
+        logger.info(f"Cache warm-up {stage}: {done}/{total}")
+        if self.request.id:
+            self.update_state(state='PROGRESS', meta={'stage': stage, 'done': done, 'total': total})
+
+    try:
+        return warm_cache(force=force, progress=progress)
+    finally:
+        cache.delete(lock_key)
@@ -3,11 +3,19 @@
 """
 import json
 from decimal import Decimal
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
-from django.test import TestCase
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from rest_framework.test import APITestCase, APIClient
+from urllib.parse import parse_qs, urlparse
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 
@@ -15,6 +23,15 @@ from ..models import (
     Category, Product, Order, OrderItem, 
     Cart, CartItem, Payment, PaymentSettings, NovaPoshtaSettings
 )
+from ..cache import cache_cart_count, get_cached_cart_count
+from ..filters import ProductFilterBackend
+from ..guest_cart import (
+    GUEST_CART_COOKIE, apply_guest_operations, get_guest_cart, merge_guest_cart, new_guest_cart_token,
+    set_guest_cart_cookie,
+)
+from ..pagination import ProductCursorPagination
+from ..search import is_full_text_search_available, refresh_search_vector, search_products
+from ..autocomplete import ProductNameTrie, autocomplete_index, autocomplete_products
 
 User = get_user_model()
 
@@ -95,6 +112,224 @@ class ProductAPITests(SimpleAPITestCase):
         self.assertEqual(self.product.stock, 10)
 
 
+class ProductListingTests(SimpleAPITestCase):
+    """Тесты фильтрации и курсорной пагинации списка товаров"""
+
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.other_category = Category.objects.create(name='Одежда', slug='clothes')
+        for i in range(5):
+            Product.objects.create(
+                name=f'Куртка {i}',
+                slug=f'jacket-{i}',
+                price=Decimal(f'{200 + i * 100}.00'),
+                category=self.other_category,
+                available=True,
+                stock=i
+            )
+
+    def _request(self, params):
+        return Request(self.factory.get('/api/products/', params))
+
+    def _filter(self, params):
+        return ProductFilterBackend().filter_queryset(
+            self._request(params), Product.objects.filter(available=True), None
+        )
+
+    def test_filter_by_category_slug_and_id(self):
+        """Тест фильтра по категории (slug и id)"""
+        self.assertEqual(self._filter({'category': 'clothes'}).count(), 5)
+        self.assertEqual(self._filter({'category': str(self.category.id)}).count(), 1)
+
+    def test_filter_by_price_range(self):
+        """Тест фильтра по диапазону цен"""
+        products = self._filter({'min_price': '300', 'max_price': '500'})
+        self.assertEqual(sorted(p.slug for p in products), ['jacket-1', 'jacket-2', 'jacket-3'])
+
+    def test_filter_in_stock(self):
+        """Тест фильтра по наличию на складе"""
+        self.assertEqual(self._filter({'in_stock': 'false'}).get().slug, 'jacket-0')
+        self.assertEqual(self._filter({'in_stock': 'true'}).count(), 5)
+
+    def test_filter_invalid_values(self):
+        """Тест ошибок валидации фильтров"""
+        with self.assertRaises(ValidationError):
+            self._filter({'min_price': 'abc'})
+        with self.assertRaises(ValidationError):
+            self._filter({'in_stock': 'maybe'})
+
+    def test_pagination_disabled_without_params(self):
+        """Тест: без cursor/page_size список не пагинируется"""
+        paginator = ProductCursorPagination()
+        self.assertIsNone(paginator.paginate_queryset(Product.objects.all(), self._request({})))
+
+    def test_cursor_pagination_walks_all_products(self):
+        """Тест: проход по всем страницам курсором в порядке (name, id)"""
+        seen = []
+        params = {'page_size': 2}
+        while True:
+            paginator = ProductCursorPagination()
+            page = paginator.paginate_queryset(Product.objects.all(), self._request(params))
+            self.assertLessEqual(len(page), 2)
+            seen.extend(p.name for p in page)
+            next_link = paginator.get_next_link()
+            if not next_link:
+                break
+            params = {'page_size': 2, 'cursor': parse_qs(urlparse(next_link).query)['cursor'][0]}
+
+        self.assertEqual(seen, list(Product.objects.order_by('name', 'id').values_list('name', flat=True)))
+
+    def test_cached_page_links_follow_request_host(self):
+        """Тест: страница из кэша получает ссылки от хоста текущего запроса"""
+        paginator = ProductCursorPagination()
+        page = paginator.paginate_queryset(
+            Product.objects.all(), Request(self.factory.get('/api/products/', {'page_size': 2}, HTTP_HOST='a.example'))
+        )
+        cached = {**paginator.get_cursor_tokens(), 'results': '[]'}
+        self.assertEqual(len(page), 2)
+        self.assertNotIn('a.example', json.dumps(cached))
+
+        request = Request(self.factory.get('/api/products/', {'page_size': 2}, HTTP_HOST='b.example'))
+        data = json.loads(ProductCursorPagination().render_cached_page(request, cached))
+        self.assertTrue(data['next'].startswith('http://b.example/api/products/?'))
+        self.assertEqual(parse_qs(urlparse(data['next']).query)['cursor'], [cached['next']])
+        self.assertIsNone(data['previous'])
+        self.assertEqual(data['results'], [])
+
+
+class ProductSearchTests(SimpleAPITestCase):
+    """Тесты поиска товаров (в тестах SQLite — поиск через ILIKE)"""
+
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(
+            name='Смартфон',
+            slug='smartphone',
+            description='Тестовый телефон с камерой',
+            price=Decimal('500.00'),
+            category=self.category
+        )
+
+    def test_search_by_name_and_description(self):
+        """Тест поиска по названию и описанию"""
+        self.assertEqual(search_products(Product.objects.all(), 'Смартфон').get().slug, 'smartphone')
+        self.assertEqual(search_products(Product.objects.all(), 'камерой').get().slug, 'smartphone')
+        self.assertEqual(search_products(Product.objects.all(), 'Тестов').count(), 2)
+
+    def test_empty_query_returns_nothing(self):
+        """Тест пустого поискового запроса"""
+        self.assertFalse(search_products(Product.objects.all(), '  ').exists())
+
+    def test_full_text_search_unavailable_on_sqlite(self):
+        """Тест: без PostgreSQL search_vector не заполняется"""
+        self.assertFalse(is_full_text_search_available())
+        self.assertEqual(refresh_search_vector(Product.objects.all()), 0)
+
+    def test_save_refreshes_vector_only_on_source_change(self):
+        """Тест: search_vector пересчитывается только при изменении названия, описания или категории"""
+        product = Product.objects.get(slug='smartphone')
+        with patch('shop.search.refresh_search_vector') as refresh:
+            product.stock = 3
+            product.save()
+            product.save(update_fields=['price'])
+            refresh.assert_not_called()
+
+            product.description = 'Телефон без камеры'
+            product.save()
+            refresh.assert_called_once()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Полнотекстовый поиск есть только в PostgreSQL')
+class ProductFullTextSearchTests(SimpleAPITestCase):
+    """Тесты полнотекстового поиска на PostgreSQL"""
+
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(
+            name='Чехол для телефона',
+            slug='phone-case',
+            price=Decimal('10.00'),
+            category=self.category
+        )
+        Product.objects.create(
+            name='Подставка',
+            slug='stand',
+            description='Подходит под чехол любого размера',
+            price=Decimal('20.00'),
+            category=self.category
+        )
+
+    def test_ranking_prefers_name_over_description(self):
+        """Тест: совпадение в названии выше совпадения в описании"""
+        results = list(search_products(Product.objects.all(), 'чехол'))
+        self.assertEqual([product.slug for product in results], ['phone-case', 'stand'])
+        self.assertGreater(results[0].rank, results[1].rank)
+
+    def test_vector_refreshed_after_category_rename(self):
+        """Тест: после переименования категории товары находятся по новому названию"""
+        self.assertFalse(search_products(Product.objects.all(), 'гаджеты').exists())
+
+        self.category.name = 'Гаджеты'
+        self.category.save()
+
+        self.assertEqual(search_products(Product.objects.all(), 'гаджеты').count(), 3)
+
+
+class ProductAutocompleteTests(SimpleAPITestCase):
+    """Тесты автодополнения названий товаров"""
+
+    def setUp(self):
+        super().setUp()
+        autocomplete_index.invalidate()
+        Product.objects.create(
+            name='Apple iPhone 15',
+            slug='iphone-15',
+            price=Decimal('900.00'),
+            category=self.category
+        )
+
+    def test_trie_matches_any_word_prefix(self):
+        """Тест префиксного дерева: совпадение с начала любого слова"""
+        trie = ProductNameTrie(max_results=2)
+        for i, name in enumerate(['Apple iPhone 15', 'Apple Watch', 'Apple TV']):
+            trie.insert({'id': i, 'name': name, 'slug': str(i)})
+
+        self.assertEqual([e['id'] for e in trie.lookup('iphone  1', 10)], [0])
+        self.assertEqual([e['id'] for e in trie.lookup('APP', 10)], [0, 1])
+        self.assertEqual(trie.lookup('samsung', 10), [])
+
+    def test_autocomplete_served_from_index(self):
+        """Тест: при полном каталоге в дереве запрос к БД не нужен"""
+        autocomplete_index.get_trie()
+        with self.assertNumQueries(0):
+            results = autocomplete_products(Product.objects.all(), 'iph')
+        self.assertEqual([e['slug'] for e in results], ['iphone-15'])
+
+    def test_index_rebuilt_after_product_change(self):
+        """Тест: новый товар виден в подсказках сразу после сохранения"""
+        autocomplete_index.get_trie()
+        Product.objects.create(name='iPad Air', slug='ipad-air', price=Decimal('700.00'), category=self.category)
+        results = autocomplete_products(Product.objects.all(), 'ipa')
+        self.assertEqual([e['slug'] for e in results], ['ipad-air'])
+
+    def test_stock_change_keeps_index(self):
+        """Тест: списание остатка не сбрасывает дерево, переименование сбрасывает"""
+        trie = autocomplete_index.get_trie()
+        product = Product.objects.get(slug='iphone-15')
+        product.stock = 5
+        product.save()
+        self.assertIs(autocomplete_index.get_trie(), trie)
+
+        product.name = 'Apple iPhone 16'
+        product.save(update_fields=['name'])
+        self.assertIsNot(autocomplete_index.get_trie(), trie)
+
+    def test_empty_prefix(self):
+        """Тест пустого префикса"""
+        self.assertEqual(autocomplete_products(Product.objects.all(), '   '), [])
+
+
 class CartAPITests(SimpleAPITestCase):
     """Тесты API для корзины"""
     
@@ -114,6 +349,30 @@ class CartAPITests(SimpleAPITestCase):
         """Тест расчета общей стоимости корзины"""
         self.cart.add_product(self.product, 2)
         self.assertEqual(self.cart.total_price, Decimal('200.00'))
+
+    def test_cart_summary_single_query(self):
+        """Тест: сумма и количества корзины считаются одним запросом"""
+        second = Product.objects.create(name='Чехол', slug='case', price=Decimal('15.50'), stock=10, category=self.category)
+        self.cart.add_product(self.product, 2)
+        self.cart.add_product(second, 3)
+
+        with self.assertNumQueries(1):
+            summary = self.cart.summary()
+        self.assertEqual(summary, {'total_price': Decimal('246.50'), 'items_count': 5, 'lines_count': 2})
+
+    def test_cart_with_totals_annotation(self):
+        """Тест аннотации корзин: пустая корзина дает нули"""
+        with self.assertNumQueries(1):
+            cart = Cart.objects.with_totals().get(pk=self.cart.pk)
+            self.assertEqual(cart.total_price, Decimal('0.00'))
+            self.assertEqual(cart.items_count, 0)
+
+        self.cart.add_product(self.product, 2)
+        cart = Cart.objects.with_totals().get(pk=self.cart.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.total_price, Decimal('200.00'))
+            self.assertEqual(cart.items_count, 2)
+            self.assertEqual(cart.lines_count, 1)
     
     def test_remove_product_from_cart(self):
         """Тест удаления товара из корзины"""
@@ -124,6 +383,149 @@ class CartAPITests(SimpleAPITestCase):
         self.assertEqual(self.cart.items.count(), 0)
 
 
+class CartBulkOperationsTests(SimpleAPITestCase):
+    """Тесты пакетного изменения корзины"""
+
+    def setUp(self):
+        super().setUp()
+        self.second = Product.objects.create(
+            name='Чехол', slug='case', price=Decimal('15.50'), stock=10, category=self.category
+        )
+
+    def test_apply_operations(self):
+        """Тест: добавление, изменение и удаление применяются по порядку"""
+        self.cart.add_product(self.product, 1)
+
+        self.cart.apply_operations([
+            {'action': 'add', 'product_id': self.product.id, 'quantity': 2},
+            {'action': 'set', 'product_id': self.second.id, 'quantity': 4},
+            {'action': 'add', 'product_id': self.second.id, 'quantity': 1},
+        ])
+
+        quantities = dict(self.cart.items.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.product.id: 3, self.second.id: 5})
+
+        self.cart.apply_operations([{'action': 'remove', 'product_id': self.product.id, 'quantity': 0}])
+        self.assertEqual(list(self.cart.items.values_list('product_id', flat=True)), [self.second.id])
+
+    def test_apply_operations_query_count(self):
+        """Тест: число запросов не зависит от количества операций"""
+        operations = [
+            {'action': 'set', 'product_id': self.product.id, 'quantity': 2},
+            {'action': 'set', 'product_id': self.second.id, 'quantity': 3},
+        ]
+        # Блокировка корзины, товары, текущие позиции, upsert (+ savepoint)
+        with self.assertNumQueries(6):
+            self.cart.apply_operations(operations)
+        self.assertEqual(self.cart.summary()['items_count'], 5)
+
+    def test_apply_operations_is_atomic(self):
+        """Тест: при ошибке ни одна операция не применяется"""
+        with self.assertRaises(DjangoValidationError):
+            self.cart.apply_operations([
+                {'action': 'set', 'product_id': self.product.id, 'quantity': 2},
+                {'action': 'set', 'product_id': self.second.id, 'quantity': 11},
+            ])
+        self.assertEqual(self.cart.items.count(), 0)
+
+        with self.assertRaises(DjangoValidationError):
+            self.cart.apply_operations([{'action': 'add', 'product_id': 999999, 'quantity': 1}])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GuestCartTests(SimpleAPITestCase):
+    """Тесты корзины гостя"""
+
+    def setUp(self):
+        super().setUp()
+        self.second = Product.objects.create(
+            name='Чехол', slug='case', price=Decimal('15.50'), stock=3, category=self.category
+        )
+        self.token = new_guest_cart_token()
+
+    def guest_request(self):
+        response = HttpResponse()
+        set_guest_cart_cookie(response, self.token)
+        request = RequestFactory().post('/api/auth/login/')
+        request.COOKIES[GUEST_CART_COOKIE] = response.cookies[GUEST_CART_COOKIE].value
+        return request
+
+    def test_guest_operations_do_not_touch_cart_tables(self):
+        """Тест: корзина гостя живет в кэше"""
+        with self.assertNumQueries(1):
+            apply_guest_operations(self.token, [
+                {'action': 'add', 'product_id': self.product.id, 'quantity': 2},
+                {'action': 'set', 'product_id': self.second.id, 'quantity': 1},
+            ])
+        self.assertEqual(get_guest_cart(self.token), {self.product.id: 2, self.second.id: 1})
+        self.assertEqual(CartItem.objects.count(), 0)
+
+        apply_guest_operations(self.token, [{'action': 'remove', 'product_id': self.second.id, 'quantity': 0}])
+        self.assertEqual(get_guest_cart(self.token), {self.product.id: 2})
+
+    def test_guest_operations_validate_stock(self):
+        """Тест: превышение остатка отклоняется, корзина не меняется"""
+        with self.assertRaises(DjangoValidationError):
+            apply_guest_operations(self.token, [{'action': 'set', 'product_id': self.second.id, 'quantity': 4}])
+        self.assertEqual(get_guest_cart(self.token), {})
+
+    def test_merge_on_login(self):
+        """Тест: при входе корзина гостя добавляется к корзине пользователя"""
+        self.cart.add_product(self.product, 1)
+        apply_guest_operations(self.token, [
+            {'action': 'add', 'product_id': self.product.id, 'quantity': 2},
+            {'action': 'add', 'product_id': self.second.id, 'quantity': 3},
+        ])
+        # Остаток уменьшился после добавления в корзину гостя — количество урезается
+        Product.objects.filter(pk=self.second.pk).update(stock=2)
+
+        self.assertTrue(merge_guest_cart(self.guest_request(), self.user))
+
+        quantities = dict(self.cart.items.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.product.id: 3, self.second.id: 2})
+        self.assertEqual(get_guest_cart(self.token), {})
+
+    def test_merge_without_guest_cart(self):
+        """Тест: вход без корзины гостя ничего не меняет"""
+        request = RequestFactory().post('/api/auth/login/')
+        with self.assertNumQueries(0):
+            self.assertFalse(merge_guest_cart(request, self.user))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CartCountCacheTests(SimpleAPITestCase):
+    """Тесты счетчика товаров для значка корзины"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_add_product_increments_counter(self):
+        """Тест: добавление товара увеличивает счетчик после коммита"""
+        cache_cart_count(self.user.id, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cart.add_product(self.product, 2)
+        self.assertEqual(get_cached_cart_count(self.user.id), 3)
+
+    def test_missing_counter_not_created(self):
+        """Тест: без счетчика в кэше инкремент ничего не создает"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cart.add_product(self.product, 2)
+        self.assertIsNone(get_cached_cart_count(self.user.id))
+
+    def test_clear_and_bulk_update_counter(self):
+        """Тест: очистка обнуляет счетчик, пакетное изменение сбрасывает его"""
+        self.cart.add_product(self.product, 2)
+        cache_cart_count(self.user.id, 2)
+        self.cart.apply_operations([{'action': 'add', 'product_id': self.product.id, 'quantity': 1}])
+        self.assertIsNone(get_cached_cart_count(self.user.id))
+
+        cache_cart_count(self.user.id, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cart.clear()
+        self.assertEqual(get_cached_cart_count(self.user.id), 0)
+
+
 class OrderAPITests(SimpleAPITestCase):
     """Тесты API для заказов"""
     
@@ -3,15 +3,52 @@
 """
 from django.test import TestCase, override_settings
 from django.core.cache import cache
+from django.core.management import call_command
+from django.http import Http404
+from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
+import time
+from datetime import timedelta
+from io import StringIO
+from decimal import Decimal
+from django.utils import timezone
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView, exception_handler
 
 from shop.cache import (
     get_cached_products_list, cache_products_list,
     get_cached_product_detail, cache_product_detail,
-    invalidate_product_cache
+    get_cached_product_details, cache_product_details,
+    invalidate_product_cache, get_catalog_version,
+    get_cached_products_page, cache_products_page,
+    cache_decorator, xfetch_should_recompute, get_cached_payment_settings, cache_payment_settings,
+    LocalLRUCache, local_cache, xfetch_set, bump_catalog_version,
+    tag_cache_key, invalidate_tags, invalidate_user_cache, cache_user_orders, cache_user_cart,
+    get_cached_user_orders, get_cached_user_cart,
+    CACHE_CODECS, CompressedCodec, JSONCodec,
+    get_cached_categories_list, cache_categories_list,
+    get_cached_category_detail, cache_category_detail, products_list_key,
+    _acquire_rebuild_lock, _release_rebuild_lock, _lock_tokens, release_rebuild_locks, cache_key_generator,
+    cache_cart_count, get_cached_cart_count, incr_cart_count, get_missing_keys,
 )
-from shop.models import Product, Category
+from shop.cache_metrics import (
+    cache_metrics, collect_cache_metrics, render_prometheus_metrics, summarize_cache_metrics,
+    METRICS_PROCESS_KEY, METRICS_PROCESSES_KEY,
+)
+from shop.models import Product, Category, Cart, CartItem
+from shop.cart_store import cart_store, CartLocked, ADD_SCRIPT, LOCKED, LOADED_FIELD
+from shop.views_metrics import CacheMetricsView
+from shop.conditional import catalog_condition, get_catalog_state
+from shop import warmup
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
 
 User = get_user_model()
 
@@ -21,6 +58,7 @@ class CacheTestCase(TestCase):
     
     def setUp(self):
         cache.clear()
+        local_cache.clear()
         
         self.category = Category.objects.create(
             name='Тестовая категория',
@@ -85,6 +123,40 @@ class ProductDetailCacheTests(CacheTestCase):
         self.assertIsNone(cached_data)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductDetailsBulkCacheTests(CacheTestCase):
+    """Тесты пакетного чтения и записи карточек товаров"""
+
+    def test_bulk_roundtrip(self):
+        """Тест: set_many/get_many, отсутствующие товары не возвращаются"""
+        cache_product_details({1: b'{"id":1}', 2: b'{"id":2}'})
+        local_cache.clear()
+
+        with patch('shop.cache.cache.get_many', wraps=cache.get_many) as get_many:
+            details = get_cached_product_details([1, 2, 3])
+        self.assertEqual(details, {1: b'{"id":1}', 2: b'{"id":2}'})
+        self.assertEqual(get_many.call_count, 1)
+
+        # Совместимо с поштучным чтением
+        self.assertEqual(get_cached_product_detail(2), b'{"id":2}')
+
+    def test_local_tier_skips_shared_cache(self):
+        """Тест: найденные в локальном кэше карточки не запрашиваются из общего"""
+        cache_product_details({1: b'{"id":1}'})
+
+        with patch('shop.cache.cache.get_many', wraps=cache.get_many) as get_many:
+            self.assertEqual(get_cached_product_details([1]), {1: b'{"id":1}'})
+        get_many.assert_not_called()
+
+    def test_bulk_cached_invalidated_by_tag(self):
+        """Тест: карточки из пакетной записи сбрасываются по тегу товара"""
+        cache_product_details({self.product.id: b'{}', 999: b'{}'})
+
+        invalidate_tags(f"product:{self.product.id}")
+
+        self.assertEqual(list(get_cached_product_details([self.product.id, 999])), [999])
+
+
 class ProductCacheInvalidationTests(CacheTestCase):
     """Тесты инвалидации кэша товаров"""
     
@@ -99,4 +171,873 @@ class ProductCacheInvalidationTests(CacheTestCase):
         invalidate_product_cache(self.product.id)
         
         cached_data = get_cached_product_detail(self.product.id)
-        self.assertIsNone(cached_data)
\ No newline at end of file
+        self.assertIsNone(cached_data)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogVersionCacheTests(CacheTestCase):
+    """Тесты поколений каталога и защиты от одновременной пересборки"""
+
+    def test_invalidation_bumps_version(self):
+        """Тест: инвалидация переключает списки на новое поколение"""
+        version = get_catalog_version()
+        cache_products_list(['old'], version=version)
+        cache_products_page({'category': 'x'}, ['old page'], version=version)
+
+        invalidate_product_cache(self.product.id)
+
+        self.assertEqual(get_catalog_version(), version + 1)
+        self.assertEqual(get_cached_products_list(version), ['old'])
+
+    def test_single_flight_rebuild(self):
+        """Тест: пересобирает один воркер, остальные получают предыдущее поколение"""
+        version = get_catalog_version()
+        cache_products_list(['old'], version=version)
+        cache_products_page({'category': 'x'}, ['old page'], version=version)
+        invalidate_product_cache()
+        version = get_catalog_version()
+
+        # Первый промах — блокировка на пересборку
+        self.assertIsNone(get_cached_products_list(version))
+        self.assertIsNone(get_cached_products_page({'category': 'x'}, version))
+        # Пока идет пересборка — предыдущее поколение
+        self.assertEqual(get_cached_products_list(version), ['old'])
+        self.assertEqual(get_cached_products_page({'category': 'x'}, version), ['old page'])
+
+        cache_products_list(['new'], version=version)
+        self.assertEqual(get_cached_products_list(), ['new'])
+
+    def test_unlock_keeps_lock_of_another_worker(self):
+        """Тест: блокировку, перешедшую к другому воркеру после истечения, set_and_unlock не снимает"""
+        version = get_catalog_version()
+        lock_key = f"{products_list_key(version)}:lock"
+        self.assertIsNone(get_cached_products_list(version))
+
+        # Пересборка затянулась: блокировка истекла, и ее взял другой воркер
+        cache.set(lock_key, 'other-worker', 30)
+        cache_products_list(['new'], version=version)
+
+        self.assertEqual(cache.get(lock_key), 'other-worker')
+        self.assertEqual(get_cached_products_list(version), ['new'])
+
+    def test_unlock_releases_own_lock(self):
+        """Тест: свою блокировку set_and_unlock снимает"""
+        version = get_catalog_version()
+        lock_key = f"{products_list_key(version)}:lock"
+        self.assertIsNone(get_cached_products_list(version))
+        self.assertIsNotNone(cache.get(lock_key))
+
+        cache_products_list(['new'], version=version)
+        self.assertIsNone(cache.get(lock_key))
+
+    def test_failed_rebuild_releases_lock(self):
+        """Тест: если пересборка упала (404), блокировка и токен потока снимаются"""
+        lock_key = f"product:detail:{self.product.id}:lock"
+
+        with self.assertRaises(Http404), release_rebuild_locks():
+            self.assertIsNone(get_cached_product_detail(self.product.id))
+            self.assertIsNotNone(cache.get(lock_key))
+            raise Http404
+
+        self.assertIsNone(cache.get(lock_key))
+        self.assertNotIn(f"product:detail:{self.product.id}", _lock_tokens())
+
+    def test_detail_miss_waits_for_rebuild(self):
+        """Тест: без предыдущего поколения воркер ждет пересборку владельца блокировки"""
+        lock_key = f"product:detail:{self.product.id}:lock"
+        cache.set(lock_key, 'other-worker', 30)
+
+        def rebuild_finished(_):
+            xfetch_set(f"product:detail:{self.product.id}", b'{"id": 1}', 60)
+
+        with patch('shop.cache.time.sleep', side_effect=rebuild_finished):
+            self.assertEqual(get_cached_product_detail(self.product.id), b'{"id": 1}')
+
+    def test_detail_miss_stops_waiting_for_failed_rebuild(self):
+        """Тест: блокировку сняли без значения — ждать дальше нечего"""
+        lock_key = f"product:detail:{self.product.id}:lock"
+        cache.set(lock_key, 'other-worker', 30)
+
+        with patch('shop.cache.time.sleep', side_effect=lambda _: cache.delete(lock_key)) as sleep:
+            self.assertIsNone(get_cached_product_detail(self.product.id))
+        self.assertEqual(sleep.call_count, 1)
+
+    @skipUnless(fakeredis, 'fakeredis не установлен')
+    def test_redis_lock_compare_and_delete(self):
+        """Тест: на Redis блокировка снимается скриптом только по своему токену"""
+        client = fakeredis.FakeStrictRedis()
+        with patch('shop.cache._get_redis_client', return_value=client):
+            token = _acquire_rebuild_lock('key')
+            self.assertIsNotNone(token)
+            self.assertIsNone(_acquire_rebuild_lock('key'))
+
+            self.assertFalse(_release_rebuild_lock('key', 'other-token'))
+            self.assertTrue(client.exists(cache.make_key('key:lock')))
+            self.assertTrue(_release_rebuild_lock('key', token))
+            self.assertFalse(client.exists(cache.make_key('key:lock')))
+
+
+class LocalLRUCacheTests(TestCase):
+    """Тесты локального LRU-кэша процесса"""
+
+    def test_lru_eviction(self):
+        """Тест: при переполнении вытесняется давно не читанное значение"""
+        local = LocalLRUCache(maxsize=2, timeout=60)
+        local.set('a', 1, 1)
+        local.set('b', 2, 1)
+        local.get('a', 1)
+        local.set('c', 3, 1)
+
+        self.assertEqual(local.get('a', 1), 1)
+        self.assertIsNone(local.get('b', 1))
+        self.assertEqual(local.get('c', 1), 3)
+
+    def test_version_and_timeout(self):
+        """Тест: значение другого поколения или с истекшим сроком не читается"""
+        local = LocalLRUCache(maxsize=2, timeout=60)
+        local.set('a', 1, 1)
+        self.assertIsNone(local.get('a', 2))
+
+        local.set('b', 2, 1)
+        with patch('shop.cache.time.monotonic', return_value=time.monotonic() + 120):
+            self.assertIsNone(local.get('b', 1))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TwoTierCacheTests(CacheTestCase):
+    """Тесты двухуровневого кэша списков и карточек товаров"""
+
+    def test_hot_read_served_locally(self):
+        """Тест: повторное чтение не обращается к общему кэшу за значением"""
+        version = get_catalog_version()
+        cache_products_list(['product'], version=version)
+
+        with patch('shop.cache.cache.get') as shared_get:
+            self.assertEqual(get_cached_products_list(version), ['product'])
+        shared_get.assert_not_called()
+
+    def test_local_copy_dropped_after_version_bump(self):
+        """Тест: после смены поколения другим процессом локальная карточка не используется"""
+        cache_product_detail(self.product.id, {'name': 'old'})
+        self.assertEqual(get_cached_product_detail(self.product.id), {'name': 'old'})
+
+        # Другой процесс обновил карточку в общем кэше и сменил поколение
+        xfetch_set(f'product:detail:{self.product.id}', {'name': 'new'}, 60)
+        bump_catalog_version()
+
+        self.assertEqual(get_cached_product_detail(self.product.id), {'name': 'new'})
+
+    def test_legacy_entries_are_misses(self):
+        """Тест: карточка в формате до XFetch (голый dict) считается промахом, а не падает"""
+        key = f'product:detail:{self.product.id}'
+        cache.set(key, {'id': self.product.id, 'name': 'old'}, 3600)
+        local_cache.clear()
+
+        self.assertEqual(get_cached_product_details([self.product.id]), {})
+        self.assertEqual(get_missing_keys([key]), [key])
+        self.assertIsNone(get_cached_product_detail(self.product.id))
+
+        cache_product_detail(self.product.id, b'{"id": 1}')
+        self.assertEqual(get_cached_product_detail(self.product.id), b'{"id": 1}')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class XFetchTests(TestCase):
+    """Тесты вероятностного досрочного пересчета (XFetch)"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_should_recompute(self):
+        """Тест: далеко до истечения — не пересчитываем, у самого истечения — пересчитываем"""
+        now = time.time()
+        self.assertFalse(xfetch_should_recompute({'delta': 0.5, 'expiry': now + 3600}))
+        self.assertFalse(xfetch_should_recompute({'delta': 0, 'expiry': now + 1}))
+        with patch('shop.cache.random.random', return_value=0.999):
+            self.assertTrue(xfetch_should_recompute({'delta': 0.5, 'expiry': now + 1}))
+
+    def test_early_recompute_by_single_worker(self):
+        """Тест: досрочно пересчитывает один воркер, остальные получают текущее значение"""
+        cache_payment_settings('stripe', {'key': 'old'}, compute_time=0.5)
+
+        with patch('shop.cache.xfetch_should_recompute', return_value=True):
+            self.assertIsNone(get_cached_payment_settings('stripe'))
+            self.assertEqual(get_cached_payment_settings('stripe'), {'key': 'old'})
+
+        cache_payment_settings('stripe', {'key': 'new'})
+        self.assertEqual(get_cached_payment_settings('stripe'), {'key': 'new'})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StaleWhileRevalidateTests(TestCase):
+    """Тесты режима stale-while-revalidate в cache_decorator"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+        @cache_decorator(timeout=600, key_prefix='test', soft_timeout=60)
+        def compute(value):
+            self.calls.append(value)
+            return len(self.calls)
+
+        self.compute = compute
+
+    def test_fresh_value_from_cache(self):
+        """Тест: до soft_timeout значение берется из кэша"""
+        self.assertEqual(self.compute('a'), 1)
+        self.assertEqual(self.compute('a'), 1)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_stale_value_refreshed_in_background(self):
+        """Тест: после soft_timeout отдается старое значение, пересчет — один в фоне"""
+        self.compute('a')
+        later = time.time() + 120
+
+        with patch('shop.cache.time.time', return_value=later), \
+                patch('shop.cache.threading.Thread') as thread:
+            self.assertEqual(self.compute('a'), 1)
+            self.assertEqual(self.compute('a'), 1)
+            self.assertEqual(thread.call_count, 1)
+
+            with patch('shop.cache.connection'):
+                thread.call_args.kwargs['target']()
+
+        self.assertEqual(self.compute('a'), 2)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_refresh_keeps_lock_of_another_worker(self):
+        """Тест: фоновый пересчет не снимает блокировку, перешедшую к другому воркеру"""
+        self.compute('a')
+        lock_key = f"{cache_key_generator('test:compute', 'a')}:lock"
+        later = time.time() + 120
+
+        with patch('shop.cache.time.time', return_value=later), \
+                patch('shop.cache.threading.Thread') as thread:
+            self.compute('a')
+            self.assertIsNotNone(cache.get(lock_key))
+            cache.set(lock_key, 'other-worker', 30)
+
+            with patch('shop.cache.connection'):
+                thread.call_args.kwargs['target']()
+
+        self.assertEqual(cache.get(lock_key), 'other-worker')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TagInvalidationTests(CacheTestCase):
+    """Тесты инвалидации кэша по тегам"""
+
+    user_id = 13
+
+    def test_invalidate_tag_deletes_only_its_keys(self):
+        """Тест: удаляются ключи тега, остальные остаются"""
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        tag_cache_key('a', ['category:7'])
+        tag_cache_key('b', ['category:7', 'product:42'])
+        tag_cache_key('c', ['product:42'])
+
+        invalidate_tags('category:7')
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_invalidate_user_cache(self):
+        """Тест: инвалидация пользователя удаляет его заказы и корзину"""
+        cache_user_orders(self.user_id, ['order'])
+        cache_user_cart(self.user_id, {'items': []})
+        cache_user_cart(self.user_id + 1, {'items': []})
+
+        invalidate_user_cache(self.user_id)
+
+        self.assertIsNone(get_cached_user_orders(self.user_id))
+        self.assertIsNone(get_cached_user_cart(self.user_id))
+        self.assertEqual(get_cached_user_cart(self.user_id + 1), {'items': []})
+
+    def test_invalidate_product_cache_by_tag(self):
+        """Тест: инвалидация товара удаляет его карточку"""
+        cache_product_detail(self.product.id, {'name': 'old'})
+        invalidate_product_cache(self.product.id)
+        self.assertIsNone(get_cached_product_detail(self.product.id))
+
+    def test_redis_pipeline(self):
+        """Тест: на Redis теги — множества, инвалидация одним pipeline"""
+        pipeline = MagicMock()
+        pipeline.execute.return_value = [{b'a', b'b'}]
+        client = MagicMock()
+        client.pipeline.return_value = pipeline
+
+        with patch('shop.cache._get_redis_client', return_value=client), \
+                patch('shop.cache.cache.delete_many') as delete_many:
+            tag_cache_key('a', ['product:42'])
+            pipeline.sadd.assert_called_once_with(cache.make_key('tag:product:42'), 'a')
+
+            invalidate_tags('product:42')
+            self.assertEqual(sorted(delete_many.call_args.args[0]), ['a', 'b', 'tag:product:42'])
+
+    @skipUnless(fakeredis, 'fakeredis не установлен')
+    def test_redis_tag_ttl_only_extended(self):
+        """Тест: регистрация короткоживущего ключа не сокращает срок множества тега"""
+        client = fakeredis.FakeStrictRedis()
+        tag_key = cache.make_key('tag:product:42')
+        with patch('shop.cache._get_redis_client', return_value=client):
+            tag_cache_key('long', ['product:42'], timeout=3600)
+            tag_cache_key('short', ['product:42'], timeout=60)
+            self.assertGreater(client.ttl(tag_key), 60)
+
+            tag_cache_key('longer', ['product:42'], timeout=7200)
+            self.assertGreater(client.ttl(tag_key), 3600)
+            self.assertEqual(client.smembers(tag_key), {b'long', b'short', b'longer'})
+
+
+class CacheCodecTests(TestCase):
+    """Тесты кодеков кэша"""
+
+    def test_json_codec_decimal_and_datetime(self):
+        """Тест: Decimal и datetime кодируются так же, как их отдает DRF"""
+        now = timezone.now()
+        data = JSONCodec().decode(JSONCodec().encode([{'price': Decimal('10.50'), 'updated': now}]))
+        self.assertEqual(data[0]['price'], '10.50')
+        self.assertTrue(data[0]['updated'].startswith(now.strftime('%Y-%m-%dT%H:%M:%S')))
+
+    def test_compression_above_threshold(self):
+        """Тест: значения больше порога сжимаются, меньше — нет"""
+        codec = CompressedCodec(JSONCodec(), threshold=100)
+        small = {'name': 'товар'}
+        large = [{'name': 'товар', 'description': 'описание ' * 20}] * 50
+
+        self.assertEqual(codec.encode(small)[:1], CompressedCodec.RAW)
+        encoded = codec.encode(large)
+        self.assertNotEqual(encoded[:1], CompressedCodec.RAW)
+        self.assertLess(len(encoded), len(JSONCodec().encode(large)))
+        self.assertEqual(codec.decode(encoded), large)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_products_list_stored_encoded(self):
+        """Тест: список товаров хранится в кэше байтами кодека и читается обратно"""
+        cache.clear()
+        local_cache.clear()
+        version = get_catalog_version()
+        data = [{'id': 1, 'price': '100.00'}]
+        cache_products_list(data, version=version)
+
+        entry = cache.get(f'products:list:v{version}')
+        self.assertIn(entry['codec'], CACHE_CODECS)
+        self.assertIsInstance(entry['value'], bytes)
+
+        local_cache.clear()
+        self.assertEqual(get_cached_products_list(version), data)
+
+    def test_benchmark_command(self):
+        """Тест: сравнение кодеков проходит по всем кодекам, включая raw"""
+        out = StringIO()
+        call_command('benchmark_cache_codecs', products=3, repeat=1, stdout=out)
+        for name in CACHE_CODECS:
+            self.assertIn(name, out.getvalue())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RenderedPayloadCacheTests(CacheTestCase):
+    """Тесты кэширования отрендеренных байтов JSON"""
+
+    def test_rendered_bytes_stored_as_is(self):
+        """Тест: байты ответа хранятся без перекодирования и возвращаются теми же"""
+        body = '[{"id":1,"name":"Товар"}]'.encode()
+        cache_product_detail(self.product.id, body)
+
+        entry = cache.get(f'product:detail:{self.product.id}')
+        self.assertEqual(entry['codec'], 'raw+compressed')
+        local_cache.clear()
+        self.assertEqual(get_cached_product_detail(self.product.id), body)
+
+    def test_category_cache_invalidated_on_change(self):
+        """Тест: изменение категории сбрасывает список и карточку (в том числе по старому slug)"""
+        cache_categories_list(b'[]')
+        cache_category_detail(self.category.id, self.category.slug, b'{}')
+
+        self.category.slug = 'renamed'
+        self.category.save()
+
+        self.assertIsNone(get_cached_categories_list())
+        self.assertIsNone(get_cached_category_detail('test-category'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CacheWarmupTests(CacheTestCase):
+    """Тесты прогрева кэша"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch(
+            'shop.warmup._product_queryset',
+            return_value=Product.objects.filter(available=True).prefetch_related('images'),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.request = warmup._build_request()
+
+    def test_warm_lists(self):
+        """Тест: списки товаров и категорий попадают в кэш готовыми байтами"""
+        self.assertEqual(warmup.warm_products_list(self.request), 1)
+        self.assertEqual(warmup.warm_categories_list(self.request), 1)
+
+        self.assertIn('Тестовый товар'.encode(), get_cached_products_list())
+        self.assertIn(b'test-category', get_cached_categories_list())
+
+    def test_only_missing_keys_rebuilt(self):
+        """Тест: без force уже закэшированные ключи не пересобираются"""
+        warmup.warm_products_list(self.request)
+        self.assertEqual(warmup.warm_products_list(self.request), 0)
+        self.assertEqual(warmup.warm_products_list(self.request, force=True), 1)
+
+        cache_product_detail(self.product.id, b'{}')
+        self.assertEqual(warmup._missing_product_ids([self.product.id, 999]), [999])
+
+    def test_product_details_batch(self):
+        """Тест: пачка карточек — один запрос товаров (плюс prefetch картинок) на всю пачку"""
+        Product.objects.create(name='Второй товар', slug='second', category=self.category, price=5, stock=1)
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+
+        with patch('shop.warmup.connection.close'), self.assertNumQueries(2):
+            warmup._warm_products_batch(product_ids, self.request)
+        self.assertEqual(set(get_cached_product_details(product_ids)), set(product_ids))
+
+
+class CatalogView(APIView):
+    """Минимальный view каталога с условным GET"""
+    permission_classes = [AllowAny]
+
+    @catalog_condition(Product)
+    def get(self, request):
+        return Response(list(Product.objects.values_list('name', flat=True)))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogConditionalGetTests(CacheTestCase):
+    """Тесты ETag / Last-Modified для API каталога"""
+
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = CatalogView.as_view()
+
+    def test_not_modified_with_matching_etag(self):
+        """Тест: 304 без обращения к БД при совпадающем ETag"""
+        response = self.view(self.factory.get('/api/products/'))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.view(self.factory.get('/api/products/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_after_product_update(self):
+        """Тест: изменение товара меняет ETag"""
+        etag = self.view(self.factory.get('/api/products/'))['ETag']
+
+        self.product.price = 150
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+        response = self.view(self.factory.get('/api/products/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_orm_save_invalidates_cached_bodies(self):
+        """Тест: сохранение через ORM сбрасывает кэш тел ответов вместе с ETag после коммита"""
+        version = get_catalog_version()
+        cache_product_detail(self.product.id, b'{}')
+
+        self.product.price = 150
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+            # До коммита кэш не трогаем
+            self.assertEqual(get_catalog_version(), version)
+
+        self.assertGreater(get_catalog_version(), version)
+        self.assertIsNone(get_cached_product_detail(self.product.id))
+
+    def test_stock_change_keeps_catalog_cache(self):
+        """Тест: списание остатка (его нет в ответах API) не сбрасывает кэш каталога"""
+        version = get_catalog_version()
+
+        self.product.stock -= 1
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.product.save()
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_catalog_version(), version)
+
+    def test_not_modified_since_and_deletion(self):
+        """Тест If-Modified-Since, в том числе после удаления товара"""
+        last_modified = self.view(self.factory.get('/api/products/'))['Last-Modified']
+
+        response = self.view(self.factory.get('/api/products/', HTTP_IF_MODIFIED_SINCE=last_modified))
+        self.assertEqual(response.status_code, 304)
+
+        with patch('shop.cache.timezone.now', return_value=timezone.now() + timedelta(seconds=5)), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+
+        response = self.view(self.factory.get('/api/products/', HTTP_IF_MODIFIED_SINCE=last_modified))
+        self.assertEqual(response.status_code, 200)
+
+    def test_category_state_cached(self):
+        """Тест: состояние категорий считается один раз и сбрасывается при изменении"""
+        self.assertEqual(get_catalog_state(Category)['count'], 1)
+        with self.assertNumQueries(0):
+            get_catalog_state(Category)
+
+        Category.objects.create(name='Одежда', slug='clothes')
+        self.assertEqual(get_catalog_state(Category)['count'], 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CacheMetricsTests(CacheTestCase):
+    """Тесты метрик кэша по семействам ключей"""
+
+    def setUp(self):
+        super().setUp()
+        cache_metrics.reset()
+        self.addCleanup(cache_metrics.reset)
+
+    def test_hits_misses_and_sets_per_family(self):
+        """Тест: попадания, промахи и записи считаются по семейству ключа"""
+        get_cached_user_orders(13)
+        cache_user_orders(13, [{'id': 1}])
+        get_cached_user_orders(13)
+
+        family = cache_metrics.snapshot()['user:orders']
+        self.assertEqual((family['hits'], family['misses'], family['sets']), (1, 1, 1))
+        self.assertEqual(family['get_latency']['count'], 2)
+        self.assertEqual(family['set_latency']['count'], 1)
+
+    def test_cart_count_metrics(self):
+        """Тест: счетчик корзины учитывается в метриках, incr не ломает число в кэше"""
+        get_cached_cart_count(13)
+        incr_cart_count(13, 1)
+        cache_cart_count(13, 2)
+        incr_cart_count(13, 3)
+
+        self.assertEqual(get_cached_cart_count(13), 5)
+        family = cache_metrics.snapshot()['user:cart_count']
+        self.assertEqual((family['hits'], family['misses'], family['sets']), (1, 2, 2))
+
+    def test_local_hits_and_payload_size(self):
+        """Тест: чтение из локального кэша и размер закодированного значения"""
+        cache_product_detail(self.product.id, b'{"id": 1}')
+        get_cached_product_detail(self.product.id)
+
+        family = cache_metrics.snapshot()['product:detail']
+        self.assertEqual(family['local_hits'], 1)
+        self.assertEqual(family['payload_bytes']['count'], 1)
+        # Байт-маркер кодека + сами данные
+        self.assertEqual(family['payload_bytes']['sum'], len(b'{"id": 1}') + 1)
+
+    def test_decorator_family(self):
+        """Тест: у cache_decorator семейство — префикс и имя функции"""
+        @cache_decorator(timeout=60, key_prefix='reports')
+        def monthly(month):
+            return month
+
+        monthly(1)
+        monthly(1)
+        monthly(2)
+
+        family = cache_metrics.snapshot()['reports:monthly']
+        self.assertEqual((family['hits'], family['misses'], family['sets']), (1, 2, 2))
+
+    def test_collect_merges_processes(self):
+        """Тест: снимки других воркеров из общего кэша суммируются"""
+        get_cached_user_cart(13)
+        other = {'user:cart': cache_metrics.snapshot()['user:cart']}
+        cache.set(METRICS_PROCESS_KEY.format(process='other:1'), other, 60)
+        cache.set(METRICS_PROCESSES_KEY, {'other:1': time.time()}, 60)
+
+        metrics = collect_cache_metrics()
+        self.assertEqual(metrics['processes'], 2)
+        self.assertEqual(metrics['families']['user:cart']['misses'], 2)
+
+    def test_prometheus_format(self):
+        """Тест: текстовый формат Prometheus с кумулятивными корзинами"""
+        get_cached_user_cart(13)
+        cache_user_cart(13, {'items': []})
+        text = render_prometheus_metrics(cache_metrics.snapshot())
+
+        self.assertIn('shop_cache_requests_total{family="user:cart",result="miss"} 1', text)
+        self.assertIn('shop_cache_sets_total{family="user:cart"} 1', text)
+        self.assertIn('shop_cache_get_duration_seconds_bucket{family="user:cart",le="+Inf"} 1', text)
+        self.assertIn('# TYPE shop_cache_payload_bytes histogram', text)
+
+        rows = summarize_cache_metrics(cache_metrics.snapshot())
+        self.assertEqual(rows[0]['family'], 'user:cart')
+        self.assertEqual(rows[0]['hit_ratio'], 0)
+
+    @override_settings(CACHE_METRICS_TOKEN='secret')
+    def test_metrics_endpoint_token(self):
+        """Тест: эндпоинт метрик доступен только с токеном сборщика"""
+        view = CacheMetricsView.as_view()
+        factory = APIRequestFactory()
+
+        response = view(factory.get('/api/metrics/cache/'))
+        self.assertIn(response.status_code, (401, 403))
+
+        response = view(factory.get('/api/metrics/cache/', HTTP_X_METRICS_TOKEN='secret'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+
+class CartStoreTests(TestCase):
+    """Тесты горячего хранилища корзин"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Категория', slug='category')
+        self.product = Product.objects.create(
+            name='Товар', slug='product', price=Decimal('10.00'), stock=50, category=self.category
+        )
+        self.other = Product.objects.create(
+            name='Другой', slug='other', price=Decimal('5.00'), stock=50, category=self.category
+        )
+        self.user = User.objects.create_user(email='cart@example.com', password='testpass123')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def redis_client(self, dirty, items):
+        client = MagicMock()
+        client.spop.return_value = dirty
+        client.srem.return_value = len(dirty)
+        client.hgetall.return_value = items
+        return client
+
+    def test_disabled_without_redis(self):
+        """Тест: без Redis корзина пишется сразу в БД"""
+        self.assertFalse(cart_store.enabled)
+        item = self.cart.add_product(self.product, 2)
+        self.assertIsNotNone(item.pk)
+        self.assertFalse(cart_store.materialize(self.cart))
+
+    def test_replace_items(self):
+        """Тест: состояние из Redis заменяет позиции корзины, удаленные товары пропускаются"""
+        CartItem.objects.create(cart=self.cart, product=self.other, quantity=1)
+
+        self.cart.replace_items({self.product.id: 3, 999999: 1})
+
+        self.assertEqual(dict(self.cart.items.values_list('product_id', 'quantity')), {self.product.id: 3})
+
+    def test_replace_items_drops_unavailable_and_clamps(self):
+        """Тест: снятые с продажи товары отбрасываются, количество урезается до остатка"""
+        Product.objects.filter(pk=self.other.pk).update(available=False)
+
+        written = self.cart.replace_items({self.product.id: 80, self.other.id: 1})
+
+        self.assertEqual(written, {self.product.id: 50})
+        self.assertEqual(dict(self.cart.items.values_list('product_id', 'quantity')), {self.product.id: 50})
+
+    def test_add_product_checks_resulting_total(self):
+        """Тест: остаток проверяется по итоговому количеству, превышение откатывается"""
+        with patch('shop.cart_store._get_redis_client', return_value=MagicMock()), \
+                patch.object(cart_store, '_increment', side_effect=[51, 41]) as increment:
+            with self.assertRaises(ValidationError):
+                cart_store.add_product(self.cart, self.product, 10)
+
+        self.assertEqual(increment.call_count, 2)
+        self.assertEqual(increment.call_args.args[3], -10)
+
+    def test_flush_dirty_carts(self):
+        """Тест: задача сброса записывает измененные корзины в БД"""
+        client = self.redis_client(
+            [str(self.cart.id).encode()],
+            {b'loaded': b'1', str(self.product.id).encode(): b'4'}
+        )
+        with patch('shop.cart_store._get_redis_client', return_value=client):
+            self.assertEqual(cart_store.flush(), 1)
+
+        self.assertEqual(dict(self.cart.items.values_list('product_id', 'quantity')), {self.product.id: 4})
+
+    def test_flush_skips_expired_cart(self):
+        """Тест: истекший хеш не затирает корзину в БД"""
+        CartItem.objects.create(cart=self.cart, product=self.other, quantity=2)
+        client = self.redis_client([str(self.cart.id).encode()], {})
+        with patch('shop.cart_store._get_redis_client', return_value=client):
+            self.assertEqual(cart_store.flush(), 0)
+
+        self.assertEqual(self.cart.items.count(), 1)
+
+    def test_materialize_clean_cart(self):
+        """Тест: корзина без несохраненных изменений не трогает БД"""
+        client = self.redis_client([], {})
+        with patch('shop.cart_store._get_redis_client', return_value=client), self.assertNumQueries(0):
+            self.assertFalse(cart_store.materialize(self.cart))
+        client.hgetall.assert_not_called()
+
+
+@skipUnless(fakeredis, 'fakeredis не установлен')
+class CartStoreRedisTests(TestCase):
+    """Тесты хранилища корзин на настоящих Lua-скриптах (fakeredis)"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Категория', slug='category')
+        self.product = Product.objects.create(
+            name='Товар', slug='product', price=Decimal('10.00'), stock=50, category=self.category
+        )
+        self.other = Product.objects.create(
+            name='Другой', slug='other', price=Decimal('5.00'), stock=50, category=self.category
+        )
+        self.user = User.objects.create_user(email='cart@example.com', password='testpass123')
+        self.cart = Cart.objects.create(user=self.user)
+
+        self.client = fakeredis.FakeStrictRedis()
+        patcher = patch('shop.cart_store._get_redis_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Скрипты, зарегистрированные на другом клиенте, не переиспользуем
+        scripts = patch.object(cart_store, '_scripts', {})
+        scripts.start()
+        self.addCleanup(scripts.stop)
+
+    def db_items(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+    def hash_items(self):
+        data = self.client.hgetall(cart_store._items_key(self.cart.id))
+        return {int(field): int(value) for field, value in data.items() if field.decode() != LOADED_FIELD}
+
+    def is_dirty(self):
+        return bool(self.client.sismember(cart_store._dirty_key(), self.cart.id))
+
+    def test_add_loads_cart_from_db(self):
+        """Тест: первое изменение поднимает корзину из БД, дальше — только Redis"""
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+
+        self.assertEqual(cart_store.add_product(self.cart, self.product, 3), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_store.add_product(self.cart, self.other, 1), 1)
+
+        self.assertEqual(self.hash_items(), {self.product.id: 5, self.other.id: 1})
+        self.assertTrue(self.is_dirty())
+        self.assertEqual(self.db_items(), {self.product.id: 2})
+
+    def test_add_over_stock_rolled_back(self):
+        """Тест: приращение сверх остатка откатывается в хеше"""
+        cart_store.add_product(self.cart, self.product, 45)
+
+        with self.assertRaises(ValidationError):
+            cart_store.add_product(self.cart, self.product, 10)
+
+        self.assertEqual(self.hash_items(), {self.product.id: 45})
+
+    def test_flush_round_trip(self):
+        """Тест: сброс пишет хеш в БД и убирает корзину из очереди"""
+        CartItem.objects.create(cart=self.cart, product=self.other, quantity=4)
+        cart_store.add_product(self.cart, self.product, 2)
+        cart_store.add_product(self.cart, self.other, -4)
+
+        self.assertEqual(cart_store.flush(), 1)
+
+        self.assertEqual(self.db_items(), {self.product.id: 2})
+        self.assertFalse(self.is_dirty())
+        self.assertEqual(self.hash_items(), {self.product.id: 2})
+
+    def test_clear(self):
+        """Тест: очистка оставляет пустой загруженный хеш и доходит до БД со сбросом"""
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        cart_store.add_product(self.cart, self.other, 1)
+
+        cart_store.clear(self.cart)
+
+        self.assertTrue(self.client.exists(cart_store._items_key(self.cart.id)))
+        self.assertEqual(self.hash_items(), {})
+        self.assertEqual(cart_store.flush(), 1)
+        self.assertEqual(self.db_items(), {})
+
+    def test_expired_before_flush(self):
+        """Тест: истекший до сброса хеш не затирает БД"""
+        CartItem.objects.create(cart=self.cart, product=self.other, quantity=1)
+        cart_store.add_product(self.cart, self.product, 2)
+        self.client.delete(cart_store._items_key(self.cart.id))
+
+        self.assertEqual(cart_store.flush(), 0)
+
+        self.assertEqual(self.db_items(), {self.other.id: 1})
+        self.assertFalse(self.is_dirty())
+
+    def test_add_during_direct_change(self):
+        """Тест: HINCRBY не проходит, пока корзину меняют в БД в обход хранилища"""
+        cart_store.add_product(self.cart, self.product, 2)
+        keys = [cart_store._items_key(self.cart.id), cart_store._dirty_key(), cart_store._lock_key(self.cart.id)]
+
+        with cart_store.locked(self.cart):
+            # Несохраненное состояние уже в БД
+            self.assertEqual(self.db_items(), {self.product.id: 2})
+            CartItem.objects.filter(cart=self.cart, product=self.product).update(quantity=5)
+            result = cart_store._run(self.client, ADD_SCRIPT, keys, [self.other.id, 1, 60, self.cart.id])
+            self.assertEqual(result, LOCKED)
+
+        self.assertFalse(self.client.exists(cart_store._items_key(self.cart.id)))
+        cart_store.add_product(self.cart, self.other, 1)
+        cart_store.flush()
+        self.assertEqual(self.db_items(), {self.product.id: 5, self.other.id: 1})
+
+    def test_concurrent_add_waits_for_discard(self):
+        """Тест: добавление во время прямого изменения ждет сброса хеша и не теряется"""
+        cart_store.add_product(self.cart, self.product, 1)
+        # Другой запрос держит блокировку и меняет корзину в БД
+        token = cart_store._acquire(self.client, self.cart.id)
+        cart_store._materialize(self.client, self.cart.id)
+        CartItem.objects.filter(cart=self.cart, product=self.product).update(quantity=4)
+        finished = []
+
+        def finish_direct_change(_):
+            if not finished:
+                cart_store._discard(self.client, self.cart.id)
+                cart_store._release(self.client, self.cart.id, token)
+                finished.append(True)
+
+        with patch('shop.cart_store.time.sleep', side_effect=finish_direct_change):
+            self.assertEqual(cart_store.add_product(self.cart, self.product, 2), 6)
+
+        self.assertTrue(finished)
+        self.assertEqual(cart_store.flush(), 1)
+        self.assertEqual(self.db_items(), {self.product.id: 6})
+
+    def test_flush_skips_locked_cart(self):
+        """Тест: сброс не ждет занятую корзину и возвращает ее в очередь"""
+        cart_store.add_product(self.cart, self.product, 2)
+        token = cart_store._acquire(self.client, self.cart.id)
+
+        self.assertEqual(cart_store.flush(), 0)
+
+        self.assertTrue(self.is_dirty())
+        self.assertEqual(self.db_items(), {})
+        cart_store._release(self.client, self.cart.id, token)
+        self.assertEqual(cart_store.flush(), 1)
+        self.assertEqual(self.db_items(), {self.product.id: 2})
+
+    def test_busy_cart_answers_409(self):
+        """Тест: корзина занята дольше CART_LOCK_WAIT — 409 с просьбой повторить, а не 500"""
+        cart_store.add_product(self.cart, self.product, 1)
+        cart_store._acquire(self.client, self.cart.id)
+
+        with patch('shop.cart_store.CART_LOCK_WAIT', 0), self.assertRaises(CartLocked):
+            cart_store.add_product(self.cart, self.product, 1)
+        with patch.object(cart_store, '_acquire', return_value=None), self.assertRaises(CartLocked):
+            with cart_store.locked(self.cart):
+                pass
+
+        response = exception_handler(CartLocked(), {})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.hash_items(), {self.product.id: 1})
+
+    def test_order_under_lock(self):
+        """Тест: оформление заказа пишет корзину из Redis и сбрасывает хеш"""
+        self.cart.add_product(self.product, 2)
+
+        order = self.cart.create_order(
+            shipping_address='Адрес', phone='+380501234567', email='cart@example.com', city='Киев'
+        )
+
+        self.assertEqual(order.order_items.get().quantity, 2)
+        self.assertFalse(self.client.exists(cart_store._items_key(self.cart.id)))
+        self.assertFalse(self.client.exists(cart_store._lock_key(self.cart.id)))
+        self.assertFalse(self.is_dirty())
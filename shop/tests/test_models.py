@@ -2,24 +2,29 @@
 Тесты для моделей приложения shop
 """
 import json
+import pickle
 import time
 from decimal import Decimal
 from unittest.mock import patch, MagicMock
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core import signing
 from django.core.cache import cache
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.permissions import AllowAny
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from ..models import (
     Category, Product, ProductImage, Order, OrderItem, 
-    Cart, CartItem, Payment, PaymentSettings, NovaPoshtaSettings
+    Cart, CartItem, Payment, PaymentSettings, NovaPoshtaSettings, nova_poshta_settings_cache
 )
 from ..serializers import ProductSerializer, OrderSerializer
+from ..views_payments import ActivePaymentMethodsAPIView, PaymentOptionsAPIView
 from ..cache import cache_products_list, get_cached_products_list
 from ..tasks import send_payment_success_email_task, create_nova_poshta_ttn_task
+from ..utils import get_nova_poshta_api_key
 
 User = get_user_model()
 
@@ -33,6 +38,9 @@ class BaseTestCase(TestCase):
         """Настройка перед каждым тестом"""
         # Очищаем кэш
         cache.clear()
+        # Настройки создаются в тестах, а откат транзакции не вызывает сигналов
+        nova_poshta_settings_cache.invalidate()
+        self.addCleanup(nova_poshta_settings_cache.invalidate)
         
         # Создаем тестового пользователя
         self.user = User.objects.create_user(
@@ -358,6 +366,141 @@ class PaymentTests(BaseTestCase):
         self.assertEqual(payment.status, 'paid')
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PaymentSettingsRegistryTests(TestCase):
+    """
+    Тесты кэшированного получения активных настроек платежных систем
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.payment_settings = PaymentSettings(payment_system='stripe', is_active=True)
+        self.payment_settings.secret_key = 'sk_test_123'
+        self.payment_settings.webhook_secret = 'whsec_123'
+        self.payment_settings.save()
+
+    def test_active_settings_cached(self):
+        """Тест: после первого обращения настройки читаются без запросов к БД"""
+        PaymentSettings.get_active('stripe')
+
+        with self.assertNumQueries(0):
+            payment_settings = PaymentSettings.get_active('stripe')
+        self.assertEqual(payment_settings.pk, self.payment_settings.pk)
+        self.assertEqual(payment_settings.secret_key, 'sk_test_123')
+        self.assertEqual(payment_settings.webhook_secret, 'whsec_123')
+
+    def test_missing_settings_cached(self):
+        """Тест: отсутствие активных настроек тоже кэшируется"""
+        self.assertIsNone(PaymentSettings.get_active('fondy'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(PaymentSettings.get_active('fondy'))
+
+    def test_invalidated_on_save(self):
+        """Тест: изменение настроек в админке сразу видно вебхукам"""
+        PaymentSettings.get_active('stripe')
+
+        self.payment_settings.secret_key = 'sk_live_456'
+        self.payment_settings.save()
+        self.assertEqual(PaymentSettings.get_active('stripe').secret_key, 'sk_live_456')
+
+        self.payment_settings.is_active = False
+        self.payment_settings.save()
+        self.assertIsNone(PaymentSettings.get_active('stripe'))
+
+    def test_payment_methods_built_once(self):
+        """Тест: список способов оплаты строится один раз и сбрасывается при сохранении настроек"""
+        resource = PaymentSettings.get_active_methods()
+        self.assertEqual([method['payment_system'] for method in resource['methods']], ['stripe'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(PaymentSettings.get_active_methods(), resource)
+
+        PaymentSettings.objects.create(payment_system='fondy', is_active=True)
+        changed = PaymentSettings.get_active_methods()
+        self.assertEqual(len(changed['methods']), 2)
+        self.assertNotEqual(changed['etag'], resource['etag'])
+
+    def test_payment_methods_views(self):
+        """Тест: старые эндпоинты — проекции общего списка, с 304 по ETag"""
+        factory = APIRequestFactory()
+        view = PaymentOptionsAPIView.as_view(permission_classes=[AllowAny])
+
+        response = view(factory.get('/api/payments/options/'))
+        response.render()
+        self.assertEqual(json.loads(response.content), [{'system': 'stripe', 'name': 'Stripe'}])
+
+        with self.assertNumQueries(0):
+            response = view(factory.get('/api/payments/options/', HTTP_IF_NONE_MATCH=response['ETag']))
+        self.assertEqual(response.status_code, 304)
+
+        response = ActivePaymentMethodsAPIView.as_view(permission_classes=[AllowAny])(
+            factory.get('/api/payment-methods/active/')
+        )
+        self.assertEqual(response.data, [
+            {'payment_system': 'stripe', 'is_active': True, 'is_sandbox': True, 'title': 'Stripe'}
+        ])
+
+    def test_secrets_decrypted_once(self):
+        """Тест: расшифровка секрета выполняется один раз на шифротекст"""
+        payment_settings = PaymentSettings.get_active('stripe')
+        payment_settings.secret_key
+
+        with patch('shop.models.signing.loads') as loads:
+            self.assertEqual(PaymentSettings.get_active('stripe').secret_key, 'sk_test_123')
+        loads.assert_not_called()
+
+
+class PaymentSettingsSecretsTests(TestCase):
+    """
+    Тесты ленивой расшифровки секретов платежных систем
+    """
+
+    def setUp(self):
+        payment_settings = PaymentSettings(payment_system='liqpay', is_active=True)
+        payment_settings.api_key = 'public_1'
+        payment_settings.secret_key = 'private_1'
+        payment_settings.save()
+
+    def test_loading_does_not_decrypt(self):
+        """Тест: загрузка и сохранение настроек без обращения к секретам не расшифровывают их"""
+        with patch('shop.models._unsign_secret') as unsign:
+            payment_settings = PaymentSettings.objects.get(payment_system='liqpay')
+            payment_settings.is_sandbox = False
+            payment_settings.save()
+        unsign.assert_not_called()
+
+    def test_decrypted_once_per_instance(self):
+        """Тест: секрет расшифровывается при первом обращении и запоминается"""
+        payment_settings = PaymentSettings.objects.get(payment_system='liqpay')
+        with patch('shop.models._unsign_secret', return_value='private_1') as unsign:
+            self.assertEqual(payment_settings.secret_key, 'private_1')
+            self.assertEqual(payment_settings.secret_key, 'private_1')
+        unsign.assert_called_once()
+
+    def test_secret_change_and_refresh(self):
+        """Тест: новое значение сохраняется, а после refresh_from_db читается из БД"""
+        payment_settings = PaymentSettings.objects.get(payment_system='liqpay')
+        payment_settings.secret_key
+        payment_settings.secret_key = 'private_2'
+        payment_settings.save()
+
+        other = PaymentSettings.objects.get(pk=payment_settings.pk)
+        self.assertEqual(other.secret_key, 'private_2')
+
+        PaymentSettings.objects.filter(pk=payment_settings.pk).update(_secret_key=signing.dumps('private_3'))
+        payment_settings.refresh_from_db()
+        self.assertEqual(payment_settings.secret_key, 'private_3')
+
+    def test_plaintext_not_pickled(self):
+        """Тест: расшифрованные секреты не сериализуются вместе с объектом"""
+        payment_settings = PaymentSettings.objects.get(payment_system='liqpay')
+        payment_settings.api_key
+
+        data = pickle.dumps(payment_settings)
+        self.assertNotIn(b'public_1', data)
+        self.assertEqual(pickle.loads(data).api_key, 'public_1')
+
+
 class NovaPoshtaTests(BaseTestCase):
     """
     Тесты для Nova Poshta
@@ -382,6 +525,40 @@ class NovaPoshtaTests(BaseTestCase):
         self.skipTest("Nova Poshta API тест отключен")
 
 
+@override_settings(SETTINGS_CACHE_TIMEOUT=60)
+class NovaPoshtaSettingsCacheTests(TestCase):
+    """
+    Копия настроек Новой Почты в памяти процесса
+    """
+
+    def setUp(self):
+        nova_poshta_settings_cache.invalidate()
+        self.addCleanup(nova_poshta_settings_cache.invalidate)
+
+    def test_missing_settings_memoized(self):
+        """Отсутствие настроек тоже запоминается, создание сбрасывает копию"""
+        self.assertIsNone(NovaPoshtaSettings.get_active())
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_nova_poshta_api_key())
+
+        NovaPoshtaSettings.objects.create(api_key='test_key', is_active=True)
+
+        self.assertEqual(get_nova_poshta_api_key(), 'test_key')
+        with self.assertNumQueries(0):
+            self.assertEqual(NovaPoshtaSettings.get_active().api_key, 'test_key')
+
+    def test_deactivation_invalidates(self):
+        """Отключение интеграции видно сразу после сохранения"""
+        nova_settings = NovaPoshtaSettings.objects.create(api_key='test_key', is_active=True)
+        self.assertIsNotNone(NovaPoshtaSettings.get_active())
+
+        nova_settings.is_active = False
+        nova_settings.save()
+
+        self.assertIsNone(NovaPoshtaSettings.get_active())
+        self.assertEqual(get_nova_poshta_api_key(), 'test_key')
+
+
 class PerformanceTests(BaseTestCase):
     """
     Тесты производительности
@@ -408,6 +585,38 @@ class PerformanceTests(BaseTestCase):
         data = serializer.data
         self.assertEqual(len(data), 11)
 
+    def test_products_list_constant_queries(self):
+        """Тест: список товаров сериализуется за постоянное число запросов"""
+        for i in range(10):
+            product = Product.objects.create(
+                name=f'Товар {i}',
+                slug=f'product-{i}',
+                price=Decimal(f'{100 + i}.00'),
+                category=self.category,
+                available=True
+            )
+            ProductImage.objects.create(product=product, image=f'products/{i}-a.jpg')
+            ProductImage.objects.create(product=product, image=f'products/{i}-b.jpg', is_main=True)
+
+        products = Product.objects.filter(available=True).prefetch_related('images')
+
+        # 1 запрос на товары + 1 на prefetch изображений
+        with self.assertNumQueries(2):
+            data = ProductSerializer(products, many=True).data
+
+        self.assertEqual(len(data), 11)
+        product_data = next(item for item in data if item['slug'] == 'product-0')
+        self.assertEqual(product_data['main_image'], '/media/products/0-b.jpg')
+
+    def test_get_main_image_fallback_to_first(self):
+        """Тест: без главного изображения берется первое"""
+        first = ProductImage.objects.create(product=self.product, image='products/first.jpg')
+        ProductImage.objects.create(product=self.product, image='products/second.jpg')
+
+        product = Product.objects.prefetch_related('images').get(pk=self.product.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(product.get_main_image(), first)
+
 
 class SecurityTests(BaseTestCase):
     """
@@ -1,7 +1,12 @@
 """
 Тесты для системы резервации товаров
 """
-from django.test import TestCase
+import time
+from decimal import Decimal
+from unittest.mock import patch
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -9,17 +14,29 @@ from datetime import timedelta
 
 from ..models import (
     Order, Payment, Product, Category, Cart, CartItem, 
-    ReservationSettings, OrderItem
+    ReservationSettings, OrderItem, reservation_settings_cache
 )
 
 User = get_user_model()
 
 
-class ReservationSettingsTests(TestCase):
+class ReservationTestCase(TestCase):
+    """
+    Базовый класс: копия настроек резервации в памяти процесса сбрасывается
+    до и после теста — настройки создаются в тестах, а откат транзакции не вызывает сигналов
+    """
+
+    def setUp(self):
+        reservation_settings_cache.invalidate()
+        self.addCleanup(reservation_settings_cache.invalidate)
+
+
+class ReservationSettingsTests(ReservationTestCase):
     """Тесты модели ReservationSettings"""
     
     def setUp(self):
         """Подготовка тестовых данных"""
+        super().setUp()
         self.user = User.objects.create_user(
             email='test@example.com',
             password='testpass123'
@@ -118,11 +135,54 @@ class ReservationSettingsTests(TestCase):
         self.assertIn("Отключена", str(settings))
 
 
-class OrderReservationTests(TestCase):
+@override_settings(SETTINGS_CACHE_TIMEOUT=60)
+class ReservationSettingsCacheTests(ReservationTestCase):
+    """Тесты копии настроек резервации в памяти процесса"""
+
+    def setUp(self):
+        super().setUp()
+        ReservationSettings.objects.create(reservation_time_minutes=60)
+
+    def test_get_settings_memoized(self):
+        """Повторное получение настроек не обращается к БД"""
+        settings = ReservationSettings.get_settings()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(ReservationSettings.get_settings().pk, settings.pk)
+
+    def test_returns_independent_copies(self):
+        """Изменение полученных настроек не видно другим вызовам (и потокам)"""
+        settings = ReservationSettings.get_settings()
+        settings.reservation_time_minutes = 5
+
+        self.assertEqual(ReservationSettings.get_settings().reservation_time_minutes, 60)
+
+    def test_save_invalidates(self):
+        """Сохранение настроек сбрасывает копию"""
+        settings = ReservationSettings.get_settings()
+        settings.reservation_time_minutes = 15
+        settings.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(ReservationSettings.get_settings().reservation_time_minutes, 15)
+
+    def test_expires_after_timeout(self):
+        """По истечении TTL настройки перечитываются из БД"""
+        ReservationSettings.get_settings()
+        # Изменение в обход сигналов — как из другого процесса
+        ReservationSettings.objects.update(reservation_time_minutes=45)
+
+        self.assertEqual(ReservationSettings.get_settings().reservation_time_minutes, 60)
+        with patch('shop.cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(ReservationSettings.get_settings().reservation_time_minutes, 45)
+
+
+class OrderReservationTests(ReservationTestCase):
     """Тесты резервации заказов"""
     
     def setUp(self):
         """Подготовка тестовых данных"""
+        super().setUp()
         self.user = User.objects.create_user(
             email='test@example.com',
             password='testpass123'
@@ -299,11 +359,12 @@ class OrderReservationTests(TestCase):
         self.assertEqual(order.status, 'cancelled')
 
 
-class CartReservationTests(TestCase):
+class CartReservationTests(ReservationTestCase):
     """Тесты резервации в корзине"""
     
     def setUp(self):
         """Подготовка тестовых данных"""
+        super().setUp()
         self.user = User.objects.create_user(
             email='test@example.com',
             password='testpass123'
@@ -359,6 +420,25 @@ class CartReservationTests(TestCase):
         time_diff = abs((order.reserved_until - expected_time).total_seconds())
         self.assertLess(time_diff, 60)
     
+    def test_create_order_total_without_aggregate(self):
+        """Тест: сумма заказа считается по загруженным позициям, без отдельного агрегата"""
+        second = Product.objects.create(
+            category=self.category, name='Второй товар', slug='second-product', price=Decimal('2.50'), stock=10
+        )
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=second, quantity=3)
+
+        with CaptureQueriesContext(connection) as queries:
+            order = self.cart.create_order(
+                shipping_address='Тестовый адрес',
+                phone='+380501234567',
+                email='test@example.com',
+                city='Киев'
+            )
+
+        self.assertEqual(order.total_price, Decimal('207.50'))
+        self.assertFalse(any('SUM(' in query['sql'] for query in queries.captured_queries))
+
     def test_create_order_with_reservation_disabled(self):
         """Тест создания заказа с отключенной резервацией"""
         # Отключаем резервацию
@@ -431,11 +511,12 @@ class CartReservationTests(TestCase):
         self.assertEqual(self.product.stock, 10)  # Остаток не изменился
 
 
-class ReservationIntegrationTests(TestCase):
+class ReservationIntegrationTests(ReservationTestCase):
     """Интеграционные тесты резервации"""
     
     def setUp(self):
         """Подготовка тестовых данных"""
+        super().setUp()
         self.user = User.objects.create_user(
             email='test@example.com',
             password='testpass123'
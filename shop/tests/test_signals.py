@@ -2,12 +2,16 @@
 Тесты для Django signals
 """
 from decimal import Decimal
+from io import StringIO
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_save, post_delete
 from unittest.mock import patch
 
-from shop.models import Order, OrderItem, Product, Category
+from django.core.management import call_command
+from shop.models import Order, OrderItem, Product, Category, ProductImage
 from shop.signals import update_order_total_on_save, update_order_total_on_delete
 
 User = get_user_model()
@@ -294,4 +298,90 @@ class OrderSignalsTests(TestCase):
             # Попытка изменить элемент должна вызвать исключение
             with self.assertRaises(Exception):
                 order_item.quantity = 3
-                order_item.save()
\ No newline at end of file
+                order_item.save()
+
+
+class ProductDenormalizationSignalsTests(TestCase):
+    """Тесты поддержки денормализованных полей товара"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Электроника', slug='electronics')
+        self.product = Product.objects.create(
+            name='Товар',
+            slug='product',
+            category=self.category,
+            price=Decimal('100.00'),
+            stock=10
+        )
+
+    def test_category_name_set_on_save(self):
+        """Тест заполнения category_name при сохранении товара"""
+        self.assertEqual(self.product.category_name, 'Электроника')
+
+    def test_category_rename_updates_products(self):
+        """Тест обновления category_name при переименовании категории"""
+        self.category.name = 'Гаджеты'
+        self.category.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.category_name, 'Гаджеты')
+
+    def test_category_change_updates_category_name(self):
+        """Тест обновления category_name при смене категории товара"""
+        other = Category.objects.create(name='Гаджеты', slug='gadgets')
+        product = Product.objects.get(pk=self.product.pk)
+        product.category_id = other.pk
+        product.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.category_name, 'Гаджеты')
+
+        product.category = self.category
+        product.save(update_fields=['category'])
+        product.refresh_from_db()
+        self.assertEqual(product.category_name, 'Электроника')
+
+    def test_save_without_category_change_skips_category_query(self):
+        """Тест: сохранение без смены категории не загружает категорию"""
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock = 5
+
+        # full_clean: проверка внешнего ключа категории и уникальности slug; затем UPDATE
+        with CaptureQueriesContext(connection) as queries, self.assertNumQueries(3):
+            product.save()
+
+        self.assertFalse(any('"shop_category"."name"' in query['sql'] for query in queries.captured_queries))
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
+        self.assertEqual(product.category_name, 'Электроника')
+
+    def test_main_image_url_follows_images(self):
+        """Тест обновления main_image_url при сохранении и удалении изображений"""
+        ProductImage.objects.create(product=self.product, image='products/first.jpg')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.main_image_url, '/media/products/first.jpg')
+
+        main = ProductImage.objects.create(product=self.product, image='products/main.jpg', is_main=True)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.main_image_url, '/media/products/main.jpg')
+
+        main.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.main_image_url, '/media/products/first.jpg')
+
+    def test_product_delete_with_images(self):
+        """Тест каскадного удаления товара с изображениями"""
+        ProductImage.objects.create(product=self.product, image='products/first.jpg')
+        self.product.delete()
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_backfill_command(self):
+        """Тест команды заполнения денормализованных полей"""
+        ProductImage.objects.create(product=self.product, image='products/first.jpg', is_main=True)
+        Product.objects.update(category_name='', main_image_url='')
+
+        call_command('backfill_product_fields', stdout=StringIO())
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.category_name, 'Электроника')
+        self.assertEqual(self.product.main_image_url, '/media/products/first.jpg')
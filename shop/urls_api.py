@@ -1,17 +1,22 @@
 from django.urls import path, include
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 from .views import (
     ProductViewSet,
     CategoryViewSet,
     CartView,
+    CartSummaryView,
+    CartCountView,
     CartItemDetailView,
     AddToCartView,
     OrderListCreateAPIView,
     OrderDetailAPIView,
     ClearCartView,
+    GuestCartView,
+    CartMergeTokenObtainPairView,
+    CartBulkView,
     RegisterView,
     CurrentUserView,
     LoginView,
@@ -24,6 +29,7 @@ from .views_payments import CreatePaymentView, PaymentMethodsView, PaymentOption
     ActivePaymentSystemsView, ActivePaymentMethodsAPIView, stripe_webhook, PayPalWebhookView, FondyWebhookView, \
     LiqPayWebhookView, PortmoneWebhookView, StripePublicKeyView, CreateFondyPaymentView, CreatePortmonePaymentView
 
+from .views_metrics import CacheMetricsView
 from . import views
 from .test_cache import test_cache_view, clear_test_cache, cache_stats_view
 
@@ -36,9 +42,13 @@ api_urlpatterns = [
     
     # Корзина пользователя
     path('cart/', CartView.as_view(), name='api-cart'),
+    path('cart/summary/', CartSummaryView.as_view(), name='api-cart-summary'),
+    path('cart/count/', CartCountView.as_view(), name='api-cart-count'),
     path('cart/add/', AddToCartView.as_view(), name='api-cart-add'),
     path('cart/items/<int:item_id>/', CartItemDetailView.as_view(), name='api-cart-item-detail'),
     path('cart/clear/', ClearCartView.as_view(), name='api-cart-clear'),
+    path('cart/bulk/', CartBulkView.as_view(), name='api-cart-bulk'),
+    path('cart/guest/', GuestCartView.as_view(), name='api-cart-guest'),
 
     # Заказы
     path('orders/', OrderListCreateAPIView.as_view(), name='order-list-create'),
@@ -86,12 +96,15 @@ api_urlpatterns = [
     path('np-autocomplete/warehouses/', views.WarehouseAutocomplete.as_view(), name='np_warehouse_autocomplete'),
 
     # Авторизация
-    path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('auth/token/', CartMergeTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('register/', RegisterView.as_view(), name='register'),
     path('user/me/', CurrentUserView.as_view(), name='user_me'),
     path('auth/login/', LoginView.as_view(), name='login'),
     
+    # Метрики кэша для Prometheus
+    path('metrics/cache/', CacheMetricsView.as_view(), name='cache-metrics'),
+
     # Тестовые URL для демонстрации кэширования
     path('test/cache/', test_cache_view, name='test-cache'),
     path('test/cache/clear/', clear_test_cache, name='clear-test-cache'),
@@ -12,11 +12,26 @@ import stripe
 logger = logging.getLogger(__name__)
 
 def get_nova_poshta_api_key():
-    settings = NovaPoshtaSettings.objects.order_by("-updated_at").first()
+    settings = NovaPoshtaSettings.get_settings()
     if settings:
         return settings.api_key
     return None
 
+def fetch_nova_poshta_cities(api_key, search=""):
+    """
+    Города Nova Poshta по строке поиска (ответ API как есть)
+    """
+    payload = {
+        "apiKey": api_key,
+        "modelName": "Address",
+        "calledMethod": "getCities",
+        "methodProperties": {
+            "FindByString": search,
+        }
+    }
+    response = requests.post("https://api.novaposhta.ua/v2.0/json/", json=payload)
+    return response.json()
+
 def send_payment_confirmation_email(order, payment):
     try:
         subject = f"Оплата заказа #{order.id} подтверждена"
@@ -1,3 +1,7 @@
+import json
+import logging
+import time
+from decimal import Decimal
 from dal import autocomplete
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -7,16 +11,20 @@ from django.utils.encoding import force_str, force_bytes
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.views.generic import ListView
 from django.contrib.auth import get_user_model, authenticate
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import Product, Order, NovaPoshtaSettings
 from rest_framework import generics
 from .serializers import ProductSerializer, CategorySerializer, UserSerializer, RegisterSerializer, \
     CurrentUserSerializer, OrderCreateSerializer, DashboardOverviewSerializer, DashboardProfileUpdateSerializer, \
     DashboardOrderListSerializer, DashboardOrderDetailSerializer, SendPasswordResetEmailSerializer, \
     ConfirmPasswordResetSerializer, ChangePasswordSerializer
-from .serializers import CartItemSerializer, AddToCartSerializer
+from .serializers import CartItemSerializer, AddToCartSerializer, CartBulkSerializer
 from .models import Category, Cart, CartItem
 from rest_framework import status, viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from .serializers import OrderSerializer
@@ -26,8 +34,9 @@ from .permissions import IsStaff
 from django.core.exceptions import ValidationError
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
-from .utils import get_nova_poshta_api_key
-from django.http import JsonResponse, HttpRequest
+from .utils import get_nova_poshta_api_key, fetch_nova_poshta_cities
+from django.http import HttpResponse, JsonResponse, HttpRequest
+from rest_framework.renderers import JSONRenderer
 import requests
 from shop.admin_dashboard import admin_site
 
@@ -36,39 +45,232 @@ User = get_user_model()
 
 from .cache import (
     get_cached_products_list, cache_products_list, 
+    get_cached_products_page, cache_products_page,
     get_cached_product_detail, cache_product_detail,
-    invalidate_product_cache
+    get_cached_product_details, cache_product_details,
+    get_catalog_version,
+    get_cached_categories_list, cache_categories_list,
+    get_cached_category_detail, cache_category_detail,
+    get_cached_cart_count, cache_cart_count, incr_cart_count,
+    release_rebuild_locks,
 )
+from .filters import ProductFilterBackend
+from .pagination import ProductCursorPagination
+from .search import search_products
+from .autocomplete import AUTOCOMPLETE_MAX_RESULTS, autocomplete_products
+from .cart_store import cart_store
+from .guest_cart import (
+    GUEST_CART_COOKIE, apply_guest_operations, delete_guest_cart, get_guest_cart, get_guest_cart_token,
+    merge_guest_cart, new_guest_cart_token, set_guest_cart_cookie,
+)
+from .conditional import catalog_condition
+
+logger = logging.getLogger(__name__)
+
+class RenderedJSONMixin:
+    """
+    Кэш хранит уже отрендеренные байты JSON: попадание в кэш отдается
+    как есть, без повторного прохода через JSONRenderer
+    """
+
+    def render_json(self, data):
+        return JSONRenderer().render(data)
+
+    def json_response(self, body):
+        if not isinstance(body, bytes):
+            # Значение, закэшированное до перехода на байты
+            body = self.render_json(body)
+        if not isinstance(self.request.accepted_renderer, JSONRenderer):
+            # Browsable API и другие форматы — обычный путь DRF
+            return Response(json.loads(body))
 
-class ProductViewSet(viewsets.ModelViewSet):
+        response = HttpResponse(body, content_type='application/json')
+        response['Content-Length'] = len(body)
+        return response
+
+
+class ProductViewSet(RenderedJSONMixin, viewsets.ModelViewSet):
     permission_classes = [AllowAny]
     queryset = Product.objects.filter(available=True).prefetch_related('images')
     serializer_class = ProductSerializer
+    # Поля, нужные ProductSerializer: категория и главная картинка денормализованы в Product
+    list_fields = (
+        'id', 'name', 'slug', 'category_name', 'main_image_url',
+        'description', 'price', 'available', 'created', 'updated',
+    )
+    filter_backends = [ProductFilterBackend]
+    pagination_class = ProductCursorPagination
+    search_limit = 20
+    max_search_limit = 100
+    max_bulk_ids = 100
+    listing_params = ProductFilterBackend.query_params + (
+        ProductCursorPagination.cursor_query_param,
+        ProductCursorPagination.page_size_query_param,
+    )
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve', 'search', 'bulk'):
+            # Чтение — одна таблица, без JOIN на категорию
+            queryset = queryset.only(*self.list_fields)
+        return queryset
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({"request": self.request})
         return context
     
+    @catalog_condition(Product)
+    @release_rebuild_locks()
     def list(self, request, *args, **kwargs):
         """
-        Кэшированный список товаров
+        Кэшированный список товаров.
+        С фильтрами или параметрами пагинации — кэш по отдельному ключу на выборку/страницу
         """
+        params = {
+            name: request.query_params[name]
+            for name in self.listing_params
+            if name in request.query_params
+        }
+        # Поколение каталога фиксируем до запроса к БД
+        version = get_catalog_version()
+        if params:
+            return self.list_page(params, version)
+
         # Пытаемся получить из кэша
-        cached_products = get_cached_products_list()
+        cached_products = get_cached_products_list(version)
         if cached_products is not None:
-            return Response(cached_products)
+            return self.json_response(cached_products)
         
         # Если нет в кэше, получаем из БД
+        started = time.monotonic()
         queryset = self.filter_queryset(self.get_queryset())
         serializer = self.get_serializer(queryset, many=True)
-        data = serializer.data
+        body = self.render_json(serializer.data)
         
         # Сохраняем в кэш
-        cache_products_list(data)
+        cache_products_list(body, version=version, compute_time=time.monotonic() - started)
         
-        return Response(data)
+        return self.json_response(body)
     
+    def list_page(self, params, version):
+        """
+        Отфильтрованная выборка или страница курсорной пагинации.
+        Страница кэшируется как курсоры + результаты, ссылки next/previous
+        собираются заново для каждого запроса (хост и схема у запросов разные)
+        """
+        cached_page = get_cached_products_page(params, version)
+        if isinstance(cached_page, dict):
+            return self.json_response(self.paginator.render_cached_page(self.request, cached_page))
+        if cached_page is not None:
+            return self.json_response(cached_page)
+
+        started = time.monotonic()
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            data = {**self.paginator.get_cursor_tokens(), 'results': self.render_json(serializer.data).decode()}
+            cache_products_page(params, data, version=version, compute_time=time.monotonic() - started)
+            return self.json_response(self.paginator.render_cached_page(self.request, data))
+
+        body = self.render_json(self.get_serializer(queryset, many=True).data)
+        cache_products_page(params, body, version=version, compute_time=time.monotonic() - started)
+
+        return self.json_response(body)
+
+    @action(detail=False, methods=['get'])
+    @catalog_condition(Product)
+    def search(self, request):
+        """
+        Полнотекстовый поиск товаров, результаты по убыванию релевантности
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Параметр q обязателен'}, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = self.get_limit(request, self.search_limit, self.max_search_limit)
+        if limit is None:
+            return Response(
+                {'error': f'limit должен быть числом от 1 до {self.max_search_limit}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = search_products(self.filter_queryset(self.get_queryset()), query)[:limit]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    @catalog_condition(Product)
+    def autocomplete(self, request):
+        """
+        Подсказки названий товаров при вводе (большинство запросов не доходит до БД)
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response([])
+
+        limit = self.get_limit(request, AUTOCOMPLETE_MAX_RESULTS, AUTOCOMPLETE_MAX_RESULTS)
+        if limit is None:
+            return Response(
+                {'error': f'limit должен быть числом от 1 до {AUTOCOMPLETE_MAX_RESULTS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(autocomplete_products(Product.objects.filter(available=True), query, limit))
+
+    @action(detail=False, methods=['get'])
+    @catalog_condition(Product)
+    def bulk(self, request):
+        """
+        Несколько карточек товаров за один запрос: ?ids=1,2,3 (корзина, заказ, рекомендации)
+        """
+        try:
+            product_ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk.strip()]
+        except ValueError:
+            return Response({'error': 'ids должен быть списком чисел через запятую'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= len(product_ids) <= self.max_bulk_ids:
+            return Response(
+                {'error': f'ids должен содержать от 1 до {self.max_bulk_ids} товаров'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        details = self.get_product_details(product_ids)
+        # Карточки уже отрендерены — склеиваем в JSON-массив без повторного рендеринга
+        bodies = [details[pk] for pk in dict.fromkeys(product_ids) if pk in details]
+        return self.json_response(b'[' + b','.join(bodies) + b']')
+
+    def get_product_details(self, product_ids):
+        """
+        Отрендеренные карточки товаров {id: байты JSON}: кэш одним get_many,
+        промахи — одним запросом id__in и одним проходом сериализатора
+        """
+        details = get_cached_product_details(product_ids)
+        missing = [pk for pk in product_ids if pk not in details]
+        if not missing:
+            return details
+
+        started = time.monotonic()
+        products = self.get_queryset().filter(pk__in=missing)
+        serializer = self.get_serializer(products, many=True)
+        rendered = {item['id']: self.render_json(item) for item in serializer.data}
+
+        cache_product_details(rendered, compute_time=time.monotonic() - started)
+        details.update(rendered)
+        return details
+
+    def get_limit(self, request, default, maximum):
+        """
+        Параметр limit из запроса (не больше maximum) или None, если он некорректен
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', default)), maximum)
+        except ValueError:
+            return None
+        return limit if limit >= 1 else None
+
+    @catalog_condition(Product)
+    @release_rebuild_locks()
     def retrieve(self, request, *args, **kwargs):
         """
         Кэшированная детальная информация о товаре
@@ -78,41 +280,18 @@ class ProductViewSet(viewsets.ModelViewSet):
         # Пытаемся получить из кэша
         cached_product = get_cached_product_detail(product_id)
         if cached_product is not None:
-            return Response(cached_product)
+            return self.json_response(cached_product)
         
         # Если нет в кэше, получаем из БД
+        started = time.monotonic()
         instance = self.get_object()
         serializer = self.get_serializer(instance)
-        data = serializer.data
+        body = self.render_json(serializer.data)
         
         # Сохраняем в кэш
-        cache_product_detail(product_id, data)
-        
-        return Response(data)
-    
-    def update(self, request, *args, **kwargs):
-        """
-        Обновление товара с инвалидацией кэша
-        """
-        response = super().update(request, *args, **kwargs)
-        
-        # Инвалидируем кэш товара
-        product_id = kwargs.get('pk')
-        invalidate_product_cache(product_id)
-        
-        return response
-    
-    def destroy(self, request, *args, **kwargs):
-        """
-        Удаление товара с инвалидацией кэша
-        """
-        product_id = kwargs.get('pk')
-        response = super().destroy(request, *args, **kwargs)
-        
-        # Инвалидируем кэш товара
-        invalidate_product_cache(product_id)
+        cache_product_detail(product_id, body, compute_time=time.monotonic() - started)
         
-        return response
+        return self.json_response(body)
 
 
 class CategoryListView(generics.ListAPIView):
@@ -125,11 +304,44 @@ class CategoryDetailView(generics.RetrieveAPIView):
     serializer_class = CategorySerializer
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(RenderedJSONMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     lookup_field = 'slug'
 
+    @catalog_condition(Category)
+    @release_rebuild_locks()
+    def list(self, request, *args, **kwargs):
+        """
+        Кэшированный список категорий
+        """
+        cached_categories = get_cached_categories_list()
+        if cached_categories is not None:
+            return self.json_response(cached_categories)
+
+        serializer = self.get_serializer(self.filter_queryset(self.get_queryset()), many=True)
+        body = self.render_json(serializer.data)
+        cache_categories_list(body)
+
+        return self.json_response(body)
+
+    @catalog_condition(Category)
+    @release_rebuild_locks()
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Кэшированная категория
+        """
+        slug = kwargs.get(self.lookup_field)
+        cached_category = get_cached_category_detail(slug)
+        if cached_category is not None:
+            return self.json_response(cached_category)
+
+        instance = self.get_object()
+        body = self.render_json(self.get_serializer(instance).data)
+        cache_category_detail(instance.pk, slug, body)
+
+        return self.json_response(body)
+
 
 def statistics_view(request: HttpRequest):
     return admin_site.statistics_view(request)
@@ -273,19 +485,43 @@ class CartView(APIView):
     def get(self, request):
         """Получение содержимого корзины (для API и HTML)"""
         cart, _ = Cart.objects.get_or_create(user=request.user)
-        cart_items = cart.items.select_related('product').all()
-        total_price = sum(item.total_price for item in cart_items)
+        cart_store.materialize(cart)
+        cart_items = cart.items.select_related('product').prefetch_related('product__images')
+        summary = cart.summary()
 
         if request.accepted_renderer.format == 'html':
             return render(request, 'admin/cart.html', {
                 'cart_items': cart_items,
-                'total_price': total_price
+                'total_price': summary['total_price']
             })
 
         serializer = CartItemSerializer(cart_items, many=True, context={'request': request})
         return Response({
             'items': serializer.data,
-            'total_price': total_price
+            'total_price': summary['total_price'],
+            'items_count': summary['items_count']
+        })
+
+
+class CartSummaryView(APIView):
+    """
+    Сумма и количество товаров в корзине одним запросом, без списка позиций
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        cart = Cart.objects.with_totals().filter(user=request.user).first()
+        if cart is None:
+            return Response({'total_price': Decimal('0.00'), 'items_count': 0, 'lines_count': 0})
+
+        # Корзина менялась в Redis — пересчитываем после записи в БД
+        if cart_store.materialize(cart):
+            return Response(cart.summary())
+
+        return Response({
+            'total_price': cart.annotated_total_price,
+            'items_count': cart.annotated_items_count,
+            'lines_count': cart.annotated_lines_count
         })
 
 
@@ -309,8 +545,6 @@ class CartItemDetailView(APIView):
 
     def patch(self, request, item_id):
         cart = get_object_or_404(Cart, user=request.user)
-        item = get_object_or_404(CartItem, id=item_id, cart=cart)
-
         quantity = request.data.get('quantity')
         if quantity is None:
             return Response({'error': 'Поле quantity обязательно'}, status=status.HTTP_400_BAD_REQUEST)
@@ -322,17 +556,131 @@ class CartItemDetailView(APIView):
         except ValueError:
             return Response({'error': 'Количество должно быть числом от 1 до 100'}, status=status.HTTP_400_BAD_REQUEST)
 
-        item.quantity = quantity
-        item.save()
+        # Позиция меняется в БД — корзина в Redis записывается до и сбрасывается после
+        with cart_store.locked(cart):
+            item = get_object_or_404(CartItem, id=item_id, cart=cart)
+            delta = quantity - item.quantity
+            item.quantity = quantity
+            item.save()
+        incr_cart_count(request.user.id, delta)
         return Response({'message': 'Количество обновлено'})
 
     def delete(self, request, item_id):
         cart = get_object_or_404(Cart, user=request.user)
-        item = get_object_or_404(CartItem, id=item_id, cart=cart)
-        item.delete()
+        with cart_store.locked(cart):
+            item = get_object_or_404(CartItem, id=item_id, cart=cart)
+            item.delete()
+        incr_cart_count(request.user.id, -item.quantity)
         return Response({'message': 'Товар удалён из корзины'}, status=status.HTTP_204_NO_CONTENT)
 
 
+class CartCountView(APIView):
+    """
+    Количество товаров для значка корзины. Счетчик в кэше меняется при изменении
+    корзины; пользователь берется из токена без запроса к БД
+    """
+    authentication_classes = [JWTStatelessUserAuthentication]
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        if not request.user.is_authenticated:
+            return Response({'count': sum(get_guest_cart(get_guest_cart_token(request)).values())})
+
+        user_id = request.user.id
+        count = get_cached_cart_count(user_id)
+        if count is None:
+            cart = Cart.objects.filter(user_id=user_id).first()
+            if cart is not None:
+                cart_store.materialize(cart)
+            count = cart.items_count if cart is not None else 0
+            cache_cart_count(user_id, count)
+        return Response({'count': count})
+
+
+class CartBulkView(APIView):
+    """
+    Пакетное изменение корзины: добавление, изменение количества и удаление
+    товаров одним запросом и одной транзакцией
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = CartBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        cart, _ = Cart.objects.get_or_create(user=request.user)
+        try:
+            cart.apply_operations(serializer.validated_data['operations'])
+        except ValidationError as e:
+            return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'message': 'Корзина обновлена', **cart.summary()})
+
+
+class GuestCartView(APIView):
+    """
+    Корзина гостя в кэше по подписанной cookie: GET — содержимое,
+    POST — пакет операций (как /cart/bulk/), DELETE — очистка.
+    При входе переносится в корзину пользователя
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        items = get_guest_cart(get_guest_cart_token(request))
+        products = Product.objects.filter(id__in=items, available=True).prefetch_related('images')
+        cart_items = [CartItem(product=product, quantity=items[product.id]) for product in products]
+
+        serializer = CartItemSerializer(cart_items, many=True, context={'request': request})
+        return Response({
+            'items': serializer.data,
+            'total_price': sum((item.total_price for item in cart_items), Decimal('0.00')),
+            'items_count': sum(item.quantity for item in cart_items)
+        })
+
+    def post(self, request):
+        serializer = CartBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        token = get_guest_cart_token(request)
+        is_new = token is None
+        if is_new:
+            token = new_guest_cart_token()
+
+        try:
+            items = apply_guest_operations(token, serializer.validated_data['operations'])
+        except ValidationError as e:
+            return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = Response({
+            'message': 'Корзина обновлена',
+            'items_count': sum(items.values()),
+            'lines_count': len(items)
+        })
+        if is_new:
+            set_guest_cart_cookie(response, token)
+        return response
+
+    def delete(self, request):
+        token = get_guest_cart_token(request)
+        if token:
+            delete_guest_cart(token)
+        response = Response({'message': 'Корзина очищена'})
+        response.delete_cookie(GUEST_CART_COOKIE)
+        return response
+
+
+def merge_guest_cart_on_login(request, response, user):
+    """
+    Перенос корзины гостя при входе; ошибка переноса не мешает входу
+    """
+    try:
+        if merge_guest_cart(request, user):
+            response.delete_cookie(GUEST_CART_COOKIE)
+    except Exception as e:
+        logger.error(f"Error merging guest cart for user {user.email}: {e}", exc_info=True)
+    return response
+
+
 class ClearCartView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -366,28 +714,42 @@ class LoginView(APIView):
         user = authenticate(request, email=email, password=password)
         if user is not None:
             refresh = RefreshToken.for_user(user)
-            return Response({
+            return merge_guest_cart_on_login(request, Response({
                 'user': UserSerializer(user).data,
                 'refresh': str(refresh),
                 'access': str(refresh.access_token),
-            })
+            }), user)
         else:
             return Response({'detail': 'Неверный email или пароль'}, status=status.HTTP_401_UNAUTHORIZED)
 
 
 
+class CartMergeTokenObtainPairView(TokenObtainPairView):
+    """
+    Получение JWT с переносом корзины гостя в корзину пользователя
+    """
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        return merge_guest_cart_on_login(request, Response(serializer.validated_data), serializer.user)
+
+
 def is_nova_poshta_enabled():
-    return NovaPoshtaSettings.objects.filter(is_active=True).exists()
+    return NovaPoshtaSettings.get_active() is not None
 
 def create_ttn(order, settings=None):
     from .models import NovaPoshtaSettings
 
     # Получаем настройки только если они не переданы
     if not settings:
-        active_settings = NovaPoshtaSettings.objects.filter(is_active=True)
-        if active_settings.count() != 1:
+        settings = NovaPoshtaSettings.get_active()
+        if not settings:
             return {"success": False, "message": "Nova Poshta не настроена"}
-        settings = active_settings.get()
 
     # Если у заказа уже есть ТТН, не дублируем
     if order.nova_poshta_data and order.nova_poshta_data.get("ttn"):
@@ -467,16 +829,7 @@ def get_cities(request):
         return JsonResponse(cached_cities)
     
     # Если нет в кэше, делаем запрос к API
-    payload = {
-        "apiKey": api_key,
-        "modelName": "Address",
-        "calledMethod": "getCities",
-        "methodProperties": {
-            "FindByString": search,
-        }
-    }
-    response = requests.post("https://api.novaposhta.ua/v2.0/json/", json=payload)
-    data = response.json()
+    data = fetch_nova_poshta_cities(api_key, search)
     
     # Сохраняем в кэш
     cache_nova_poshta_cities(search, data)
@@ -0,0 +1,21 @@
+from django.http import HttpResponse
+from rest_framework.views import APIView
+
+from .cache_metrics import collect_cache_metrics, render_prometheus_metrics
+from .permissions import HasMetricsToken, IsStaff
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class CacheMetricsView(APIView):
+    """
+    Метрики кэша по семействам ключей в формате Prometheus.
+    Доступ: сотрудники или сборщик с X-Metrics-Token
+    """
+    permission_classes = [HasMetricsToken | IsStaff]
+    # Сборщик опрашивает каждые несколько секунд — общий лимит запросов не применяем
+    throttle_classes = []
+
+    def get(self, request):
+        metrics = collect_cache_metrics()
+        return HttpResponse(render_prometheus_metrics(metrics['families']), content_type=PROMETHEUS_CONTENT_TYPE)
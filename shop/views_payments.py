@@ -13,8 +13,9 @@ from rest_framework.response import Response
 from .clients import StripeClient, PayPalClient, FondyClient, LiqPayClient, PortmoneClient
 from .models import PaymentSettings, Payment, Order
 from .permissions import IsAdminOrUser
+from .conditional import payment_methods_condition
 import logging
-from .serializers import PaymentSettingsSerializer, PaymentMethodSerializer, PaymentDetailSerializer
+from .serializers import PaymentDetailSerializer
 from .utils import send_payment_confirmation_email
 
 logger = logging.getLogger(__name__)
@@ -55,15 +56,11 @@ class CreatePaymentView(APIView):
                 return Response({'error': 'Заказ уже оплачен'}, status=400)
 
             # Получаем настройки платежной системы
-            try:
-                payment_settings = PaymentSettings.objects.get(
-                    payment_system=payment_system, 
-                    is_active=True
-                )
-                logger.info(f"CreatePaymentView: Found active {payment_system} settings")
-            except PaymentSettings.DoesNotExist:
+            payment_settings = PaymentSettings.get_active(payment_system)
+            if payment_settings is None:
                 logger.error(f"CreatePaymentView: No active {payment_system} settings found")
                 return Response({'error': 'Платежная система неактивна или не настроена'}, status=400)
+            logger.info(f"CreatePaymentView: Found active {payment_system} settings")
 
             # Создаем платеж в зависимости от системы
             if payment_system == 'stripe':
@@ -212,51 +209,56 @@ class PaymentDetailView(RetrieveAPIView):
     def get_queryset(self):
         return super().get_queryset().filter(user=self.request.user)
 
-#для админки
-class PaymentMethodsView(APIView):
+class CachedPaymentMethodsView(APIView):
+    """
+    Активные способы оплаты из одного кэшированного списка (PaymentSettings.get_active_methods)
+    с поддержкой ETag. Наследники задают только вид одного способа в ответе
+    """
+
+    def project(self, method):
+        return method
+
+    @payment_methods_condition()
     def get(self, request):
-        # Получаем все активные платёжные системы
-        methods = PaymentSettings.objects.filter(is_active=True)
-        data = []
-
-        for method in methods:
-            data.append({
-                "id": method.id,
-                "name": method.get_payment_system_display(),  # Получаем красивое имя
-                "system": method.payment_system,  # Например: stripe, fondy и т.д.
-                "sandbox": method.sandbox,  # true / false
-            })
+        return Response([self.project(method) for method in PaymentSettings.get_active_methods()['methods']])
+
 
-        return Response(data)
+#для админки
+class PaymentMethodsView(CachedPaymentMethodsView):
+    def project(self, method):
+        return {
+            "id": method['id'],
+            "name": method['name'],  # Получаем красивое имя
+            "system": method['payment_system'],  # Например: stripe, fondy и т.д.
+            "sandbox": method['is_sandbox'],  # true / false
+        }
 
 #для фронта
-class PaymentOptionsAPIView(APIView):
-    def get(self, request):
-        active_systems = PaymentSettings.objects.filter(is_active=True)
-        options = [
-            {
-                "system": s.payment_system,
-                "name": s.get_payment_system_display()
-            }
-            for s in active_systems
-        ]
-        return Response(options)
-
-
-class ActivePaymentSystemsView(APIView):
+class PaymentOptionsAPIView(CachedPaymentMethodsView):
+    def project(self, method):
+        return {
+            "system": method['payment_system'],
+            "name": method['name']
+        }
+
+
+class ActivePaymentSystemsView(CachedPaymentMethodsView):
     permission_classes = [IsAuthenticated]
 
-    def get(self, request):
-        active = PaymentSettings.objects.filter(is_active=True)
-        serializer = PaymentSettingsSerializer(active, many=True)
-        return Response(serializer.data)
+    def project(self, method):
+        # Поля PaymentSettingsSerializer
+        return {'payment_system': method['payment_system'], 'is_active': method['is_active']}
 
 
-class ActivePaymentMethodsAPIView(APIView):
-    def get(self, request):
-        active_settings = PaymentSettings.objects.filter(is_active=True)
-        serializer = PaymentMethodSerializer(active_settings, many=True)
-        return Response(serializer.data)
+class ActivePaymentMethodsAPIView(CachedPaymentMethodsView):
+    def project(self, method):
+        # Поля PaymentMethodSerializer
+        return {
+            'payment_system': method['payment_system'],
+            'is_active': method['is_active'],
+            'is_sandbox': method['is_sandbox'],
+            'title': method['name'],
+        }
 
 
 
@@ -376,10 +378,7 @@ def stripe_webhook(request):
     
     try:
         # Получаем настройки Stripe
-        payment_settings = PaymentSettings.objects.filter(
-            payment_system='stripe', 
-            is_active=True
-        ).first()
+        payment_settings = PaymentSettings.get_active('stripe')
         
         if not payment_settings:
             logger.error("Stripe webhook: No active Stripe settings found")
@@ -449,7 +448,7 @@ class StripePublicKeyView(APIView):
     renderer_classes = [JSONRenderer]
 
     def get(self, request):
-        payment_settings = PaymentSettings.objects.filter(payment_system='stripe', is_active=True).first()
+        payment_settings = PaymentSettings.get_active('stripe')
         if not payment_settings:
             return Response({"publicKey": None}, status=404)
 
@@ -465,10 +464,7 @@ class PayPalWebhookView(APIView):
     def post(self, request, *args, **kwargs):
         try:
             # Получаем настройки PayPal
-            payment_settings = PaymentSettings.objects.filter(
-                payment_system='paypal', 
-                is_active=True
-            ).first()
+            payment_settings = PaymentSettings.get_active('paypal')
             
             if not payment_settings:
                 logger.error("PayPal webhook: No active PayPal settings found")
@@ -523,7 +519,7 @@ class CreateFondyPaymentView(APIView):
             order_id = request.data.get('order_id')
             order = Order.objects.get(id=order_id, user=request.user)
 
-            cfg = PaymentSettings.objects.filter(payment_system='fondy', is_active=True).first()
+            cfg = PaymentSettings.get_active('fondy')
             if not cfg:
                 return Response({'error': 'Fondy settings not found'}, status=400)
 
@@ -566,10 +562,7 @@ class FondyWebhookView(APIView):
                 return JsonResponse({'error': 'Invalid data format'}, status=400)
 
             # Получаем настройки Fondy
-            cfg = PaymentSettings.objects.filter(
-                payment_system='fondy', 
-                is_active=True
-            ).first()
+            cfg = PaymentSettings.get_active('fondy')
             
             if not cfg:
                 logger.error("Fondy webhook: No active Fondy settings found")
@@ -624,10 +617,7 @@ class LiqPayWebhookView(APIView):
                 return Response({'error': 'Missing data or signature'}, status=400)
 
             # Получаем настройки LiqPay
-            payment_settings = PaymentSettings.objects.filter(
-                payment_system='liqpay', 
-                is_active=True
-            ).first()
+            payment_settings = PaymentSettings.get_active('liqpay')
             
             if not payment_settings:
                 logger.error("LiqPay webhook: No active LiqPay settings found")
@@ -685,10 +675,7 @@ class PortmoneWebhookView(APIView):
             data = request.data
             
             # Получаем настройки Portmone
-            payment_settings = PaymentSettings.objects.filter(
-                payment_system='portmone', 
-                is_active=True
-            ).first()
+            payment_settings = PaymentSettings.get_active('portmone')
             
             if not payment_settings:
                 logger.error("Portmone webhook: No active Portmone settings found")
@@ -738,7 +725,7 @@ class CreatePortmonePaymentView(APIView):
         order_id = request.data.get("order_id")
         order = get_object_or_404(Order, id=order_id, user=request.user)
 
-        config = PaymentSettings.objects.filter(payment_system="portmone", is_active=True).first()
+        config = PaymentSettings.get_active("portmone")
         if not config:
             return Response({"error": "Portmone is not configured"}, status=400)
 
@@ -0,0 +1,150 @@
+"""
+Прогрев кэша после деплоя или очистки Redis
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from .cache import (
+    CACHE_KEYS, cache_categories_list, cache_nova_poshta_cities, cache_product_details,
+    cache_products_list, get_cached_nova_poshta_cities, get_catalog_version, get_missing_keys,
+    products_list_key,
+)
+from .models import Category
+from .serializers import CategorySerializer, ProductSerializer
+from .utils import fetch_nova_poshta_cities, get_nova_poshta_api_key
+
+logger = logging.getLogger(__name__)
+
+WARMUP_BATCH_SIZE = 200
+WARMUP_WORKERS = 4
+
+
+def _build_request():
+    """
+    Запрос для контекста сериализатора: абсолютные URL картинок как в ответах API
+    """
+    site_url = urlparse(getattr(settings, 'SITE_URL', 'http://localhost'))
+    return RequestFactory().get('/', secure=site_url.scheme == 'https', HTTP_HOST=site_url.netloc)
+
+
+def _render(data):
+    return JSONRenderer().render(data)
+
+
+def _product_queryset():
+    from .views import ProductViewSet
+
+    return ProductViewSet.queryset.only(*ProductViewSet.list_fields)
+
+
+def warm_products_list(request, force=False):
+    """
+    Полный список товаров для текущего поколения каталога
+    """
+    # Поколение фиксируем до запроса к БД, как и ProductViewSet.list
+    version = get_catalog_version()
+    if not force and not get_missing_keys([products_list_key(version)]):
+        return 0
+
+    data = ProductSerializer(_product_queryset(), many=True, context={'request': request}).data
+    cache_products_list(_render(data), version=version)
+    return 1
+
+
+def _missing_product_ids(product_ids):
+    keys = {CACHE_KEYS['product_detail'].format(id=pk): pk for pk in product_ids}
+    return [keys[key] for key in get_missing_keys(list(keys))]
+
+
+def _warm_products_batch(product_ids, request):
+    try:
+        products = _product_queryset().filter(pk__in=product_ids)
+        data = ProductSerializer(products, many=True, context={'request': request}).data
+        cache_product_details({item['id']: _render(item) for item in data})
+        return len(product_ids)
+    finally:
+        # Поток не из пула запросов — соединение с БД закрываем сами
+        connection.close()
+
+
+def warm_product_details(request, force=False, batch_size=WARMUP_BATCH_SIZE, workers=WARMUP_WORKERS, progress=None):
+    """
+    Карточки товаров: пачками по batch_size в workers потоков.
+    Без force пересобираются только отсутствующие в кэше карточки
+    """
+    product_ids = list(_product_queryset().order_by('pk').values_list('pk', flat=True))
+    batches = [product_ids[i:i + batch_size] for i in range(0, len(product_ids), batch_size)]
+    if not force:
+        batches = [batch for batch in map(_missing_product_ids, batches) if batch]
+
+    total = sum(len(batch) for batch in batches)
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for count in executor.map(lambda batch: _warm_products_batch(batch, request), batches):
+            done += count
+            if progress:
+                progress('product_details', done, total)
+    return done
+
+
+def warm_categories_list(request, force=False):
+    """
+    Список категорий
+    """
+    if not force and not get_missing_keys([CACHE_KEYS['categories']]):
+        return 0
+
+    data = CategorySerializer(Category.objects.all(), many=True, context={'request': request}).data
+    cache_categories_list(_render(data))
+    return 1
+
+
+def warm_nova_poshta_cities(searches=('',), force=False):
+    """
+    Города Nova Poshta для популярных строк поиска (по умолчанию — пустой поиск)
+    """
+    api_key = get_nova_poshta_api_key()
+    if not api_key:
+        logger.warning("Nova Poshta API key is not configured, skipping cities warm-up")
+        return 0
+
+    warmed = 0
+    for search in searches:
+        if not force and get_cached_nova_poshta_cities(search) is not None:
+            continue
+        cache_nova_poshta_cities(search, fetch_nova_poshta_cities(api_key, search))
+        warmed += 1
+    return warmed
+
+
+def warm_cache(force=False, batch_size=WARMUP_BATCH_SIZE, workers=WARMUP_WORKERS,
+               nova_poshta_searches=('',), progress=None):
+    """
+    Прогрев основных ключей кэша. Безопасно при живом трафике: ключи пишутся
+    теми же функциями, что и в API, а без force заполняются только пустые
+    """
+    request = _build_request()
+    stats = {}
+
+    stats['products_list'] = warm_products_list(request, force)
+    if progress:
+        progress('products_list', stats['products_list'], 1)
+
+    stats['product_details'] = warm_product_details(request, force, batch_size, workers, progress)
+
+    stats['categories_list'] = warm_categories_list(request, force)
+    if progress:
+        progress('categories_list', stats['categories_list'], 1)
+
+    stats['nova_poshta_cities'] = warm_nova_poshta_cities(nova_poshta_searches, force)
+    if progress:
+        progress('nova_poshta_cities', stats['nova_poshta_cities'], len(nova_poshta_searches))
+
+    logger.info(f"Cache warm-up finished: {stats}")
+    return stats
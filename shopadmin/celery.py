@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_ready
 
 # Устанавливаем переменную окружения для настроек Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shopadmin.settings')
@@ -21,8 +22,18 @@ app.conf.beat_schedule = {
         'task': 'shop.tasks.cleanup_unpaid_orders_task',
         'schedule': 300.0,  # каждые 5 минут
     },
+    'flush-cart-store': {
+        'task': 'shop.tasks.flush_cart_store_task',
+        'schedule': 60.0,  # каждую минуту
+    },
 }
 
+
+@worker_ready.connect
+def prewarm_cache(sender, **kwargs):
+    # После деплоя воркеры перезапускаются — прогреваем кэш до первых посетителей
+    app.send_task('shop.tasks.warm_cache_task')
+
 #retry 
 app.conf.task_acks_late = True
 app.conf.task_reject_on_worker_lost = True
@@ -157,6 +157,7 @@ INSTALLED_APPS = [
     "rest_framework.authtoken",
     "shop.apps.ShopConfig",
     "django.contrib.humanize",
+    "django.contrib.postgres",
     "corsheaders",
     "dal",
     "dal_select2",